@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import math
+import time
+
+
+def fetch_queue_stats(conn, agente: int, window_seconds: int):
+    """
+    Read the queue depth and the recent service rate of an agent.
+
+    Args:
+        conn: Open pyodbc connection.
+        agente (int): Agent ID (id_agente) whose queue is measured.
+        window_seconds (int): Window, in seconds, used to measure completed tasks.
+
+    Returns:
+        dict: pendentes, processando, concluidas (in the window) and duracao_media (seconds, or None).
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT
+            SUM(CASE WHEN status = 102 THEN 1 ELSE 0 END),
+            SUM(CASE WHEN status = 202 THEN 1 ELSE 0 END)
+        FROM IA.dbo.fila_processamento_agentes
+        WHERE id_agente = ? AND status IN (102, 202)
+        """,
+        agente
+    )
+    pendentes, processando = cursor.fetchone()
+    cursor.execute(
+        """
+        SELECT COUNT(*), AVG(CAST(DATEDIFF(millisecond, data_inicio_processamento, data_fim_processamento) AS FLOAT))
+        FROM IA.dbo.fila_processamento_agentes
+        WHERE id_agente = ? AND status = 200
+          AND data_fim_processamento >= DATEADD(second, -?, GETDATE())
+        """,
+        agente, window_seconds
+    )
+    concluidas, duracao_media_ms = cursor.fetchone()
+    cursor.close()
+    return {
+        "pendentes": pendentes or 0,
+        "processando": processando or 0,
+        "concluidas": concluidas or 0,
+        "duracao_media": duracao_media_ms / 1000.0 if duracao_media_ms is not None else None,
+    }
+
+
+class AdmissionController:
+    """
+    Admission control for the RAG queue.
+
+    A background task refreshes the queue depth and the number of tasks
+    completed in a recent window every `refresh_interval` seconds, so the
+    decision on each request costs no database round trip. The estimated
+    completion time of a new task is the backlog ahead of it divided by the
+    observed service rate, plus the mean processing time. Requests whose
+    estimate exceeds `max_wait` are refused with a Retry-After hint.
+
+    If the statistics cannot be read (or are stale), requests are admitted
+    without an estimate (fail open).
+    """
+
+    def __init__(self, db_executor, agente=101, max_wait=900.0, refresh_interval=5.0, window=600, default_service_seconds=60.0):
+        self.db_executor = db_executor
+        self.agente = agente
+        self.max_wait = max_wait
+        self.refresh_interval = refresh_interval
+        self.window = window
+        self.default_service_seconds = default_service_seconds
+        self.stats = None
+        self.updated_at = None
+        # Tarefas aceitas por esta instância desde a última leitura da fila
+        self._admitted = 0
+        self._task = None
+
+    async def refresh(self):
+        self.stats = await self.db_executor.run(fetch_queue_stats, self.agente, self.window)
+        self.updated_at = time.monotonic()
+        self._admitted = 0
+
+    def service_rate(self):
+        """Tasks completed per second over the window, or None if nothing finished recently."""
+        if not self.stats or not self.stats["concluidas"]:
+            return None
+        return self.stats["concluidas"] / float(self.window)
+
+    def estimate(self, n=1):
+        """
+        Estimated seconds until the last of `n` new tasks is finished, or None without statistics.
+        """
+        if self.stats is None or time.monotonic() - self.updated_at > 6 * self.refresh_interval:
+            # Sem leitura recente da fila: não há base para estimar
+            return None
+        duracao = self.stats["duracao_media"] or self.default_service_seconds
+        rate = self.service_rate() or 1.0 / self.default_service_seconds
+        ahead = self.stats["pendentes"] + self._admitted + n - 1
+        return ahead / rate + duracao
+
+    def admit(self, n=1):
+        """
+        Decide whether `n` new tasks can be enqueued.
+
+        Returns:
+            tuple: (accepted, estimated_seconds, retry_after_seconds). estimated_seconds
+            is None when no statistics are available; retry_after_seconds is None when accepted.
+        """
+        estimated = self.estimate(n)
+        if estimated is not None and self.max_wait > 0 and estimated > self.max_wait:
+            retry_after = max(1, math.ceil(estimated - self.max_wait))
+            return False, estimated, min(retry_after, 3600)
+        self._admitted += n
+        return True, estimated, None
+
+    async def run(self):
+        """Background loop refreshing the queue statistics."""
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Error reading queue statistics: {e}")
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
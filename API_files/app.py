@@ -1,7 +1,9 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks, status
-from pydantic import BaseModel
-from typing import Dict, Any
+from fastapi import FastAPI, HTTPException, BackgroundTasks, status, Header, Request, Response
+from fastapi.responses import StreamingResponse, ORJSONResponse
+from pydantic import BaseModel, ConfigDict
+from typing import Dict, Any, Optional
 import uuid
+import secrets
 from datetime import datetime, timezone
 import logging
 import pyodbc
@@ -9,9 +11,23 @@ from dotenv import load_dotenv
 import os
 from elasticsearch import Elasticsearch, ApiError, TransportError
 from elasticsearch.exceptions import NotFoundError
-import json
+from elasticsearch.helpers import bulk
+from elasticsearch.serializer import OrjsonSerializer
+import orjson
 import sys
 import time
+from datetime import timedelta
+import asyncio
+from status_broker import StatusBroker, is_terminal
+from status_cache import StatusCache
+from db import DatabaseExecutor
+from admission import AdmissionController
+from schemas import RagPayload, RagBatchPayload
+from eval_writer import EvaluationWriter, DuplicateEvaluationError
+from idempotency import IdempotencyStore, IdempotencyKeyConflict, payload_fingerprint
+from tracing import start_span, shutdown_exporter, SPAN_KIND_SERVER
+from metrics import http_request_duration, admission_rejections, idempotent_replays, tasks_enqueued, register_state_collector, render_metrics
+from starlette.concurrency import run_in_threadpool
 
 
 
@@ -32,6 +48,7 @@ elasticsearch_hosts_list = elasticsearch_hosts.split(',')
 es = Elasticsearch(
     elasticsearch_hosts_list,
     basic_auth=(elasticsearch_user, elasticsearch_pwd),
+    serializer=OrjsonSerializer(),
 )
 
 # Define the Elasticsearch index for storing responses
@@ -44,6 +61,33 @@ connection_string = os.getenv("SQL_SERVER_CNXN_STR_IA")
 url_api_ocr_gampes = os.getenv("URL_API_OCR_GAMPES")
 url_api_ocr_mni = os.getenv("URL_API_OCR_MNI")
 
+# Notificações de status: intervalo do poller, heartbeat do SSE e token do worker
+status_poll_interval = float(os.getenv("STATUS_POLL_INTERVAL", "1.0"))
+sse_heartbeat_seconds = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+notify_token = os.getenv("NOTIFY_TOKEN")
+
+# Cache de status: TTL curto para tarefas em andamento, longo para tarefas finalizadas
+status_cache_size = int(os.getenv("STATUS_CACHE_SIZE", "10000"))
+status_cache_pending_ttl = float(os.getenv("STATUS_CACHE_PENDING_TTL", "2"))
+status_cache_terminal_ttl = float(os.getenv("STATUS_CACHE_TERMINAL_TTL", "3600"))
+
+# Tamanho máximo de um lote de perguntas (o INSERT multi-linhas usa 4 parâmetros por linha)
+batch_max_size = int(os.getenv("BATCH_MAX_SIZE", "50"))
+
+# Controle de admissão: recusa com 429 quando a espera estimada na fila passa do limite (0 desativa)
+admission_max_wait = float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "900"))
+admission_refresh_interval = float(os.getenv("ADMISSION_REFRESH_INTERVAL", "5"))
+admission_window = int(os.getenv("ADMISSION_WINDOW_SECONDS", "600"))
+admission_default_service_seconds = float(os.getenv("ADMISSION_DEFAULT_SERVICE_SECONDS", "60"))
+
+# Gravação das avaliações em lote: por tamanho ou a cada intervalo (segundos)
+eval_batch_size = int(os.getenv("EVAL_BATCH_SIZE", "200"))
+eval_flush_interval = float(os.getenv("EVAL_FLUSH_INTERVAL", "0.25"))
+
+# Idempotency-Key do POST /rag: tempo (segundos) durante o qual um retry devolve a mesma tarefa
+idempotency_ttl = float(os.getenv("IDEMPOTENCY_TTL", "3600"))
+idempotency_max_keys = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "100000"))
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -54,29 +98,74 @@ def get_db_connection():
     """Cria uma nova conexão com o banco de dados"""
     return pyodbc.connect(connection_string)
 
-# Modify the insert_into_fila_processamento function
-def insert_into_fila_processamento(id_elasticsearch: str, payload_json: dict, status: int, agente: int):
-    """Insere dados na tabela fila_processamento_agentes"""
+# Pool dedicado para o SQL Server: as chamadas pyodbc não bloqueiam o event loop
+db_pool_size = int(os.getenv("DB_POOL_SIZE", "8"))
+db_executor = DatabaseExecutor(connection_string, max_workers=db_pool_size)
+
+# Avaliações acumuladas em memória e gravadas com INSERT multi-linhas
+evaluation_writer = EvaluationWriter(db_executor, batch_size=eval_batch_size, flush_interval=eval_flush_interval)
+
+# Chaves de idempotência -> resposta da requisição que criou a tarefa
+idempotency_store = IdempotencyStore(ttl=idempotency_ttl, max_entries=idempotency_max_keys)
+
+# Profundidade da fila e taxa de atendimento em cache, atualizadas em segundo plano
+admission = AdmissionController(
+    db_executor,
+    agente=101,
+    max_wait=admission_max_wait,
+    refresh_interval=admission_refresh_interval,
+    window=admission_window,
+    default_service_seconds=admission_default_service_seconds,
+)
+
+def insert_into_fila_processamento(conn, id_elasticsearch: str, payload_json: dict, status: int, agente: int):
+    """Insere dados na tabela fila_processamento_agentes usando a conexão informada"""
     try:
-        with get_db_connection() as conn:
-            cursor = conn.cursor()
-            
-            query = """
-            INSERT INTO IA.dbo.fila_processamento_agentes 
-            (id_elasticsearch, payload, status, data_criacao, id_agente)
-            VALUES (?, ?, ?, GETDATE(), ?)
-            """
-            
-            # Convert the dictionary to a JSON string
-            payload_str = json.dumps(payload_json, ensure_ascii=False)
-            cursor.execute(query, id_elasticsearch, payload_str, status, agente)
-            conn.commit()
-            logging.info(f"Dados inseridos na tabela com sucesso. ID Elasticsearch: {id_elasticsearch}")
+        cursor = conn.cursor()
+        
+        query = """
+        INSERT INTO IA.dbo.fila_processamento_agentes 
+        (id_elasticsearch, payload, status, data_criacao, id_agente)
+        VALUES (?, ?, ?, GETDATE(), ?)
+        """
+        
+        # Convert the dictionary to a JSON string
+        payload_str = orjson.dumps(payload_json).decode("utf-8")
+        cursor.execute(query, id_elasticsearch, payload_str, status, agente)
+        conn.commit()
+        cursor.close()
+        logging.info(f"Dados inseridos na tabela com sucesso. ID Elasticsearch: {id_elasticsearch}")
             
     except Exception as e:
         logging.error(f"Erro ao inserir dados na tabela: {e}")
         raise
 
+def insert_many_into_fila_processamento(conn, rows, status: int, agente: int):
+    """Insere várias tarefas na fila_processamento_agentes com um único INSERT multi-linhas.
+
+    Args:
+        rows (list): Lista de tuplas (id_elasticsearch, payload_json).
+    """
+    try:
+        cursor = conn.cursor()
+        values_sql = ", ".join(["(?, ?, ?, GETDATE(), ?)"] * len(rows))
+        query = f"""
+        INSERT INTO IA.dbo.fila_processamento_agentes 
+        (id_elasticsearch, payload, status, data_criacao, id_agente)
+        VALUES {values_sql}
+        """
+        params = []
+        for id_elasticsearch, payload_json in rows:
+            params.extend([id_elasticsearch, orjson.dumps(payload_json).decode("utf-8"), status, agente])
+        cursor.execute(query, params)
+        conn.commit()
+        cursor.close()
+        logging.info(f"{len(rows)} tarefas inseridas na tabela com sucesso.")
+
+    except Exception as e:
+        logging.error(f"Erro ao inserir dados na tabela: {e}")
+        raise
+
 # Function to check database connection
 def check_db_connection():
     """Checks the database connection."""
@@ -104,7 +193,48 @@ def check_elasticsearch_connection():
         logging.error(f"Elasticsearch connection failed: {e}")
         return False
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
+
+# Cache de leitura dos documentos de status (evita um es.get por poll)
+status_cache = StatusCache(status_cache_size, status_cache_pending_ttl, status_cache_terminal_ttl)
+
+async def load_status_document(task_id: str):
+    """Read the status document of a task from Elasticsearch."""
+    doc = await run_in_threadpool(es.get, index=index_responses, id=task_id)
+    return doc["_source"]
+
+async def get_cached_status(task_id: str):
+    """Status document of a task, served from the cache when possible."""
+    return await status_cache.get_or_fetch(task_id, load_status_document)
+
+# Distribui mudanças de status para clientes SSE e long-poll
+status_broker = StatusBroker(es, index_responses, poll_interval=status_poll_interval, loader=get_cached_status, on_change=status_cache.put)
+
+# Métricas Prometheus: profundidade da fila e cache de status lidos no momento da coleta
+register_state_collector(admission, status_cache)
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Observe the latency of every request, labeled by route template."""
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        http_request_duration.labels(
+            request.method,
+            route.path if route is not None else "desconhecida",
+            str(status_code),
+        ).observe(time.perf_counter() - start)
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus exposition of the API metrics."""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
 
 @app.on_event("startup")
 def startup_event():
@@ -119,53 +249,239 @@ def startup_event():
         logging.error("Application startup failed: could not connect to Elasticsearch.")
         sys.exit(1)
 
+@app.on_event("startup")
+async def start_status_broker():
+    """Start the background poller that feeds status streams."""
+    status_broker.start()
+
+@app.on_event("shutdown")
+async def stop_status_broker():
+    await status_broker.stop()
+
+@app.on_event("startup")
+async def start_admission_control():
+    """Start the background refresh of the queue statistics."""
+    admission.start()
+
+@app.on_event("shutdown")
+async def stop_admission_control():
+    await admission.stop()
+
+@app.on_event("startup")
+async def start_evaluation_writer():
+    """Start the background flush of buffered evaluations."""
+    evaluation_writer.start()
+
+@app.on_event("shutdown")
+async def stop_db_executor():
+    # As avaliações ainda em memória são gravadas antes de fechar as conexões
+    await evaluation_writer.close()
+    await run_in_threadpool(db_executor.shutdown)
+    # Spans ainda na fila do exportador
+    await run_in_threadpool(shutdown_exporter)
+
+def check_admission(n=1):
+    """
+    Admit `n` new tasks or refuse them with 429 and Retry-After when the queue is too long.
+
+    Returns:
+        dict: Estimated completion fields for the response (empty without queue statistics).
+    """
+    accepted, estimated, retry_after = admission.admit(n)
+    if not accepted:
+        admission_rejections.inc()
+        logging.warning(f"Request refused by admission control: estimated wait {estimated:.0f}s")
+        raise HTTPException(
+            status_code=429,
+            detail=f"Fila de processamento cheia: espera estimada de {estimated / 60:.0f} minutos. Tente novamente mais tarde.",
+            headers={"Retry-After": str(retry_after)},
+        )
+    if estimated is None:
+        return {}
+    return {
+        "tempo_estimado_segundos": round(estimated),
+        "conclusao_estimada": (datetime.now(timezone.utc) + timedelta(seconds=estimated)).isoformat(),
+    }
+
+def _initial_doc(texto_prompt):
+    return {
+        "status": 202,
+        "texto_resposta": "processando requisição",
+        "texto_aux": texto_prompt,
+        "data_criacao": datetime.now(timezone.utc).isoformat(),
+    }
+
 @app.post("/rag", status_code=202) # 202 Accepted is more appropriate for async tasks
-async def rag_async_trigger(payload: Dict[str, Any], background_tasks: BackgroundTasks):
+async def rag_async_trigger(payload: RagPayload, background_tasks: BackgroundTasks, response: Response, idempotency_key: Optional[str] = Header(default=None), traceparent: Optional[str] = Header(default=None)):
+    """Enqueue a RAG task.
+
+    With an `Idempotency-Key` header, a retry of the same request returns the
+    task created by the first attempt instead of enqueueing a new one. A W3C
+    `traceparent` header makes the task's trace a child of the caller's.
+    """
     if not es:
         raise HTTPException(status_code=503, detail="Elasticsearch service unavailable. Cannot process request.")
+    if idempotency_key is None:
+        return await enqueue_rag_task(payload, traceparent)
+    if not idempotency_key.strip() or len(idempotency_key) > 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key deve ter entre 1 e 255 caracteres.")
+
+    # Chave válida por usuário: clientes diferentes podem gerar a mesma chave
+    key = f"{payload.user}:{idempotency_key}"
+    try:
+        replayed, body = await idempotency_store.run(key, payload_fingerprint(payload.model_dump()), lambda: enqueue_rag_task(payload, traceparent))
+    except IdempotencyKeyConflict:
+        raise HTTPException(status_code=422, detail="Idempotency-Key já utilizada com um payload diferente.")
+    if replayed:
+        idempotent_replays.inc()
+        logging.info(f"Idempotent replay of task {body['task_id']}")
+        response.headers["Idempotent-Replayed"] = "true"
+    return body
+
+async def enqueue_rag_task(payload: RagPayload, traceparent: Optional[str] = None):
+    """Create the status document and the queue row of a new RAG task.
+
+    The traceparent of the request span goes into the queue payload, so the
+    worker continues the same trace.
+    """
+    estimativa = check_admission()
 
     task_id = str(uuid.uuid4())
     
     # Construct the complete URL that will be returned
     elasticsearch_url = f"{elasticsearch_host}/{index_responses}/_doc/{task_id}"
     
-    # Initial document creation in Elasticsearch
-    initial_doc_body = {
-        "status": 202,
-        "texto_resposta": "processando requisição",
-        "texto_aux": payload.get('texto_prompt', ''), # Storing original payload for reference
-        "data_criacao": datetime.now(timezone.utc).isoformat(),
-    }
-    try:
-        es.index(
-            index=index_responses,
-            id=task_id,
-            document=initial_doc_body
-        )
-        logging.info(f"Initial Elasticsearch document {task_id} created for new RAG task.")
-    except (ApiError, TransportError) as e:
-        logging.error(f"Failed to create initial Elasticsearch document for task {task_id}: {e}")
-        raise HTTPException(status_code=500, detail="Failed to initiate task tracking in Elasticsearch.")
-    except Exception as e: # Catch any other unexpected error during ES init
-        logging.error(f"Unexpected error creating initial Elasticsearch document for task {task_id}: {e}")
-        raise HTTPException(status_code=500, detail="Unexpected error initiating task tracking.")
-
-    #background_tasks.add_task(process_rag_task, task_id, payload, es, connection_string)
-    insert_into_fila_processamento(task_id, payload, 102, 101)
+    with start_span("POST /rag", traceparent, service_name="rag-api", kind=SPAN_KIND_SERVER, **{"task.id": task_id, "user": payload.user}) as trace:
+        # Initial document creation in Elasticsearch
+        initial_doc_body = {**_initial_doc(payload.texto_prompt), "trace_id": trace["trace_id"]} # Storing original prompt for reference
+        try:
+            await run_in_threadpool(
+                es.index,
+                index=index_responses,
+                id=task_id,
+                document=initial_doc_body
+            )
+            logging.info(f"Initial Elasticsearch document {task_id} created for new RAG task.")
+        except (ApiError, TransportError) as e:
+            logging.error(f"Failed to create initial Elasticsearch document for task {task_id}: {e}")
+            raise HTTPException(status_code=500, detail="Failed to initiate task tracking in Elasticsearch.")
+        except Exception as e: # Catch any other unexpected error during ES init
+            logging.error(f"Unexpected error creating initial Elasticsearch document for task {task_id}: {e}")
+            raise HTTPException(status_code=500, detail="Unexpected error initiating task tracking.")
+
+        #background_tasks.add_task(process_rag_task, task_id, payload, es, connection_string)
+        task_payload = {**payload.model_dump(exclude_none=True), "traceparent": trace["traceparent"]}
+        await db_executor.run(insert_into_fila_processamento, task_id, task_payload, 102, 101)
+    tasks_enqueued.labels("rag").inc()
     
     return {
         "task_id": task_id,
         "url": elasticsearch_url,
-        "message": "Requisição recebida e processamento iniciado em segundo plano."
+        "trace_id": trace["trace_id"],
+        "message": "Requisição recebida e processamento iniciado em segundo plano.",
+        **estimativa
+    }
+
+@app.post("/rag/batch", status_code=202)
+async def rag_batch_trigger(payload: RagBatchPayload, traceparent: Optional[str] = Header(default=None)):
+    """Enqueue several questions over the same document set with one ES _bulk and one multi-row insert.
+
+    The payload carries the fields shared by every task (id_documentos_mni,
+    id_documentos_gampes, user, idfuncao, idorgao, ...) plus the list of
+    questions in `textos_prompt`.
+    """
+    if not es:
+        raise HTTPException(status_code=503, detail="Elasticsearch service unavailable. Cannot process request.")
+
+    perguntas = payload.textos_prompt
+    if len(perguntas) > batch_max_size:
+        raise HTTPException(status_code=422, detail=f"O lote aceita no máximo {batch_max_size} perguntas.")
+    estimativa = check_admission(len(perguntas))
+
+    batch_id = str(uuid.uuid4())
+    # Um trace por lote: todas as tarefas continuam o span desta requisição
+    with start_span("POST /rag/batch", traceparent, service_name="rag-api", kind=SPAN_KIND_SERVER, **{"batch.id": batch_id, "batch.size": len(perguntas), "user": payload.user}) as trace:
+        shared = {**payload.model_dump(exclude={"textos_prompt"}, exclude_none=True), "traceparent": trace["traceparent"]}
+        tasks = [(str(uuid.uuid4()), {**shared, "texto_prompt": pergunta, "id_lote": batch_id}) for pergunta in perguntas]
+
+        # Documento do lote + documentos iniciais das tarefas em uma única chamada _bulk
+        actions = [{
+            "_index": index_responses,
+            "_id": batch_id,
+            "_source": {
+                "tipo_requisicao": "RAG_LOTE",
+                "task_ids": [task_id for task_id, _ in tasks],
+                "usuario": payload.user,
+                "data_criacao": datetime.now(timezone.utc).isoformat(),
+                "trace_id": trace["trace_id"],
+            },
+        }]
+        actions.extend(
+            {"_index": index_responses, "_id": task_id, "_source": {**_initial_doc(task_payload["texto_prompt"]), "id_lote": batch_id, "trace_id": trace["trace_id"]}}
+            for task_id, task_payload in tasks
+        )
+        try:
+            await run_in_threadpool(bulk, es, actions)
+            logging.info(f"Batch {batch_id} with {len(tasks)} tasks created in Elasticsearch.")
+        except Exception as e:
+            logging.error(f"Failed to create Elasticsearch documents for batch {batch_id}: {e}")
+            raise HTTPException(status_code=500, detail="Failed to initiate batch tracking in Elasticsearch.")
+
+        await db_executor.run(insert_many_into_fila_processamento, tasks, 102, 101)
+        tasks_enqueued.labels("rag_batch").inc(len(tasks))
+
+    return {
+        "batch_id": batch_id,
+        "task_ids": [task_id for task_id, _ in tasks],
+        "url": f"/rag/batch/{batch_id}",
+        "trace_id": trace["trace_id"],
+        "message": "Lote recebido e processamento iniciado em segundo plano.",
+        **estimativa
     }
 
+@app.get("/rag/batch/{batch_id}")
+async def get_rag_batch_status(batch_id: str):
+    """Aggregate status of every task of a batch, read with one get and one mget."""
+    if not es:
+        raise HTTPException(status_code=503, detail="Elasticsearch service unavailable. Cannot retrieve status.")
+    try:
+        batch_doc = await run_in_threadpool(es.get, index=index_responses, id=batch_id)
+        task_ids = batch_doc["_source"].get("task_ids", [])
+        response = await run_in_threadpool(es.mget, index=index_responses, ids=task_ids)
+    except NotFoundError:
+        raise HTTPException(status_code=404, detail=f"Batch ID '{batch_id}' não encontrado.")
+    except (ApiError, TransportError) as e:
+        logging.error(f"Elasticsearch error fetching status for batch {batch_id}: {e}")
+        raise HTTPException(status_code=500, detail="Erro ao consultar o status do lote no Elasticsearch.")
+
+    tarefas = []
+    resumo = {"total": len(task_ids), "concluidas": 0, "em_andamento": 0, "erros": 0}
+    for doc in response["docs"]:
+        source = doc.get("_source", {}) if doc.get("found") else {}
+        task_status = source.get("status")
+        if task_status == 200:
+            resumo["concluidas"] += 1
+        elif task_status in (102, 202) or task_status is None:
+            resumo["em_andamento"] += 1
+        else:
+            resumo["erros"] += 1
+        tarefas.append({"task_id": doc["_id"], "status": task_status, "fase": source.get("fase")})
+
+    return {"batch_id": batch_id, "resumo": resumo, "finalizado": resumo["em_andamento"] == 0, "tarefas": tarefas}
+
 @app.get("/rag/status/{task_id}")
-async def get_rag_status(task_id: str):
+async def get_rag_status(task_id: str, wait: bool = False, timeout: float = 30.0):
     if not es:
         raise HTTPException(status_code=503, detail="Elasticsearch service unavailable. Cannot retrieve status.")
     try:
-        doc = es.get(index=index_responses, id=task_id)
-        return doc["_source"]
+        if wait:
+            # Long-poll: responde assim que o status mudar ou ao fim do timeout
+            async with status_broker.watch(task_id):
+                version, source = await status_broker.fetch(task_id)
+                if not is_terminal(source):
+                    version, source = await status_broker.wait_for_change(task_id, version, min(max(timeout, 0.0), 60.0))
+                return source
+        return await get_cached_status(task_id)
     except NotFoundError:
         raise HTTPException(status_code=404, detail=f"Task ID '{task_id}' não encontrado.")
     except (ApiError, TransportError) as e:
@@ -176,6 +492,76 @@ async def get_rag_status(task_id: str):
         raise HTTPException(status_code=500, detail="Erro inesperado ao consultar o status da tarefa.")
 
 
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {orjson.dumps(data).decode('utf-8')}\n\n"
+
+
+@app.get("/rag/stream/{task_id}")
+async def stream_rag_status(task_id: str, request: Request):
+    """Server-Sent Events stream with every status change (and partial text) of a task."""
+    if not es:
+        raise HTTPException(status_code=503, detail="Elasticsearch service unavailable. Cannot retrieve status.")
+
+    async def events():
+        async with status_broker.watch(task_id):
+            try:
+                version, source = await status_broker.fetch(task_id)
+            except NotFoundError:
+                yield _sse_event("error", {"detail": f"Task ID '{task_id}' não encontrado."})
+                return
+            yield _sse_event("status", source)
+            while not is_terminal(source):
+                if await request.is_disconnected():
+                    return
+                new_version, new_source = await status_broker.wait_for_change(task_id, version, sse_heartbeat_seconds)
+                if new_version == version:
+                    yield ": ping\n\n"
+                    continue
+                version, source = new_version, new_source
+                yield _sse_event("status", source)
+            yield _sse_event("end", {"status": source.get("status")})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+class StatusNotification(BaseModel):
+    """Fields of the status document that the worker pushes (see worker update_document)."""
+
+    model_config = ConfigDict(extra="forbid")
+
+    id_requisicao: Optional[str] = None
+    texto_resposta: Optional[str] = None
+    texto_aux: Optional[str] = None
+    status: Optional[int] = None
+    mensagem_erro: Optional[str] = None
+    data_criacao: Optional[str] = None
+    usuario: Optional[str] = None
+    tipo_requisicao: Optional[str] = None
+    fase: Optional[str] = None
+    texto_parcial: Optional[str] = None
+    tempos: Optional[Dict[str, Any]] = None
+    uso: Optional[Dict[str, Any]] = None
+
+
+@app.post("/rag/status/{task_id}/notify", status_code=204)
+async def notify_rag_status(task_id: str, notification: StatusNotification, x_notify_token: Optional[str] = Header(default=None)):
+    """Receive a status change pushed by the worker and wake the clients watching the task."""
+    # Sem NOTIFY_TOKEN configurado o endpoint fica desativado (os clientes seguem pelo poller)
+    if not notify_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not x_notify_token or not secrets.compare_digest(x_notify_token.encode(), notify_token.encode()):
+        raise HTTPException(status_code=403, detail="Invalid notify token.")
+    fields = notification.model_dump(exclude_none=True)
+    if not fields:
+        return
+    status_cache.merge(task_id, fields)
+    status_broker.publish(task_id, fields, merge=True)
+
+
 class EvalData(BaseModel):
     id: str
     eval: bool
@@ -184,16 +570,10 @@ class EvalData(BaseModel):
 @app.post("/evaluate", status_code=status.HTTP_201_CREATED)
 async def save_evaluation(data: EvalData):
     try:
-        with pyodbc.connect(connection_string) as conn:
-            with conn.cursor() as cursor:
-                cursor.execute(
-                    "INSERT INTO IA.dbo.rag_gampes_eval (id, eval, info) VALUES (?, ?, ?)",
-                    (data.id, int(data.eval), data.info)
-                )
-                conn.commit()
+        await evaluation_writer.submit(data.id, data.eval, data.info)
         return {"message": "Evaluation saved successfully"}
     
-    except pyodbc.IntegrityError:
+    except DuplicateEvaluationError:
         raise HTTPException(
             status_code=400,
             detail="Duplicate ID - This evaluation already exists"
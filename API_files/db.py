@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pyodbc
+
+
+class DatabaseExecutor:
+    """
+    Run blocking pyodbc work off the event loop.
+
+    Calls go to a dedicated thread pool whose threads each keep one open
+    connection, so the pool size bounds the connections the API holds and
+    requests no longer pay a new ODBC handshake. A connection that fails is
+    discarded and reopened on the next call.
+    """
+
+    def __init__(self, connection_string, max_workers=8):
+        self.connection_string = connection_string
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = pyodbc.connect(self.connection_string)
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _discard_connection(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            with self._lock:
+                if conn in self._connections:
+                    self._connections.remove(conn)
+            try:
+                conn.close()
+            except pyodbc.Error:
+                pass
+
+    def _call(self, fn, *args, **kwargs):
+        conn = self._connection()
+        try:
+            return fn(conn, *args, **kwargs)
+        except pyodbc.IntegrityError:
+            # Erro de dados: a conexão continua válida
+            conn.rollback()
+            raise
+        except pyodbc.Error:
+            self._discard_connection()
+            raise
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Run `fn(conn, *args, **kwargs)` on a pooled connection without blocking the event loop.
+
+        Args:
+            fn (callable): Function receiving an open pyodbc connection first.
+
+        Returns:
+            The return value of `fn`.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: self._call(fn, *args, **kwargs))
+
+    def run_sync(self, fn, *args, **kwargs):
+        """Blocking variant of `run`, for code that is not running on the event loop."""
+        return self._executor.submit(self._call, fn, *args, **kwargs).result()
+
+    def shutdown(self):
+        """Stop the pool and close every connection."""
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except pyodbc.Error as e:
+                    logging.error(f"Error closing database connection: {e}")
+            self._connections.clear()
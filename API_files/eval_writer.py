@@ -0,0 +1,148 @@
+import asyncio
+import logging
+from collections import OrderedDict
+import pyodbc
+
+
+class DuplicateEvaluationError(Exception):
+    """The evaluation ID already exists (in the table or waiting in the buffer)."""
+
+
+def write_evaluations(conn, rows):
+    """
+    Insert evaluations into rag_gampes_eval with a multi-row INSERT.
+
+    If the batch violates the primary key, it is rolled back and the rows are
+    inserted one by one, so only the duplicates are refused.
+
+    Args:
+        conn: Open pyodbc connection.
+        rows (list): List of tuples (id, eval, info).
+
+    Returns:
+        list: For each row, True if it was inserted or False if its ID already existed.
+    """
+    cursor = conn.cursor()
+    try:
+        values_sql = ", ".join(["(?, ?, ?)"] * len(rows))
+        params = [value for row in rows for value in row]
+        try:
+            cursor.execute(f"INSERT INTO IA.dbo.rag_gampes_eval (id, eval, info) VALUES {values_sql}", params)
+            conn.commit()
+            return [True] * len(rows)
+        except pyodbc.IntegrityError:
+            conn.rollback()
+
+        results = []
+        for row in rows:
+            try:
+                cursor.execute("INSERT INTO IA.dbo.rag_gampes_eval (id, eval, info) VALUES (?, ?, ?)", row)
+                conn.commit()
+                results.append(True)
+            except pyodbc.IntegrityError:
+                conn.rollback()
+                results.append(False)
+        return results
+    finally:
+        cursor.close()
+
+
+class EvaluationWriter:
+    """
+    Buffered writer for /evaluate.
+
+    Evaluations are kept in memory and written by a single background task
+    with multi-row inserts, every `flush_interval` seconds or as soon as
+    `batch_size` rows are waiting, so a burst of feedback uses one database
+    connection instead of one per request. Each request still waits for its
+    row to be committed, which keeps the 201/400 answers exact: IDs already
+    buffered or recently written are refused up front, and IDs that already
+    exist in the table are refused when the batch is written.
+    """
+
+    def __init__(self, db_executor, batch_size=200, flush_interval=0.25, recent_size=10000):
+        self.db_executor = db_executor
+        # O SQL Server aceita até 2100 parâmetros por comando (3 por linha)
+        self.batch_size = min(batch_size, 690)
+        self.flush_interval = flush_interval
+        self.recent_size = recent_size
+        self._pending = OrderedDict()
+        self._recent = OrderedDict()
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        self._task = None
+
+    def _remember(self, eval_id):
+        self._recent[eval_id] = True
+        self._recent.move_to_end(eval_id)
+        while len(self._recent) > self.recent_size:
+            self._recent.popitem(last=False)
+
+    async def submit(self, eval_id, eval_value, info):
+        """
+        Buffer an evaluation and wait until it is committed.
+
+        Raises:
+            DuplicateEvaluationError: If the ID already exists.
+            pyodbc.Error: If the batch could not be written.
+        """
+        if eval_id in self._pending or eval_id in self._recent:
+            raise DuplicateEvaluationError(eval_id)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[eval_id] = ((eval_id, int(eval_value), info), future)
+        if len(self._pending) >= self.batch_size or self._task is None:
+            self._wakeup.set()
+        if self._task is None:
+            # Sem o laço em segundo plano (ex.: fora do ciclo de vida da app), grava na hora
+            await self.flush()
+        await future
+
+    async def flush(self):
+        """Write everything buffered so far, in batches of `batch_size`."""
+        while self._pending:
+            batch = []
+            while self._pending and len(batch) < self.batch_size:
+                batch.append(self._pending.popitem(last=False)[1])
+            rows = [row for row, _ in batch]
+            try:
+                results = await self.db_executor.run(write_evaluations, rows)
+            except Exception as e:
+                logging.error(f"Error writing {len(rows)} evaluations: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (row, future), inserted in zip(batch, results):
+                self._remember(row[0])
+                if future.done():
+                    continue
+                if inserted:
+                    future.set_result(None)
+                else:
+                    future.set_exception(DuplicateEvaluationError(row[0]))
+
+    async def run(self):
+        """Background loop flushing the buffer by size or interval."""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+            if self._closing:
+                return
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def close(self):
+        """Stop the background loop after a last flush of what is still buffered."""
+        if self._task is not None:
+            # Não cancela: um lote em gravação precisa terminar e responder aos seus pedidos
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()
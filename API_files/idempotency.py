@@ -0,0 +1,76 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
+import orjson
+
+
+class IdempotencyKeyConflict(Exception):
+    """The idempotency key was already used with a different payload."""
+
+
+def payload_fingerprint(data):
+    """Stable hash of a request payload, used to detect a key reused for another request."""
+    return hashlib.sha256(orjson.dumps(data, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+class IdempotencyStore:
+    """
+    In-memory map of idempotency keys to the response of the request that used them first.
+
+    A key is registered before its request runs, so a retry that arrives
+    while the first attempt is still enqueueing waits for it and gets the
+    same response instead of creating a second task. If the first attempt
+    fails the key is released and the next retry runs normally. Entries
+    expire after `ttl` seconds and the store keeps at most `max_entries`.
+    """
+
+    def __init__(self, ttl=3600.0, max_entries=100000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    def _purge(self):
+        now = time.monotonic()
+        # As chaves entram em ordem de criação e têm o mesmo TTL: as expiradas ficam no início
+        while self._entries:
+            key, (expires_at, _, _) = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[key]
+
+    async def run(self, key, fingerprint, create):
+        """
+        Return the response stored for `key`, or run `create()` once and store its result.
+
+        Args:
+            key (str): The idempotency key (already scoped to the caller).
+            fingerprint (str): Fingerprint of the request payload.
+            create (callable): Coroutine function producing the response of a new request.
+
+        Returns:
+            tuple: (replayed, response), where replayed is True if the response was stored.
+
+        Raises:
+            IdempotencyKeyConflict: If the key was used with a different payload.
+        """
+        self._purge()
+        entry = self._entries.get(key)
+        if entry is not None:
+            _, stored_fingerprint, future = entry
+            if stored_fingerprint != fingerprint:
+                raise IdempotencyKeyConflict(key)
+            return True, await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._entries[key] = (time.monotonic() + self.ttl, fingerprint, future)
+        try:
+            response = await create()
+        except BaseException as e:
+            self._entries.pop(key, None)
+            future.set_exception(e)
+            # Evita o aviso de exceção não consumida quando ninguém mais aguardava
+            future.exception()
+            raise
+        future.set_result(response)
+        return False, response
@@ -0,0 +1,434 @@
+"""
+Load generator for the RAG API.
+
+Replays a weighted mix of payloads at a target arrival rate (Poisson
+arrivals, optionally in stages) with up to `--users` concurrent virtual
+users. Each virtual user submits a task and follows it until it finishes,
+through the SSE stream (`--follow sse`, default) or the long-poll status
+endpoint (`--follow poll`). Batches (/rag/batch) are followed through
+GET /rag/batch/{id}. Measures per task:
+
+    submit      latency of POST /rag (or /rag/batch)
+    first phase time until the worker picked the task (first `fase` update)
+    ttft        time until the first partial answer (worker with ANSWER_STREAM=true)
+    completion  time until a final status
+
+and writes a JSON report (summary plus every session) and a self-contained
+HTML report. Each session creates real tasks; use a staging environment.
+
+Payload mix file (JSON list, `endpoint` defaults to /rag):
+    [
+      {"name": "pergunta", "weight": 3, "payload": {"texto_prompt": "...", "id_documentos_mni": [...], ...}},
+      {"name": "lote", "weight": 1, "endpoint": "/rag/batch", "payload": {"textos_prompt": ["...", "..."], ...}}
+    ]
+
+Usage:
+    python loadgen.py --url http://localhost:8000 --rate 0.5 --duration 300 --users 50 --output loadgen
+    python loadgen.py --stages 120:0.2,120:0.5,120:1 --payloads mix.json --output capacidade
+    python loadgen.py --stages 30:1,30:5,30:10,30:25 --users 200 --follow none --output enfileiramento
+
+With --stages, the report also breaks the submit latency down per stage,
+e.g. to check that the /rag p99 stays flat as the arrival rate grows.
+"""
+import argparse
+import asyncio
+import html
+import json
+import random
+import time
+import uuid
+import httpx
+
+DEFAULT_MIX = [{
+    "name": "padrao",
+    "weight": 1,
+    "payload": {
+        "texto_prompt": "quem sao os envolvidos do processo?",
+        "id_documentos_mni": [23204850, 23204851],
+        "id_documentos_gampes": [251735],
+        "idfuncao": "987",
+        "idorgao": "456",
+        "user": "loadgen",
+        "info": "loadgen.py",
+    },
+}]
+
+# Status de tarefas ainda não concluídas (ver status_broker.PENDING_STATUS)
+PENDING_STATUS = (102, 202)
+
+METRICS = ("submit_seconds", "first_phase_seconds", "ttft_seconds", "completion_seconds", "start_delay_seconds")
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def summarize(values):
+    values = [value for value in values if value is not None]
+    return {
+        "count": len(values),
+        "p50": percentile(values, 0.50),
+        "p90": percentile(values, 0.90),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": max(values) if values else None,
+    }
+
+
+def parse_stages(spec):
+    """Parse "seconds:rate,seconds:rate" into [(seconds, rate), ...]."""
+    stages = []
+    for item in spec.split(","):
+        seconds, rate = item.split(":")
+        stages.append((float(seconds), float(rate)))
+    return stages
+
+
+def arrival_times(stages, rng):
+    """Poisson arrival offsets (seconds from the start) over the stages."""
+    times = []
+    stage_start = 0.0
+    for seconds, rate in stages:
+        t = stage_start
+        while rate > 0:
+            t += rng.expovariate(rate)
+            if t >= stage_start + seconds:
+                break
+            times.append(t)
+        stage_start += seconds
+    return times
+
+
+class Session:
+    """One virtual user's request: submit, then follow the task(s) to the end."""
+
+    def __init__(self, client, args, scenario, scheduled_at):
+        self.client = client
+        self.args = args
+        self.scenario = scenario
+        self.record = {
+            "scenario": scenario.get("name", scenario.get("endpoint", "/rag")),
+            "endpoint": scenario.get("endpoint", "/rag"),
+            "scheduled_at": scheduled_at,
+            "start_delay_seconds": None,
+            "submit_status": None,
+            "submit_seconds": None,
+            "task_id": None,
+            "first_phase_seconds": None,
+            "ttft_seconds": None,
+            "completion_seconds": None,
+            "final_status": None,
+            "error": None,
+        }
+
+    async def run(self, started):
+        record = self.record
+        record["start_delay_seconds"] = time.perf_counter() - started - record["scheduled_at"]
+        start = time.perf_counter()
+        try:
+            response = await self.client.post(f"{self.args.url}{record['endpoint']}", json=self.scenario["payload"])
+        except httpx.HTTPError as e:
+            record["error"] = f"submit_{type(e).__name__}"
+            return record
+        record["submit_seconds"] = time.perf_counter() - start
+        record["submit_status"] = response.status_code
+        if response.status_code != 202:
+            record["error"] = f"submit_http_{response.status_code}"
+            return record
+        body = response.json()
+
+        if self.args.follow == "none":
+            record["task_id"] = body.get("task_id") or body.get("batch_id")
+            return record
+        try:
+            if record["endpoint"] == "/rag/batch":
+                record["task_id"] = body["batch_id"]
+                await asyncio.wait_for(self.follow_batch(body["batch_id"], start), self.args.task_timeout)
+            else:
+                record["task_id"] = body["task_id"]
+                follow = self.follow_sse if self.args.follow == "sse" else self.follow_poll
+                await asyncio.wait_for(follow(body["task_id"], start), self.args.task_timeout)
+        except asyncio.TimeoutError:
+            record["error"] = "timeout"
+        except (httpx.HTTPError, ValueError, KeyError) as e:
+            record["error"] = f"follow_{type(e).__name__}"
+        if record["error"] is None and record["final_status"] != 200:
+            record["error"] = f"task_status_{record['final_status']}"
+        return record
+
+    def observe(self, source, start):
+        """Update the timings with a status document seen at this moment."""
+        record = self.record
+        elapsed = time.perf_counter() - start
+        if record["first_phase_seconds"] is None and source.get("fase"):
+            record["first_phase_seconds"] = elapsed
+        if record["ttft_seconds"] is None and source.get("texto_parcial"):
+            record["ttft_seconds"] = elapsed
+        if source.get("status") not in PENDING_STATUS:
+            record["completion_seconds"] = elapsed
+            record["final_status"] = source.get("status")
+            return True
+        return False
+
+    async def follow_sse(self, task_id, start):
+        event = None
+        async with self.client.stream("GET", f"{self.args.url}/rag/stream/{task_id}", timeout=None) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line.startswith("event: "):
+                    event = line[len("event: "):]
+                elif line.startswith("data: ") and event == "status":
+                    if self.observe(json.loads(line[len("data: "):]), start):
+                        return
+                elif line.startswith("data: ") and event == "error":
+                    raise ValueError(line[len("data: "):])
+        raise ValueError("stream closed before a final status")
+
+    async def follow_poll(self, task_id, start):
+        while True:
+            response = await self.client.get(f"{self.args.url}/rag/status/{task_id}", params={"wait": "true", "timeout": 30})
+            response.raise_for_status()
+            if self.observe(response.json(), start):
+                return
+
+    async def follow_batch(self, batch_id, start):
+        record = self.record
+        while True:
+            response = await self.client.get(f"{self.args.url}/rag/batch/{batch_id}")
+            response.raise_for_status()
+            body = response.json()
+            elapsed = time.perf_counter() - start
+            if record["first_phase_seconds"] is None and any(tarefa.get("fase") for tarefa in body["tarefas"]):
+                record["first_phase_seconds"] = elapsed
+            if body["finalizado"]:
+                record["completion_seconds"] = elapsed
+                record["final_status"] = 200 if body["resumo"]["erros"] == 0 else 500
+                return
+            await asyncio.sleep(self.args.poll_interval)
+
+
+async def evaluate(client, url, record, rng):
+    """Post a random /evaluate for a completed task (also exercises the feedback path)."""
+    try:
+        response = await client.post(f"{url}/evaluate", json={"id": record["task_id"], "eval": rng.random() < 0.8, "info": "loadgen.py"})
+        record["evaluate_status"] = response.status_code
+    except httpx.HTTPError as e:
+        record["evaluate_status"] = type(e).__name__
+
+
+async def run(args, mix):
+    rng = random.Random(args.seed)
+    schedule = arrival_times(parse_stages(args.stages) if args.stages else [(args.duration, args.rate)], rng)
+    weights = [scenario.get("weight", 1) for scenario in mix]
+    users = asyncio.Semaphore(args.users)
+    records = []
+    limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users)
+
+    async with httpx.AsyncClient(limits=limits, timeout=args.request_timeout) as client:
+        started = time.perf_counter()
+
+        async def launch(scheduled_at, scenario):
+            async with users:
+                record = await Session(client, args, scenario, scheduled_at).run(started)
+                if record["final_status"] == 200 and record["endpoint"] == "/rag" and rng.random() < args.evaluate_ratio:
+                    await evaluate(client, args.url, record, rng)
+                records.append(record)
+                if args.progress:
+                    print(f"{record['scheduled_at']:>8.1f}s {record['scenario']:<15} {record['submit_status']} "
+                          f"{record['final_status']} {record['completion_seconds'] or 0:>7.1f}s {record['error'] or ''}")
+
+        tasks = []
+        for scheduled_at in schedule:
+            delay = scheduled_at - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(launch(scheduled_at, rng.choices(mix, weights)[0])))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    return records, elapsed
+
+
+def stage_summaries(stages, records):
+    """Submit and completion percentiles of the sessions scheduled in each stage."""
+    summaries = []
+    stage_start = 0.0
+    for seconds, rate in stages:
+        subset = [record for record in records if stage_start <= record["scheduled_at"] < stage_start + seconds]
+        summaries.append({
+            "start": stage_start,
+            "seconds": seconds,
+            "rate": rate,
+            "sessions": len(subset),
+            "rejected_429": sum(1 for record in subset if record["submit_status"] == 429),
+            "errors": sum(1 for record in subset if record["error"]),
+            "submit_seconds": summarize([record["submit_seconds"] for record in subset]),
+            "completion_seconds": summarize([record["completion_seconds"] for record in subset]),
+        })
+        stage_start += seconds
+    return summaries
+
+
+def build_report(args, records, elapsed):
+    errors = {}
+    for record in records:
+        if record["error"]:
+            errors[record["error"]] = errors.get(record["error"], 0) + 1
+    completed = [record for record in records if record["final_status"] == 200]
+    scenarios = {}
+    for name in sorted({record["scenario"] for record in records}):
+        subset = [record for record in records if record["scenario"] == name]
+        scenarios[name] = {
+            "sessions": len(subset),
+            "errors": sum(1 for record in subset if record["error"]),
+            **{metric: summarize([record[metric] for record in subset]) for metric in METRICS},
+        }
+    return {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(time.time() - elapsed)),
+        "settings": vars(args),
+        "summary": {
+            "sessions": len(records),
+            "elapsed_seconds": elapsed,
+            "arrival_rate": len(records) / elapsed if elapsed else None,
+            "accepted": sum(1 for record in records if record["submit_status"] == 202),
+            "rejected_429": sum(1 for record in records if record["submit_status"] == 429),
+            "completed": len(completed),
+            "throughput": len(completed) / elapsed if elapsed else None,
+            "error_rate": sum(1 for record in records if record["error"]) / len(records) if records else None,
+            "errors": errors,
+            **{metric: summarize([record[metric] for record in records]) for metric in METRICS},
+        },
+        "scenarios": scenarios,
+        "stages": stage_summaries(parse_stages(args.stages), records) if args.stages else [],
+        "sessions": sorted(records, key=lambda record: record["scheduled_at"]),
+    }
+
+
+def _fmt(value, digits=2):
+    return "-" if value is None else f"{value:.{digits}f}"
+
+
+def _scatter_svg(sessions, width=900, height=300):
+    """Completion time of every session against its start time (errors in red)."""
+    points = [(s["scheduled_at"], s["completion_seconds"] or s["submit_seconds"] or 0, bool(s["error"])) for s in sessions]
+    if not points:
+        return ""
+    max_x = max(x for x, _, _ in points) or 1.0
+    max_y = max(y for _, y, _ in points) or 1.0
+    circles = "".join(
+        f'<circle cx="{40 + x / max_x * (width - 60):.1f}" cy="{height - 30 - y / max_y * (height - 50):.1f}" r="3" '
+        f'fill="{"#c0392b" if error else "#2e86c1"}"><title>{x:.1f}s: {y:.2f}s</title></circle>'
+        for x, y, error in points
+    )
+    return (
+        f'<svg width="{width}" height="{height}" xmlns="http://www.w3.org/2000/svg" font-size="11">'
+        f'<line x1="40" y1="{height - 30}" x2="{width - 20}" y2="{height - 30}" stroke="#888"/>'
+        f'<line x1="40" y1="20" x2="40" y2="{height - 30}" stroke="#888"/>'
+        f'<text x="{width / 2}" y="{height - 8}" text-anchor="middle">início da sessão (s), máx {max_x:.0f}</text>'
+        f'<text x="8" y="14">conclusão (s), máx {max_y:.1f}</text>{circles}</svg>'
+    )
+
+
+def render_html(report):
+    summary = report["summary"]
+    latency_rows = "".join(
+        f"<tr><td>{metric.removesuffix('_seconds')}</td><td>{stats['count']}</td>"
+        + "".join(f"<td>{_fmt(stats[p])}</td>" for p in ("p50", "p90", "p95", "p99", "max"))
+        + "</tr>"
+        for metric, stats in ((metric, summary[metric]) for metric in METRICS)
+    )
+    scenario_rows = "".join(
+        f"<tr><td>{html.escape(name)}</td><td>{data['sessions']}</td><td>{data['errors']}</td>"
+        f"<td>{_fmt(data['submit_seconds']['p95'])}</td><td>{_fmt(data['ttft_seconds']['p95'])}</td>"
+        f"<td>{_fmt(data['completion_seconds']['p50'])}</td><td>{_fmt(data['completion_seconds']['p95'])}</td></tr>"
+        for name, data in report["scenarios"].items()
+    )
+    stage_rows = "".join(
+        f"<tr><td>{index}</td><td>{_fmt(stage['rate'], 3)}</td><td>{stage['sessions']}</td><td>{stage['rejected_429']}</td><td>{stage['errors']}</td>"
+        + "".join(f"<td>{_fmt(stage['submit_seconds'][p], 3)}</td>" for p in ("p50", "p95", "p99"))
+        + f"<td>{_fmt(stage['completion_seconds']['p95'])}</td></tr>"
+        for index, stage in enumerate(report["stages"], start=1)
+    )
+    stage_table = (
+        "<h2>Estágios</h2>\n<table><tr><th>estágio</th><th>chegadas/s</th><th>sessões</th><th>429</th><th>erros</th>"
+        f"<th>submit p50</th><th>submit p95</th><th>submit p99</th><th>conclusão p95</th></tr>{stage_rows}</table>\n"
+    ) if stage_rows else ""
+    error_rows = "".join(f"<tr><td>{html.escape(error)}</td><td>{count}</td></tr>" for error, count in sorted(summary["errors"].items())) or '<tr><td colspan="2">nenhum</td></tr>'
+    settings = html.escape(json.dumps(report["settings"], ensure_ascii=False, indent=2))
+    return f"""<!DOCTYPE html>
+<html lang="pt-br"><head><meta charset="utf-8"><title>Teste de carga RAG - {report['started_at']}</title>
+<style>body{{font-family:sans-serif;margin:2em}}table{{border-collapse:collapse;margin-bottom:1.5em}}td,th{{border:1px solid #ccc;padding:4px 10px;text-align:right}}td:first-child,th:first-child{{text-align:left}}</style>
+</head><body>
+<h1>Teste de carga RAG</h1>
+<p>Início {report['started_at']} &middot; {summary['sessions']} sessões em {summary['elapsed_seconds']:.0f}s
+&middot; chegada {_fmt(summary['arrival_rate'], 3)}/s &middot; vazão {_fmt(summary['throughput'], 3)} tarefas/s
+&middot; aceitas {summary['accepted']} &middot; 429 {summary['rejected_429']} &middot; concluídas {summary['completed']}
+&middot; taxa de erro {_fmt((summary['error_rate'] or 0) * 100, 1)}%</p>
+<h2>Latências (s)</h2>
+<table><tr><th>métrica</th><th>n</th><th>p50</th><th>p90</th><th>p95</th><th>p99</th><th>máx</th></tr>{latency_rows}</table>
+<h2>Cenários</h2>
+<table><tr><th>cenário</th><th>sessões</th><th>erros</th><th>submit p95</th><th>ttft p95</th><th>conclusão p50</th><th>conclusão p95</th></tr>{scenario_rows}</table>
+{stage_table}<h2>Erros</h2>
+<table><tr><th>erro</th><th>sessões</th></tr>{error_rows}</table>
+<h2>Conclusão por sessão</h2>
+{_scatter_svg(report['sessions'])}
+<h2>Parâmetros</h2>
+<pre>{settings}</pre>
+</body></html>
+"""
+
+
+def print_summary(report):
+    summary = report["summary"]
+    print(f"sessions {summary['sessions']}  accepted {summary['accepted']}  429 {summary['rejected_429']}  "
+          f"completed {summary['completed']}  error rate {_fmt((summary['error_rate'] or 0) * 100, 1)}%  "
+          f"throughput {_fmt(summary['throughput'], 3)} tasks/s")
+    print(f"{'metric':<14} {'n':>5} {'p50 s':>8} {'p95 s':>8} {'p99 s':>8} {'max s':>8}")
+    for metric in METRICS:
+        stats = summary[metric]
+        print(f"{metric.removesuffix('_seconds'):<14} {stats['count']:>5} {_fmt(stats['p50']):>8} {_fmt(stats['p95']):>8} {_fmt(stats['p99']):>8} {_fmt(stats['max']):>8}")
+    if report["stages"]:
+        print(f"{'stage':<6} {'rate/s':>7} {'n':>5} {'429':>5} {'submit p50':>11} {'p95':>8} {'p99':>8}")
+        for index, stage in enumerate(report["stages"], start=1):
+            submit = stage["submit_seconds"]
+            print(f"{index:<6} {_fmt(stage['rate'], 2):>7} {stage['sessions']:>5} {stage['rejected_429']:>5} "
+                  f"{_fmt(submit['p50'], 3):>11} {_fmt(submit['p95'], 3):>8} {_fmt(submit['p99'], 3):>8}")
+    for error, count in sorted(summary["errors"].items()):
+        print(f"error {error}: {count}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load generator for the RAG API.")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--payloads", help="JSON file with the weighted payload mix (default: one built-in payload).")
+    parser.add_argument("--rate", type=float, default=0.2, help="Arrivals per second (ignored with --stages).")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds of arrivals (ignored with --stages).")
+    parser.add_argument("--stages", help='Arrival stages as "seconds:rate,seconds:rate", e.g. 120:0.2,120:0.5.')
+    parser.add_argument("--users", type=int, default=50, help="Maximum concurrent virtual users.")
+    parser.add_argument("--follow", choices=("sse", "poll", "none"), default="sse", help="How to follow each task until it finishes.")
+    parser.add_argument("--task-timeout", type=float, default=900.0, help="Seconds to wait for a task to finish.")
+    parser.add_argument("--request-timeout", type=float, default=60.0)
+    parser.add_argument("--poll-interval", type=float, default=2.0, help="Seconds between batch status checks.")
+    parser.add_argument("--evaluate-ratio", type=float, default=0.0, help="Fraction of completed tasks that also get a POST /evaluate.")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--output", default=f"loadgen-{uuid.uuid4().hex[:8]}", help="Report path prefix (writes .json and .html).")
+    parser.add_argument("--progress", action="store_true", help="Print every finished session.")
+    args = parser.parse_args()
+    args.url = args.url.rstrip("/")
+
+    mix = DEFAULT_MIX
+    if args.payloads:
+        with open(args.payloads, encoding="utf-8") as f:
+            mix = json.load(f)
+
+    records, elapsed = asyncio.run(run(args, mix))
+    report = build_report(args, records, elapsed)
+    with open(f"{args.output}.json", "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    with open(f"{args.output}.html", "w", encoding="utf-8") as f:
+        f.write(render_html(report))
+    print_summary(report)
+    print(f"Reports written to {args.output}.json and {args.output}.html")
@@ -0,0 +1,72 @@
+import time
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+# Latência das requisições HTTP por rota (o template da rota, não a URL, para limitar a cardinalidade)
+http_request_duration = Histogram(
+    "rag_api_request_duration_seconds",
+    "HTTP request latency of the RAG API.",
+    ["method", "route", "status"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+
+admission_rejections = Counter(
+    "rag_api_admission_rejections_total",
+    "Requests refused with 429 by admission control.",
+)
+
+idempotent_replays = Counter(
+    "rag_api_idempotent_replays_total",
+    "POST /rag requests answered from a stored Idempotency-Key response.",
+)
+
+tasks_enqueued = Counter(
+    "rag_api_tasks_enqueued_total",
+    "Tasks written to the processing queue.",
+    ["endpoint"],
+)
+
+
+class ApiStateCollector:
+    """
+    Exposes state kept by other API components, read at scrape time.
+
+    Queue depth comes from the admission controller's cached statistics
+    (no extra database query per scrape) and cache hit counts from the
+    status cache.
+    """
+
+    def __init__(self, admission, status_cache):
+        self.admission = admission
+        self.status_cache = status_cache
+
+    def collect(self):
+        depth = GaugeMetricFamily("rag_queue_depth", "Tasks in fila_processamento_agentes by status.", labels=["status"])
+        stats = self.admission.stats
+        if stats is not None:
+            depth.add_metric(["102"], stats["pendentes"])
+            depth.add_metric(["202"], stats["processando"])
+        yield depth
+
+        rate = GaugeMetricFamily("rag_queue_service_rate", "Tasks completed per second over the admission window.")
+        rate.add_metric([], self.admission.service_rate() or 0.0)
+        yield rate
+
+        if self.admission.updated_at is not None:
+            age = GaugeMetricFamily("rag_queue_stats_age_seconds", "Age of the cached queue statistics.")
+            age.add_metric([], time.monotonic() - self.admission.updated_at)
+            yield age
+
+        lookups = CounterMetricFamily("rag_api_status_cache_lookups", "Status cache lookups by result.", labels=["result"])
+        lookups.add_metric(["hit"], self.status_cache.hits)
+        lookups.add_metric(["miss"], self.status_cache.misses)
+        yield lookups
+
+
+def register_state_collector(admission, status_cache):
+    REGISTRY.register(ApiStateCollector(admission, status_cache))
+
+
+def render_metrics():
+    """Return (body, content_type) of the Prometheus exposition."""
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,154 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from elasticsearch.exceptions import NotFoundError
+
+# Status que indicam que a tarefa ainda está em andamento
+PENDING_STATUS = {102, 202}
+
+
+def is_terminal(source):
+    """Tell whether a status document describes a finished (or failed) task."""
+    return source is not None and source.get("status") not in PENDING_STATUS
+
+
+class StatusBroker:
+    """
+    Fan-out of task status changes to SSE and long-poll clients.
+
+    Every watched task has a version counter and an asyncio.Event that is
+    set (and replaced) on each change. Changes arrive either pushed by the
+    worker (`publish`, via the notify endpoint) or from a single background
+    poller that fetches all watched tasks with one `mget` per interval, so
+    Elasticsearch load does not grow with the number of connected clients.
+    """
+
+    def __init__(self, es, index, poll_interval=1.0, loader=None, on_change=None):
+        self.es = es
+        self.index = index
+        self.poll_interval = poll_interval
+        self.loader = loader
+        self.on_change = on_change
+        self._docs = {}
+        self._versions = {}
+        self._events = {}
+        self._watchers = {}
+        self._task = None
+
+    def _event(self, task_id):
+        event = self._events.get(task_id)
+        if event is None:
+            event = self._events[task_id] = asyncio.Event()
+        return event
+
+    def publish(self, task_id, source, merge=False):
+        """
+        Record a new status document for a task and wake its waiters.
+
+        Args:
+            task_id (str): The task ID.
+            source (dict): The status document (or changed fields when merge=True).
+            merge (bool): Merge the fields into the known document instead of replacing it.
+        """
+        current = self._docs.get(task_id)
+        if merge:
+            if current is None:
+                # Sem documento completo conhecido (ex.: o primeiro fetch ainda aguarda o loader):
+                # os campos avisados não bastam como documento; fetch e o poller trarão o estado atual
+                return
+            source = {**current, **source}
+        if source.get("status") is None:
+            # Documento sem status seria tratado como finalizado por is_terminal
+            return
+        if source == current:
+            return
+        self._docs[task_id] = source
+        self._versions[task_id] = self._versions.get(task_id, 0) + 1
+        if self.on_change is not None:
+            self.on_change(task_id, source)
+        event = self._events.pop(task_id, None)
+        if event is not None:
+            event.set()
+
+    async def fetch(self, task_id):
+        """
+        Return the latest known status of a task, reading Elasticsearch if needed.
+
+        Raises:
+            NotFoundError: If the task does not exist.
+        """
+        if task_id in self._docs:
+            return self._versions[task_id], self._docs[task_id]
+        if self.loader is not None:
+            source = await self.loader(task_id)
+        else:
+            source = (await asyncio.to_thread(self.es.get, index=self.index, id=task_id))["_source"]
+        self.publish(task_id, source)
+        return self._versions.get(task_id, 0), self._docs.get(task_id, source)
+
+    async def wait_for_change(self, task_id, version, timeout):
+        """
+        Wait until the task moves past `version` or the timeout expires.
+
+        Returns:
+            tuple: (version, source) of the latest known status.
+        """
+        if self._versions.get(task_id, 0) <= version:
+            event = self._event(task_id)
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._versions.get(task_id, 0), self._docs.get(task_id)
+
+    @asynccontextmanager
+    async def watch(self, task_id):
+        """Register a client interested in a task for the duration of the block."""
+        self._watchers[task_id] = self._watchers.get(task_id, 0) + 1
+        try:
+            yield
+        finally:
+            self._watchers[task_id] -= 1
+            if self._watchers[task_id] <= 0:
+                del self._watchers[task_id]
+                self._forget(task_id)
+
+    def _forget(self, task_id):
+        self._docs.pop(task_id, None)
+        self._versions.pop(task_id, None)
+        self._events.pop(task_id, None)
+
+    async def _poll_once(self):
+        task_ids = [t for t in self._watchers if not is_terminal(self._docs.get(t))]
+        if not task_ids:
+            return
+        response = await asyncio.to_thread(self.es.mget, index=self.index, ids=task_ids)
+        for doc in response["docs"]:
+            if doc.get("found"):
+                self.publish(doc["_id"], doc["_source"])
+
+    async def run(self):
+        """Background loop fetching every watched, unfinished task in a single mget."""
+        while True:
+            try:
+                await self._poll_once()
+            except asyncio.CancelledError:
+                raise
+            except NotFoundError:
+                pass
+            except Exception as e:
+                logging.error(f"Error polling task status: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,91 @@
+import asyncio
+import time
+from collections import OrderedDict
+from status_broker import is_terminal
+
+
+class StatusCache:
+    """
+    Bounded read-through cache of task status documents.
+
+    In-progress tasks are kept for a short TTL and finished tasks for a long
+    one, so repeated polls are answered from memory. Concurrent misses for
+    the same task share a single Elasticsearch read, and state changes
+    reported by the worker update the cached document in place.
+    """
+
+    def __init__(self, max_entries=10000, pending_ttl=2.0, terminal_ttl=3600.0):
+        self.max_entries = max_entries
+        self.pending_ttl = pending_ttl
+        self.terminal_ttl = terminal_ttl
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _ttl(self, source):
+        return self.terminal_ttl if is_terminal(source) else self.pending_ttl
+
+    def get(self, task_id):
+        """Return the cached status of a task, or None if it is missing or expired."""
+        entry = self._entries.get(task_id)
+        if entry is None:
+            return None
+        expires_at, source = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[task_id]
+            return None
+        self._entries.move_to_end(task_id)
+        return source
+
+    def put(self, task_id, source):
+        """Store a status document, evicting the least recently used entries when full."""
+        self._entries[task_id] = (time.monotonic() + self._ttl(source), source)
+        self._entries.move_to_end(task_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def merge(self, task_id, fields):
+        """Apply the fields of a reported state change to the cached document, if any."""
+        source = self.get(task_id)
+        if source is not None:
+            self.put(task_id, {**source, **fields})
+
+    def invalidate(self, task_id):
+        self._entries.pop(task_id, None)
+
+    async def get_or_fetch(self, task_id, loader):
+        """
+        Return the status of a task from the cache or, on a miss, from `loader`.
+
+        Args:
+            task_id (str): The task ID.
+            loader (callable): Coroutine function `loader(task_id)` returning the status document.
+
+        Returns:
+            dict: The status document.
+        """
+        source = self.get(task_id)
+        if source is not None:
+            self.hits += 1
+            return source
+        self.misses += 1
+
+        future = self._inflight.get(task_id)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[task_id] = future
+        try:
+            source = await loader(task_id)
+            self.put(task_id, source)
+            future.set_result(source)
+            return source
+        except Exception as e:
+            future.set_exception(e)
+            # Evita o aviso de exceção não consumida quando ninguém mais aguardava
+            future.exception()
+            raise
+        finally:
+            del self._inflight[task_id]
@@ -0,0 +1,248 @@
+"""
+Trace context and span export for following a task from the API to the worker.
+
+The API creates the trace of each task (or continues the caller's W3C
+`traceparent`) and stores the traceparent of its request span in the queue
+payload; the worker resumes it, so the request, the wait in
+fila_processamento_agentes and every pipeline phase end up in one trace.
+
+Spans are exported in the background as OTLP/JSON, either to an OTLP/HTTP
+collector (TRACING_EXPORTER=otlp, OTEL_EXPORTER_OTLP_ENDPOINT) or appended
+to a JSON lines file (TRACING_EXPORTER=file, TRACING_FILE), one export
+request per line as the collector's file exporter writes them. Only the
+standard library is used.
+
+This module is kept identical in API_files/tracing.py and
+worker_files/src/tracing.py (each deployable is built from its own directory).
+"""
+import os
+import re
+import atexit
+import time
+import queue
+import logging
+import secrets
+import threading
+import urllib.request
+from contextlib import contextmanager
+import orjson
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+SPAN_KIND_PRODUCER = 4
+SPAN_KIND_CONSUMER = 5
+
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+def new_trace_id():
+    return secrets.token_hex(16)
+
+
+def new_span_id():
+    return secrets.token_hex(8)
+
+
+def format_traceparent(trace_id, span_id):
+    return f"00-{trace_id}-{span_id}-01"
+
+
+def parse_traceparent(value):
+    """
+    Parse a W3C traceparent header.
+
+    Returns:
+        tuple: (trace_id, span_id), or None if the value is missing or invalid.
+    """
+    match = _TRACEPARENT.match((value or "").strip().lower())
+    if not match or set(match.group(1)) == {"0"} or set(match.group(2)) == {"0"}:
+        return None
+    return match.group(1), match.group(2)
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+def make_span(name, trace_id, span_id, parent_id, start_ns, end_ns, kind=SPAN_KIND_INTERNAL, attributes=None, error=None):
+    """
+    Build a finished span in the OTLP/JSON format.
+
+    Args:
+        name (str): Span name.
+        trace_id (str), span_id (str), parent_id (str): Hex IDs; parent_id may be None.
+        start_ns (int), end_ns (int): Epoch times in nanoseconds.
+        kind (int): One of the SPAN_KIND_* constants.
+        attributes (dict): Attribute values (None values are skipped).
+        error (str): Error description; sets the span status to error.
+
+    Returns:
+        dict: The span.
+    """
+    span = {
+        "traceId": trace_id,
+        "spanId": span_id,
+        "name": name,
+        "kind": kind,
+        "startTimeUnixNano": str(int(start_ns)),
+        "endTimeUnixNano": str(int(max(start_ns, end_ns))),
+        "attributes": [_attribute(key, value) for key, value in (attributes or {}).items() if value is not None],
+        "status": {"code": STATUS_ERROR, "message": str(error)} if error else {"code": STATUS_OK},
+    }
+    if parent_id:
+        span["parentSpanId"] = parent_id
+    return span
+
+
+class SpanExporter:
+    """
+    Background export of finished spans.
+
+    `export` only enqueues, so a slow or missing collector never delays a
+    request or a task; a single daemon thread sends the spans in batches.
+    When the queue is full, new spans are dropped.
+    """
+
+    def __init__(self, kind, service_name, endpoint=None, path=None, max_queue=10000, batch_size=512, interval=2.0, timeout=5.0):
+        self.kind = kind
+        self.service_name = service_name
+        self.url = f"{(endpoint or 'http://localhost:4318').rstrip('/')}/v1/traces"
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.timeout = timeout
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, spans):
+        for span in spans:
+            try:
+                self._queue.put_nowait(span)
+            except queue.Full:
+                self.dropped += 1
+
+    def _request(self, spans):
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [_attribute("service.name", self.service_name)]},
+                "scopeSpans": [{"scope": {"name": "rag-tracing"}, "spans": spans}],
+            }]
+        }
+
+    def _send(self, spans):
+        body = orjson.dumps(self._request(spans))
+        try:
+            if self.kind == "file":
+                with open(self.path, "ab") as f:
+                    f.write(body + b"\n")
+            else:
+                request = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"}, method="POST")
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    response.read()
+        except Exception as e:
+            logging.warning(f"Could not export {len(spans)} spans: {e}")
+
+    def _drain(self):
+        spans = []
+        while len(spans) < self.batch_size:
+            try:
+                spans.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return spans
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._stop.wait(self.interval)
+            while True:
+                spans = self._drain()
+                if not spans:
+                    break
+                self._send(spans)
+
+    def shutdown(self, timeout=5.0):
+        """Send the spans still queued and stop the thread."""
+        self._stop.set()
+        self._thread.join(timeout)
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter(default_service_name):
+    """
+    The process-wide exporter configured by the environment.
+
+    TRACING_EXPORTER selects "otlp", "file" or "none" (default); the service
+    name comes from OTEL_SERVICE_NAME or `default_service_name`.
+
+    Returns:
+        SpanExporter: The exporter, or None when tracing is disabled.
+    """
+    global _exporter
+    kind = os.getenv("TRACING_EXPORTER", "none").lower()
+    if kind not in ("otlp", "file"):
+        return None
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = SpanExporter(
+                kind,
+                os.getenv("OTEL_SERVICE_NAME", default_service_name),
+                endpoint=os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT"),
+                path=os.getenv("TRACING_FILE", "traces.jsonl"),
+            )
+            # Envia os spans pendentes quando o processo termina
+            atexit.register(_exporter.shutdown)
+            logging.info(f"Tracing enabled: {kind} exporter")
+        return _exporter
+
+
+@contextmanager
+def start_span(name, traceparent=None, service_name="rag", kind=SPAN_KIND_INTERNAL, **attributes):
+    """
+    Time the block as a span and export it when tracing is enabled.
+
+    The span continues `traceparent` when it is valid and starts a new trace
+    otherwise. IDs are generated even with tracing disabled, so the context
+    can always be propagated.
+
+    Yields:
+        dict: trace_id, span_id, traceparent (to hand to the next hop) and
+            attributes (may be extended inside the block).
+    """
+    trace_id, parent_id = parse_traceparent(traceparent) or (new_trace_id(), None)
+    span_id = new_span_id()
+    context = {"trace_id": trace_id, "span_id": span_id, "traceparent": format_traceparent(trace_id, span_id), "attributes": dict(attributes)}
+    start_ns = time.time_ns()
+    error = None
+    try:
+        yield context
+    except BaseException as e:
+        error = getattr(e, "detail", None) or type(e).__name__
+        raise
+    finally:
+        exporter = get_exporter(service_name)
+        if exporter is not None:
+            exporter.export([make_span(name, trace_id, span_id, parent_id, start_ns, time.time_ns(), kind=kind, attributes=context["attributes"], error=error)])
+
+
+def shutdown_exporter():
+    """Flush and stop the exporter, if one was created."""
+    if _exporter is not None:
+        _exporter.shutdown()
@@ -0,0 +1,7 @@
+"""
+Offline benchmark of the worker pipeline.
+
+Runs the real worker loop (`main.handle_queue_item` and `process_rag_task`)
+against local stand-ins: an in-memory Elasticsearch, a SQLite queue table
+and a fake OCR/Azure OpenAI HTTP server. See `python -m benchmark.run --help`.
+"""
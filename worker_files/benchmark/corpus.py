@@ -0,0 +1,149 @@
+"""
+Synthetic corpus shared by the benchmark stand-ins.
+
+Pages are generated deterministically from a seed and a small legal
+vocabulary, and embeddings are a hashing bag-of-words projection, so the
+fake embedding service and the vectors seeded in the fake index agree and
+texts sharing more words get higher cosine similarity.
+"""
+import math
+import random
+import re
+import zlib
+
+EMBEDDING_DIMS = 1536
+
+# Caracteres por token nas estimativas de uso dos serviços falsos
+CHARS_PER_TOKEN = 4
+
+# Peso do componente comum a todos os textos nos embeddings sintéticos
+SHARED_WEIGHT = 0.6
+
+VOCABULARY = (
+    "inquérito policial auto prisão flagrante denúncia réu vítima testemunha depoimento "
+    "delegado promotor juiz sentença decisão despacho ofício laudo perícia exame "
+    "corpo delito boletim ocorrência mandado busca apreensão prisão preventiva "
+    "liberdade provisória fiança audiência custódia interrogatório qualificação "
+    "indiciado investigado acusado defensor advogado procuração petição recurso "
+    "apelação habeas corpus medida protetiva violência doméstica ameaça lesão "
+    "corporal furto roubo homicídio tentativa tráfico entorpecentes associação "
+    "organização criminosa lavagem dinheiro estelionato falsidade documento "
+    "endereço residência veículo placa celular aparelho extração dados quebra "
+    "sigilo bancário fiscal telefônico relatório final conclusão diligência "
+    "intimação citação notificação prazo dias comarca vara criminal ministério "
+    "público estado espírito santo município vitória vila velha serra cariacica"
+).split()
+
+QUESTIONS = (
+    "Quem são as vítimas?",
+    "Quem são os envolvidos do processo?",
+    "Qual a conclusão do relatório final do inquérito?",
+    "Quais diligências foram requeridas pelo delegado?",
+    "O investigado possui antecedentes?",
+    "Quais testemunhas foram ouvidas e o que declararam?",
+    "Houve apreensão de entorpecentes ou de aparelhos celulares?",
+    "Qual a data e o local dos fatos?",
+)
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text):
+    """Lowercase word tokens of a text."""
+    return _TOKEN.findall(text.lower())
+
+
+def embed_text(text, dims=EMBEDDING_DIMS):
+    """
+    Deterministic unit vector of a text.
+
+    A hashing bag of words plus a component shared by every text, which
+    reproduces the narrow cosine range of real embedding models (texts of
+    the same domain score around 0.75-0.9, so the 0.7 threshold of the
+    vector search keeps a realistic number of hits).
+
+    Returns:
+        list: `dims` floats.
+    """
+    bag = [0.0] * dims
+    for token in tokenize(text):
+        bag[zlib.crc32(token.encode()) % dims] += 1.0
+    bag_norm = math.sqrt(sum(v * v for v in bag)) or 1.0
+    shared = SHARED_WEIGHT / math.sqrt(dims)
+    vector = [shared + (1.0 - SHARED_WEIGHT) * v / bag_norm for v in bag]
+    norm = math.sqrt(sum(v * v for v in vector))
+    return [v / norm for v in vector]
+
+
+def random_text(rng, words):
+    """Text of `words` words drawn from the vocabulary."""
+    return " ".join(rng.choice(VOCABULARY) for _ in range(words))
+
+
+class Corpus:
+    """
+    Synthetic GAMPES/MNI documents and their pages.
+
+    Document `n` is GAMPES document `100000 + n` or MNI document
+    `200000 + n` (alternating), its textual record is `textual-{n}` and its
+    pages are `textual-{n}-p{i}`.
+    """
+
+    def __init__(self, documents, pages_per_document=20, words_per_page=350, seed=42):
+        self.documents = documents
+        self.pages_per_document = pages_per_document
+        self.words_per_page = words_per_page
+        self.seed = seed
+
+    def document(self, n):
+        """(fonte, external id, id_textual) of document `n`."""
+        if n % 2 == 0:
+            return "GAMPES", 100000 + n, f"textual-{n}"
+        return "MNI", 200000 + n, f"textual-{n}"
+
+    def ocr_mapping(self):
+        """What the OCR APIs answer: {"GAMPES": {id: id_textual}, "MNI": {...}}."""
+        mapping = {"GAMPES": {}, "MNI": {}}
+        for n in range(self.documents):
+            fonte, external_id, id_textual = self.document(n)
+            mapping[fonte][str(external_id)] = id_textual
+        return mapping
+
+    def iter_textual(self):
+        """Yield (id, source) of the gampes_textual documents."""
+        for n in range(self.documents):
+            fonte, external_id, id_textual = self.document(n)
+            source = {"fonte": fonte, "id_documento_gampes": None, "id_identificador_MNI": None}
+            if fonte == "GAMPES":
+                source["id_documento_gampes"] = external_id
+            else:
+                source["id_documento_mni"] = external_id
+                source["id_identificador_MNI"] = f"MNI-{external_id}"
+            yield id_textual, source
+
+    def iter_pages(self):
+        """Yield (id, source) of the gampes_textual_paginas documents."""
+        rng = random.Random(self.seed)
+        for n in range(self.documents):
+            _, _, id_textual = self.document(n)
+            for pagina in range(1, self.pages_per_document + 1):
+                texto = random_text(rng, self.words_per_page)
+                yield f"{id_textual}-p{pagina}", {"id_textual": id_textual, "pagina": pagina, "texto": texto}
+
+    def sample_payload(self, rng, documents_per_task=3, user="benchmark"):
+        """A valid queue payload over `documents_per_task` random documents, as the API stores it."""
+        gampes, mni = [], []
+        for n in rng.sample(range(self.documents), min(documents_per_task, self.documents)):
+            fonte, external_id, _ = self.document(n)
+            (gampes if fonte == "GAMPES" else mni).append(external_id)
+        return {
+            "texto_prompt": rng.choice(QUESTIONS),
+            "id_documentos_gampes": gampes,
+            "id_documentos_mni": mni,
+            "user": user,
+            "idfuncao": "987",
+            "idorgao": "456",
+            "info": "benchmark",
+            # Contexto do trace que a API grava junto com a tarefa
+            "traceparent": f"00-{rng.getrandbits(128):032x}-{rng.getrandbits(64):016x}-01",
+        }
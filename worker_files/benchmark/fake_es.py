@@ -0,0 +1,455 @@
+"""
+In-memory Elasticsearch stand-in.
+
+`create_client(store)` returns a real `Elasticsearch` client whose transport
+node answers from an `InMemoryStore` instead of the network, so the
+pipeline code, the client and the orjson (de)serialization all run as in
+production. Only what the worker uses is implemented: get/index/update,
+mget, bulk, count, point in time and search with match, term(s), bool,
+multi_match (BM25 over the candidate set), script_score with
+cosineSimilarity and ascending sort/search_after.
+"""
+import math
+import operator
+import re
+import threading
+import time
+from array import array
+from collections import Counter
+from urllib.parse import unquote
+import orjson
+from elasticsearch import Elasticsearch
+from elasticsearch.serializer import OrjsonSerializer
+from elastic_transport import ApiResponseMeta, BaseNode, HttpHeaders
+from elastic_transport._node import NodeApiResponse
+from benchmark.corpus import embed_text, tokenize
+
+# Campos indexados para busca exata (ids, números, textos curtos)
+KEYWORD_MAX_LENGTH = 256
+
+# Parâmetros do BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Lojas registradas por host do cliente
+_stores = {}
+
+_DOC_PATH = re.compile(r"^/([^/_][^/]*)/(_doc|_update|_create)(?:/(.+))?$")
+_SEARCH_PATH = re.compile(r"^/(?:([^/_][^/]*)/)?(_search|_count|_mget|_bulk)$")
+_PIT_PATH = re.compile(r"^/(?:([^/_][^/]*)/)?_pit$")
+
+
+class InMemoryStore:
+    """
+    Documents of every index, with an exact-value index of short fields.
+
+    Dense vectors (the `embedding` field) are kept as float32 arrays.
+    `latency` seconds are added to every request to model the network and
+    cluster time that an in-process store does not have.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = Counter()
+        self._indices = {}
+        self._keywords = {}
+        self._lock = threading.RLock()
+        self._next_id = 0
+        # Point in time: id -> (índice, posição de cada documento no momento da abertura)
+        self._pits = {}
+
+    def _index(self, index):
+        if index not in self._indices:
+            self._indices[index] = {}
+            self._keywords[index] = {}
+        return self._indices[index]
+
+    @staticmethod
+    def _is_keyword(value):
+        return isinstance(value, (int, bool)) or (isinstance(value, str) and len(value) <= KEYWORD_MAX_LENGTH)
+
+    def put(self, index, doc_id, source):
+        """Index (create or replace) a document; returns its id."""
+        with self._lock:
+            docs = self._index(index)
+            if doc_id is None:
+                self._next_id += 1
+                doc_id = f"auto-{self._next_id}"
+            if doc_id in docs:
+                self._unindex(index, doc_id, docs[doc_id])
+            source = dict(source)
+            if isinstance(source.get("embedding"), list):
+                source["embedding"] = array("f", source["embedding"])
+            docs[doc_id] = source
+            keywords = self._keywords[index]
+            for field, value in source.items():
+                if self._is_keyword(value):
+                    keywords.setdefault(field, {}).setdefault(value, set()).add(doc_id)
+            return doc_id
+
+    def _unindex(self, index, doc_id, source):
+        keywords = self._keywords[index]
+        for field, value in source.items():
+            if self._is_keyword(value):
+                keywords.get(field, {}).get(value, set()).discard(doc_id)
+
+    def get(self, index, doc_id):
+        return self._indices.get(index, {}).get(doc_id)
+
+    def update(self, index, doc_id, fields):
+        """Merge `fields` into a document; returns False if it does not exist."""
+        with self._lock:
+            source = self.get(index, doc_id)
+            if source is None:
+                return False
+            merged = {key: (list(value) if isinstance(value, array) else value) for key, value in source.items()}
+            merged.update(fields)
+            self.put(index, doc_id, merged)
+            return True
+
+    def delete(self, index, doc_id):
+        """Remove a document; returns False if it does not exist."""
+        with self._lock:
+            source = self._indices.get(index, {}).pop(doc_id, None)
+            if source is None:
+                return False
+            self._unindex(index, doc_id, source)
+            return True
+
+    def count(self, index):
+        return len(self._indices.get(index, {}))
+
+    @staticmethod
+    def render(source):
+        """Source as returned to the client (vectors as lists)."""
+        return {key: (value.tolist() if isinstance(value, array) else value) for key, value in source.items()}
+
+    # Consultas
+
+    def _all(self, index):
+        return set(self._indices.get(index, {}))
+
+    def _exact(self, index, field, value):
+        if field == "_id":
+            return {str(value)} & self._all(index)
+        return set(self._keywords.get(index, {}).get(field, {}).get(value, ()))
+
+    def _bm25(self, index, query_text, fields, candidates):
+        docs = self._indices.get(index, {})
+        terms = set(tokenize(query_text))
+        if not terms:
+            return {}
+        stats = {}
+        for doc_id in candidates:
+            source = docs[doc_id]
+            tokens = [t for field in fields for t in tokenize(str(source.get(field) or ""))]
+            stats[doc_id] = (Counter(tokens), len(tokens))
+        if not stats:
+            return {}
+        avg_length = sum(length for _, length in stats.values()) / len(stats) or 1.0
+        doc_freq = Counter(term for tf, _ in stats.values() for term in terms if term in tf)
+        scores = {}
+        for doc_id, (tf, length) in stats.items():
+            score = 0.0
+            for term in terms:
+                freq = tf.get(term)
+                if not freq:
+                    continue
+                idf = math.log(1 + (len(stats) - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+                score += idf * freq * (BM25_K1 + 1) / (freq + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length))
+            if score > 0:
+                scores[doc_id] = score
+        return scores
+
+    def evaluate(self, index, query, candidates=None):
+        """
+        Evaluate a query clause.
+
+        Args:
+            index (str): The index name.
+            query (dict): The query clause.
+            candidates (set, optional): Restrict the evaluation to these ids.
+
+        Returns:
+            dict: Matching id -> score.
+        """
+        if candidates is None:
+            candidates = self._all(index)
+        (kind, body), = query.items()
+
+        if kind == "match_all":
+            return dict.fromkeys(candidates, 1.0)
+
+        if kind in ("term", "match"):
+            (field, value), = body.items()
+            if isinstance(value, dict):
+                value = value.get("query", value.get("value"))
+            if field == "_id" or field in self._keywords.get(index, {}):
+                return dict.fromkeys(self._exact(index, field, value) & candidates, 1.0)
+            return self._bm25(index, str(value), [field], candidates)
+
+        if kind == "terms":
+            (field, values), = body.items()
+            ids = set()
+            for value in values:
+                ids |= self._exact(index, field, value)
+            return dict.fromkeys(ids & candidates, 1.0)
+
+        if kind == "exists":
+            docs = self._indices.get(index, {})
+            return {doc_id: 1.0 for doc_id in candidates if docs[doc_id].get(body["field"]) is not None}
+
+        if kind == "multi_match":
+            return self._bm25(index, body["query"], body.get("fields") or ["texto"], candidates)
+
+        if kind == "bool":
+            def clauses(name):
+                value = body.get(name, [])
+                return value if isinstance(value, list) else [value]
+
+            for clause in clauses("filter"):
+                candidates = candidates & set(self.evaluate(index, clause, candidates))
+            for clause in clauses("must_not"):
+                candidates = candidates - set(self.evaluate(index, clause, candidates))
+            scores = None
+            for clause in clauses("must"):
+                matched = self.evaluate(index, clause, candidates)
+                scores = matched if scores is None else {doc_id: scores[doc_id] + s for doc_id, s in matched.items() if doc_id in scores}
+            should = clauses("should")
+            if should:
+                extra = Counter()
+                for clause in should:
+                    extra.update(self.evaluate(index, clause, candidates))
+                if scores is None:
+                    scores = dict(extra)
+                else:
+                    for doc_id in scores:
+                        scores[doc_id] += extra.get(doc_id, 0.0)
+            if scores is None:
+                scores = dict.fromkeys(candidates, 0.0 if body.get("filter") else 1.0)
+            return scores
+
+        if kind == "script_score":
+            matched = self.evaluate(index, body["query"], candidates)
+            query_vector = body["script"]["params"]["query_vector"]
+            query_norm = math.sqrt(sum(v * v for v in query_vector)) or 1.0
+            docs = self._indices.get(index, {})
+            scores = {}
+            for doc_id in matched:
+                vector = docs[doc_id].get("embedding")
+                if not vector:
+                    scores[doc_id] = 0.0
+                    continue
+                norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+                scores[doc_id] = sum(map(operator.mul, query_vector, vector)) / (query_norm * norm) + 1.0
+            return scores
+
+        raise ValueError(f"Unsupported query clause: {kind}")
+
+    def open_pit(self, index):
+        """Snapshot the document order of `index`; returns the PIT id."""
+        with self._lock:
+            self._next_id += 1
+            pit_id = f"pit-{self._next_id}"
+            self._pits[pit_id] = (index, {doc_id: position for position, doc_id in enumerate(self._indices.get(index, {}))})
+            return pit_id
+
+    def close_pit(self, pit_id):
+        with self._lock:
+            return self._pits.pop(pit_id, None) is not None
+
+    def _sort_key(self, sort, doc_id, score, source, positions):
+        key = []
+        for clause in sort:
+            field = clause if isinstance(clause, str) else next(iter(clause))
+            if field == "_shard_doc":
+                key.append(positions.get(doc_id, -1))
+            elif field == "_score":
+                key.append(score)
+            else:
+                key.append(source.get(field))
+        return key
+
+    def search(self, index, body):
+        """Run a search request body; returns the response dict."""
+        started = time.perf_counter()
+        with self._lock:
+            pit = body.get("pit")
+            positions = {}
+            if pit:
+                index, positions = self._pits[pit["id"]]
+            candidates = set(positions) if pit else None
+            scores = self.evaluate(index, body.get("query") or {"match_all": {}}, candidates)
+            docs = self._indices.get(index, {})
+            sort = body.get("sort")
+            if sort:
+                keyed = [(self._sort_key(sort, doc_id, score, docs[doc_id], positions), doc_id, score) for doc_id, score in scores.items()]
+                keyed.sort(key=lambda item: item[0])
+                if body.get("search_after") is not None:
+                    keyed = [item for item in keyed if item[0] > list(body["search_after"])]
+                ordered = [(doc_id, score, key) for key, doc_id, score in keyed]
+            else:
+                ordered = [(doc_id, score, None) for doc_id, score in sorted(scores.items(), key=lambda item: (-item[1], item[0]))]
+            start = body.get("from", 0)
+            size = body.get("size", 10)
+            hits = []
+            for doc_id, score, key in ordered[start:start + size]:
+                hit = {"_index": index, "_id": doc_id, "_score": score, "_source": self.render(docs[doc_id])}
+                if key is not None:
+                    hit["sort"] = key
+                hits.append(hit)
+        response = {
+            "took": int((time.perf_counter() - started) * 1000),
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {
+                "total": {"value": len(scores), "relation": "eq"},
+                "max_score": max(scores.values()) if scores else None,
+                "hits": hits,
+            },
+        }
+        if pit:
+            response["pit_id"] = pit["id"]
+        return response
+
+
+def seed_corpus(store, corpus, vector_coverage=1.0, denormalized=False):
+    """
+    Load a synthetic corpus into gampes_textual, gampes_textual_paginas and gampes_vector_small.
+
+    Args:
+        store (InMemoryStore): The store to fill.
+        corpus (benchmark.corpus.Corpus): The corpus.
+        vector_coverage (float): Fraction of pages that already have a vector;
+            the others go through the worker's vector backfill path.
+        denormalized (bool): Copy the document fields onto pages and vectors,
+            as tools.denormalize_pages does.
+
+    Returns:
+        int: Number of pages loaded.
+    """
+    documents = {}
+    for doc_id, source in corpus.iter_textual():
+        store.put("gampes_textual", doc_id, source)
+        documents[doc_id] = {field: source.get(field) for field in ("fonte", "id_documento_gampes", "id_identificador_MNI")}
+    pages = 0
+    for page_id, source in corpus.iter_pages():
+        fields = documents[source["id_textual"]] if denormalized else {}
+        store.put("gampes_textual_paginas", page_id, {**source, **fields})
+        # Cobertura determinística: as primeiras páginas de cada bloco de 100 recebem vetor
+        if pages % 100 < vector_coverage * 100:
+            store.put("gampes_vector_small", f"vec-{page_id}", {"id_pagina": page_id, "embedding": embed_text(source["texto"]), **fields})
+        pages += 1
+    return pages
+
+
+class InMemoryNode(BaseNode):
+    """Transport node that answers from the InMemoryStore registered for its host."""
+
+    _CLIENT_META_HTTP_CLIENT = ("bm", "0")
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.store = _stores[config.host]
+
+    def _respond(self, status, body, started):
+        headers = HttpHeaders({"content-type": "application/json", "x-elastic-product": "Elasticsearch"})
+        meta = ApiResponseMeta(status=status, http_version="1.1", headers=headers, duration=time.perf_counter() - started, node=self.config)
+        return NodeApiResponse(meta, orjson.dumps(body))
+
+    def _not_found(self, index, doc_id, started, missing_type=None):
+        if missing_type:
+            error = {"type": missing_type, "reason": f"[{doc_id}]: document missing", "index": index}
+            return self._respond(404, {"error": {"root_cause": [error], **error}, "status": 404}, started)
+        return self._respond(404, {"_index": index, "_id": doc_id, "found": False}, started)
+
+    def perform_request(self, method, target, body=None, headers=None, request_timeout=None):
+        started = time.perf_counter()
+        store = self.store
+        if store.latency:
+            time.sleep(store.latency)
+        path = target.split("?", 1)[0]
+
+        match = _DOC_PATH.match(path)
+        if match:
+            index, action, doc_id = unquote(match.group(1)), match.group(2), match.group(3) and unquote(match.group(3))
+            store.requests[action] += 1
+            if action == "_update":
+                if not store.update(index, doc_id, orjson.loads(body).get("doc", {})):
+                    return self._not_found(index, doc_id, started, "document_missing_exception")
+                return self._respond(200, {"_index": index, "_id": doc_id, "result": "updated"}, started)
+            if method in ("GET", "HEAD"):
+                source = store.get(index, doc_id)
+                if source is None:
+                    return self._not_found(index, doc_id, started)
+                return self._respond(200, {"_index": index, "_id": doc_id, "found": True, "_source": store.render(source)}, started)
+            doc_id = store.put(index, doc_id, orjson.loads(body))
+            return self._respond(201, {"_index": index, "_id": doc_id, "result": "created", "_version": 1}, started)
+
+        match = _SEARCH_PATH.match(path)
+        if match:
+            index, action = match.group(1) and unquote(match.group(1)), match.group(2)
+            store.requests[action] += 1
+            request = orjson.loads(body) if body and action != "_bulk" else {}
+            if action == "_search":
+                pit_id = (request.get("pit") or {}).get("id")
+                if pit_id and pit_id not in store._pits:
+                    error = {"type": "search_context_missing_exception", "reason": f"No search context found for id [{pit_id}]"}
+                    return self._respond(404, {"error": {"root_cause": [error], **error}, "status": 404}, started)
+                return self._respond(200, store.search(index, request), started)
+            if action == "_count":
+                total = len(store.evaluate(index, request["query"])) if request.get("query") else store.count(index)
+                return self._respond(200, {"count": total}, started)
+            if action == "_mget":
+                ids = request.get("ids") or [doc["_id"] for doc in request.get("docs", [])]
+                docs = []
+                for doc_id in ids:
+                    source = store.get(index, doc_id)
+                    if source is None:
+                        docs.append({"_index": index, "_id": doc_id, "found": False})
+                    else:
+                        docs.append({"_index": index, "_id": doc_id, "found": True, "_source": store.render(source)})
+                return self._respond(200, {"docs": docs}, started)
+            return self._respond(200, self._bulk(index, body), started)
+
+        match = _PIT_PATH.match(path)
+        if match:
+            store.requests["_pit"] += 1
+            if method == "DELETE":
+                closed = store.close_pit(orjson.loads(body)["id"])
+                return self._respond(200 if closed else 404, {"succeeded": closed, "num_freed": int(closed)}, started)
+            return self._respond(200, {"id": store.open_pit(unquote(match.group(1)))}, started)
+
+        # Informações do cluster (GET /) e demais rotas sem efeito
+        store.requests["other"] += 1
+        return self._respond(200, {"name": "benchmark", "version": {"number": "8.17.0"}, "tagline": "You Know, for Search"}, started)
+
+    def _bulk(self, default_index, body):
+        store = self.store
+        lines = [line for line in body.splitlines() if line.strip()]
+        items = []
+        position = 0
+        while position < len(lines):
+            (action, meta), = orjson.loads(lines[position]).items()
+            index = meta.get("_index", default_index)
+            doc_id = meta.get("_id")
+            if action == "delete":
+                position += 1
+                items.append({action: {"_index": index, "_id": doc_id, "status": 200 if store.delete(index, doc_id) else 404}})
+                continue
+            document = orjson.loads(lines[position + 1])
+            position += 2
+            if action == "update":
+                status = 200 if store.update(index, doc_id, document.get("doc", {})) else 404
+            else:
+                doc_id = store.put(index, doc_id, document)
+                status = 201
+            items.append({action: {"_index": index, "_id": doc_id, "status": status}})
+        return {"took": 0, "errors": any(list(item.values())[0]["status"] >= 300 for item in items), "items": items}
+
+
+def create_client(store):
+    """Return an Elasticsearch client backed by `store`."""
+    host = f"store{id(store)}"
+    _stores[host] = store
+    return Elasticsearch(f"http://{host}:9200", node_class=InMemoryNode, serializer=OrjsonSerializer())
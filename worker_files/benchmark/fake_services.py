@@ -0,0 +1,192 @@
+"""
+Fake OCR and Azure OpenAI HTTP server for the benchmark.
+
+Answers the routes the worker calls, with configurable latency:
+
+    POST /ocr/gampes, /ocr/mni                              OCR APIs
+    POST /openai/deployments/<d>/chat/completions           chat (stream or not)
+    POST /openai/deployments/<d>/embeddings                 embeddings
+    GET  /stats                                             request counters
+
+Chat latency is `llm_ttft` plus the completion tokens at
+`llm_tokens_per_second`; deployments whose name contains "enhancement"
+answer `enhancement_tokens` tokens and the others `answer_tokens`.
+"""
+import multiprocessing
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import orjson
+from benchmark.corpus import CHARS_PER_TOKEN, VOCABULARY, embed_text, tokenize
+
+_DEPLOYMENT_PATH = re.compile(r"^/openai/deployments/([^/]+)/(chat/completions|embeddings)$")
+
+# Tokens por pedaço de resposta em streaming
+STREAM_CHUNK_TOKENS = 8
+
+
+@dataclass
+class ServiceProfile:
+    """Latency and size model of the fake services (seconds, tokens)."""
+    ocr_latency: float = 0.05
+    ocr_latency_per_document: float = 0.01
+    llm_ttft: float = 0.3
+    llm_tokens_per_second: float = 80.0
+    enhancement_tokens: int = 60
+    answer_tokens: int = 400
+    embedding_latency: float = 0.05
+    embedding_latency_per_input: float = 0.002
+
+
+def _estimate_tokens(text):
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+class FakeServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = orjson.dumps(body)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return orjson.loads(self.rfile.read(length)) if length else {}
+
+    def do_GET(self):
+        if self.path == "/stats":
+            return self._send_json(200, dict(self.server.stats))
+        self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        profile = self.server.profile
+        request = self._read_json()
+
+        if path in ("/ocr/gampes", "/ocr/mni"):
+            fonte = "GAMPES" if path.endswith("gampes") else "MNI"
+            ids = [str(doc_id) for doc_id in request.get("document_ids", [])]
+            self.server.count(f"ocr_{fonte.lower()}")
+            time.sleep(profile.ocr_latency + profile.ocr_latency_per_document * len(ids))
+            mapping = self.server.ocr_mapping[fonte]
+            return self._send_json(200, {"resultados": {doc_id: mapping[doc_id] for doc_id in ids if doc_id in mapping}})
+
+        match = _DEPLOYMENT_PATH.match(path)
+        if not match:
+            return self._send_json(404, {"error": "not found"})
+        deployment, operation = match.groups()
+
+        if operation == "embeddings":
+            inputs = request.get("input")
+            inputs = inputs if isinstance(inputs, list) else [inputs]
+            self.server.count("embeddings")
+            self.server.count("embedding_inputs", len(inputs))
+            time.sleep(profile.embedding_latency + profile.embedding_latency_per_input * len(inputs))
+            tokens = sum(_estimate_tokens(text) for text in inputs)
+            return self._send_json(200, {
+                "object": "list",
+                "data": [{"object": "embedding", "index": i, "embedding": embed_text(text)} for i, text in enumerate(inputs)],
+                "model": deployment,
+                "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+            })
+
+        self.server.count(f"chat_{deployment}")
+        prompt_text = " ".join(str(message.get("content") or "") for message in request.get("messages", []))
+        prompt_tokens = _estimate_tokens(prompt_text)
+        completion_tokens = profile.enhancement_tokens if "enhancement" in deployment else profile.answer_tokens
+        completion_tokens = min(completion_tokens, request.get("max_tokens") or completion_tokens)
+        # Resposta determinística a partir do prompt, com palavras do mesmo vocabulário do corpus
+        rng = random.Random(" ".join(tokenize(prompt_text)[:50]))
+        words = [rng.choice(VOCABULARY) for _ in range(completion_tokens)]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        time.sleep(profile.llm_ttft)
+
+        if not request.get("stream"):
+            time.sleep(completion_tokens / profile.llm_tokens_per_second)
+            return self._send_json(200, {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": deployment,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+            })
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send_event(payload):
+            data = b"data: " + (payload if isinstance(payload, bytes) else orjson.dumps(payload)) + b"\n\n"
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        for start in range(0, len(words), STREAM_CHUNK_TOKENS):
+            piece = words[start:start + STREAM_CHUNK_TOKENS]
+            time.sleep(len(piece) / profile.llm_tokens_per_second)
+            content = (" " if start else "") + " ".join(piece)
+            send_event({
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": deployment,
+                "choices": [{"index": 0, "delta": {"content": content}, "finish_reason": None}],
+            })
+        send_event({
+            "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": deployment,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        })
+        send_event(b"[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class FakeServiceServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, profile, ocr_mapping):
+        super().__init__(address, FakeServiceHandler)
+        self.profile = profile
+        self.ocr_mapping = ocr_mapping
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        with self._stats_lock:
+            self.stats[name] += amount
+
+
+def _serve(profile, ocr_mapping, port_queue):
+    server = FakeServiceServer(("127.0.0.1", 0), ServiceProfile(**profile), ocr_mapping)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_fake_services(profile, ocr_mapping):
+    """
+    Start the fake services in a separate process, so their work does not
+    compete with the worker threads for the GIL.
+
+    Args:
+        profile (ServiceProfile): The latency model.
+        ocr_mapping (dict): What the OCR APIs answer (see Corpus.ocr_mapping).
+
+    Returns:
+        tuple: (process, base_url).
+    """
+    context = multiprocessing.get_context("spawn")
+    port_queue = context.Queue()
+    process = context.Process(target=_serve, args=(asdict(profile), ocr_mapping, port_queue), daemon=True)
+    process.start()
+    port = port_queue.get(timeout=30)
+    return process, f"http://127.0.0.1:{port}"
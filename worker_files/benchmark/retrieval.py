@@ -0,0 +1,393 @@
+"""
+Retrieval latency/quality benchmark of the hybrid search and fusion settings.
+
+Two steps:
+
+    export  builds a replay file (JSONL) from production logs: every task
+            evaluated in rag_gampes_eval, with its enhanced prompt (prefix of
+            rag_gampes.prompt_final), the pages of its document set, the
+            embedding of the prompt and the pages cited in the answer
+            (texto_aux of the task document). Read-only on SQL Server and
+            Elasticsearch; calls the OCR APIs and the embedding deployment.
+    run     replays the cases against an Elasticsearch (e.g. a restored
+            snapshot of the indexes) and sweeps bm25_top_k, vector_top_k,
+            similarity_threshold and the fusion strategy (RRF with several k,
+            weighted sum with several weights, BM25 only, vector only), using
+            the pipeline's own search and fusion functions. Each search is run
+            once per distinct k and the fusions are computed from its results.
+
+Relevance comes from the feedback: the pages cited in positively evaluated
+answers. Those pages were chosen by the configuration in production at the
+time, so the recall favours it; use the numbers to compare configurations
+with each other and to find the cheapest one that keeps recall, not as an
+absolute quality measure.
+
+Usage (from worker_files/):
+    python -m benchmark.retrieval export --since 2025-01-01 --output casos.jsonl
+    python -m benchmark.retrieval run --cases casos.jsonl --output fusao.json
+    python -m benchmark.retrieval run --synthetic 50     # in-memory index, no external services
+"""
+import argparse
+import ast
+import itertools
+import logging
+import os
+import random
+import sys
+import time
+import orjson
+from elasticsearch import Elasticsearch
+from dotenv import load_dotenv
+from elasticsearch.serializer import OrjsonSerializer
+
+load_dotenv()
+
+# Separador entre o prompt aprimorado e o contexto em rag_gampes.prompt_final (ver build_context)
+CONTEXT_HEADER = "\n\n Fontes de informação:\n\n"
+
+# Configuração atual de main.py, destacada no relatório
+PRODUCTION = {"strategy": "rrf", "rrf_k": 30, "bm25_k": 10, "vector_k": 10, "threshold": 0.7}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def split_list(value, cast=float):
+    return [cast(item) for item in value.split(",") if item.strip()]
+
+
+def enhanced_prompt_from_final(prompt_final):
+    """The enhanced prompt is the part of prompt_final before the context header."""
+    return (prompt_final or "").split(CONTEXT_HEADER, 1)[0].strip()
+
+
+def parse_sources(texto_aux):
+    """Page IDs cited in an answer, from the task document's texto_aux (repr of the sources list)."""
+    try:
+        sources = ast.literal_eval(texto_aux or "[]")
+    except (ValueError, SyntaxError):
+        return []
+    return [source["id_pagina"] for source in sources if isinstance(source, dict) and source.get("id_pagina")]
+
+
+def _chunks(values, size):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def export_cases(es, connection_string, index_responses, output, since=None, limit=None):
+    """
+    Write the replay file of the evaluated tasks.
+
+    rag_gampes_eval.id may hold the task ID or the completion ID returned to
+    the client (id_requisicao); both are resolved to the task document.
+
+    Returns:
+        int: Number of cases written.
+    """
+    import pyodbc
+    from src.utils import consultar_apis
+    from src.elastic import buscar_paginas_por_ids
+    from src.embed import get_embeddings
+
+    conn = pyodbc.connect(connection_string)
+    cursor = conn.cursor()
+    query = "SELECT id, eval FROM IA.dbo.rag_gampes_eval"
+    params = []
+    if since:
+        query += " WHERE data_avaliacao >= ?"
+        params.append(since)
+    query += " ORDER BY data_avaliacao DESC"
+    evaluations = {row.id: bool(row.eval) for row in cursor.execute(query, params).fetchall()}
+    if limit:
+        evaluations = dict(itertools.islice(evaluations.items(), limit))
+    logging.warning(f"{len(evaluations)} evaluations to export")
+
+    # Documento da tarefa: pelo ID da tarefa ou pelo id_requisicao
+    tasks = {}
+    for ids in _chunks(list(evaluations), 500):
+        for doc in es.mget(index=index_responses, ids=ids)["docs"]:
+            if doc.get("found"):
+                tasks[doc["_id"]] = (doc["_id"], doc["_source"])
+        missing = [eval_id for eval_id in ids if eval_id not in tasks]
+        if missing:
+            response = es.search(index=index_responses, body={"query": {"terms": {"id_requisicao": missing}}, "size": len(missing)})
+            for hit in response["hits"]["hits"]:
+                tasks[hit["_source"]["id_requisicao"]] = (hit["_id"], hit["_source"])
+
+    completions = {source.get("id_requisicao") for _, source in tasks.values() if source.get("id_requisicao")}
+    prompts = {}
+    for ids in _chunks(sorted(completions), 500):
+        cursor.execute(f"SELECT id, prompt_original, prompt_final FROM IA.dbo.rag_gampes WHERE id IN ({', '.join('?' * len(ids))})", ids)
+        prompts.update({row.id: (row.prompt_original, row.prompt_final) for row in cursor.fetchall()})
+    payloads = {}
+    task_ids = [task_id for task_id, _ in tasks.values()]
+    for ids in _chunks(task_ids, 500):
+        cursor.execute(f"SELECT id_elasticsearch, payload FROM fila_processamento_agentes WHERE id_elasticsearch IN ({', '.join('?' * len(ids))})", ids)
+        payloads.update({row.id_elasticsearch: orjson.loads(row.payload) for row in cursor.fetchall()})
+    cursor.close()
+    conn.close()
+
+    url_gampes, url_mni = os.getenv("URL_API_OCR_GAMPES"), os.getenv("URL_API_OCR_MNI")
+    embed_key, embed_endpoint = os.getenv("AZURE_OPENAI_KEY"), os.getenv("AZURE_OPENAI_ENDPOINT")
+    written = 0
+    with open(output, "wb") as f:
+        for eval_id, positive in evaluations.items():
+            task_id, source = tasks.get(eval_id, (None, None))
+            payload = payloads.get(task_id)
+            prompt_original, prompt_final = prompts.get(source.get("id_requisicao") if source else None, (None, None))
+            if not payload or not prompt_final:
+                continue
+            prompt = enhanced_prompt_from_final(prompt_final)
+            ids_textuais = consultar_apis(payload.get("id_documentos_gampes", []), payload.get("id_documentos_mni", []), url_gampes, url_mni)
+            id_paginas = buscar_paginas_por_ids(ids_textuais, es)
+            embedding = get_embeddings(prompt, embed_key, embed_endpoint)
+            if not id_paginas or embedding is None:
+                continue
+            case = {
+                "task_id": task_id,
+                "positive": positive,
+                "prompt_original": prompt_original,
+                "prompt": prompt,
+                "id_paginas": id_paginas,
+                "relevant": parse_sources(source.get("texto_aux")),
+                "embedding": embedding,
+            }
+            f.write(orjson.dumps(case) + b"\n")
+            written += 1
+    return written
+
+
+def load_cases(path):
+    with open(path, "rb") as f:
+        return [orjson.loads(line) for line in f if line.strip()]
+
+
+def synthetic_cases(count, documents=200, seed=42):
+    """
+    In-memory index plus cases whose relevant pages are the pages of the
+    document set sharing the most words with the question.
+
+    Returns:
+        tuple: (Elasticsearch client, cases).
+    """
+    from benchmark.corpus import Corpus, QUESTIONS, embed_text, random_text, tokenize
+    from benchmark.fake_es import InMemoryStore, create_client, seed_corpus
+
+    corpus = Corpus(documents, seed=seed)
+    store = InMemoryStore(latency=0.002)
+    seed_corpus(store, corpus)
+    pages = {}
+    for page_id, source in corpus.iter_pages():
+        pages.setdefault(source["id_textual"], []).append((page_id, set(tokenize(source["texto"]))))
+
+    rng = random.Random(seed)
+    cases = []
+    for i in range(count):
+        prompt = rng.choice(QUESTIONS) + " " + random_text(rng, 12)
+        terms = set(tokenize(prompt))
+        document_set = [corpus.document(n)[2] for n in rng.sample(range(documents), 3)]
+        candidates = [page for id_textual in document_set for page in pages[id_textual]]
+        ranked = sorted(candidates, key=lambda page: len(terms & page[1]), reverse=True)
+        cases.append({
+            "task_id": f"synthetic-{i}",
+            "positive": True,
+            "prompt": prompt,
+            "id_paginas": [page_id for page_id, _ in candidates],
+            "relevant": [page_id for page_id, _ in ranked[:3]],
+            "embedding": embed_text(prompt),
+        })
+    return create_client(store), cases
+
+
+def collect_searches(es, cases, bm25_ks, vector_ks, repeat=1):
+    """
+    Run the BM25 and vector searches of every case once per distinct k.
+
+    The vector search is run without threshold; thresholds are applied to
+    its results afterwards, exactly as vector_similarity_search does.
+
+    Returns:
+        dict: (case index, "bm25"|"vector", k) -> (results, median latency in seconds).
+    """
+    from src.elastic import bm25_similarity_search, vector_similarity_search
+
+    searches = {}
+    for index, case in enumerate(cases):
+        for kind, ks in (("bm25", bm25_ks), ("vector", vector_ks)):
+            for k in sorted(set(ks)):
+                latencies = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    if kind == "bm25":
+                        results = bm25_similarity_search(es, case["prompt"], case["id_paginas"], k=k)
+                    else:
+                        results = vector_similarity_search(es, case["embedding"], id_list=case["id_paginas"], k=k, similarity_threshold=-1.0)
+                    latencies.append(time.perf_counter() - start)
+                searches[(index, kind, k)] = (results, percentile(latencies, 0.5))
+    return searches
+
+
+def configurations(args):
+    """Every (strategy, parameters) combination of the sweep."""
+    strategies = args.strategies.split(",")
+    for bm25_k, vector_k, threshold in itertools.product(split_list(args.bm25_k, int), split_list(args.vector_k, int), split_list(args.thresholds)):
+        base = {"bm25_k": bm25_k, "vector_k": vector_k, "threshold": threshold}
+        if "rrf" in strategies:
+            for rrf_k in split_list(args.rrf_k, int):
+                yield {"strategy": "rrf", "rrf_k": rrf_k, **base}
+        if "weighted" in strategies:
+            for weight in split_list(args.weights):
+                yield {"strategy": "weighted", "vector_weight": weight, **base}
+        if "vector" in strategies:
+            yield {"strategy": "vector", **base}
+    if "bm25" in strategies:
+        for bm25_k in split_list(args.bm25_k, int):
+            yield {"strategy": "bm25", "bm25_k": bm25_k}
+
+
+def fuse(config, vector_results, bm25_results):
+    from src.elastic import merge_and_rerank, merge_and_rerank_rrf
+
+    strategy = config["strategy"]
+    if strategy == "rrf":
+        return merge_and_rerank_rrf(vector_results, bm25_results, k=config["rrf_k"])
+    if strategy == "weighted":
+        return merge_and_rerank(vector_results, bm25_results, vector_weight=config["vector_weight"], bm25_weight=1 - config["vector_weight"])
+    if strategy == "vector":
+        return vector_results
+    return bm25_results
+
+
+def evaluate_configuration(config, cases, searches, top_k):
+    recalls, hits, latencies = [], [], []
+    for index, case in enumerate(cases):
+        latency = 0.0
+        bm25_results = vector_results = []
+        if config["strategy"] != "vector":
+            bm25_results, bm25_latency = searches[(index, "bm25", config["bm25_k"])]
+            latency += bm25_latency
+        if config["strategy"] != "bm25":
+            vector_results, vector_latency = searches[(index, "vector", config["vector_k"])]
+            vector_results = [(doc_id, score) for doc_id, score in vector_results if score >= config["threshold"]]
+            latency += vector_latency
+        latencies.append(latency)
+
+        relevant = set(case["relevant"])
+        if not case["positive"] or not relevant:
+            continue
+        retrieved = {doc_id for doc_id, *_ in fuse(config, vector_results, bm25_results)[:top_k]}
+        recalls.append(len(relevant & retrieved) / len(relevant))
+        hits.append(1.0 if relevant & retrieved else 0.0)
+
+    return {
+        **config,
+        "recall": sum(recalls) / len(recalls) if recalls else None,
+        "hit_rate": sum(hits) / len(hits) if hits else None,
+        "latency_mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else None,
+        "latency_p95_ms": (percentile(latencies, 0.95) or 0) * 1000,
+        "production": all(config.get(key) == value for key, value in PRODUCTION.items()),
+    }
+
+
+def describe(row):
+    parts = [row["strategy"]]
+    if "rrf_k" in row:
+        parts.append(f"k={row['rrf_k']}")
+    if "vector_weight" in row:
+        parts.append(f"w_vec={row['vector_weight']}")
+    if row["strategy"] != "vector":
+        parts.append(f"bm25_top_k={row['bm25_k']}")
+    if row["strategy"] != "bm25":
+        parts.append(f"vector_top_k={row['vector_k']} limiar={row['threshold']}")
+    return " ".join(parts)
+
+
+def run(args):
+    if args.synthetic:
+        # src.embed cria um cliente na importação; no modo sintético não há cluster
+        os.environ.setdefault("ELASTICSEARCH_HOST", "http://benchmark:9200")
+        es, cases = synthetic_cases(args.synthetic)
+    else:
+        es = Elasticsearch(
+            os.getenv("ELASTICSEARCH_HOSTS", "").split(","),
+            basic_auth=(os.getenv("ELASTICSEARCH_USER"), os.getenv("ELASTICSEARCH_PASSWORD")),
+            serializer=OrjsonSerializer(),
+        )
+        cases = load_cases(args.cases)
+    positives = sum(1 for case in cases if case["positive"] and case["relevant"])
+    print(f"{len(cases)} cases ({positives} with positive feedback and cited pages)")
+
+    searches = collect_searches(es, cases, split_list(args.bm25_k, int), split_list(args.vector_k, int), args.repeat)
+    rows = [evaluate_configuration(config, cases, searches, args.top_k) for config in configurations(args)]
+    rows.sort(key=lambda row: (-(row["recall"] or 0), row["latency_mean_ms"] or 0))
+
+    best = rows[0]["recall"] or 0 if rows else 0
+    eligible = [row for row in rows if (row["recall"] or 0) >= best - args.tolerance]
+    cheapest = min(eligible, key=lambda row: row["latency_mean_ms"] or 0) if eligible else None
+
+    print(f"{'recall@' + str(args.top_k):>9} {'hit rate':>8} {'mean ms':>8} {'p95 ms':>8}  configuration")
+    for row in rows[:args.show]:
+        marker = " (produção)" if row["production"] else ""
+        print(f"{row['recall'] or 0:>9.3f} {row['hit_rate'] or 0:>8.3f} {row['latency_mean_ms']:>8.1f} {row['latency_p95_ms']:>8.1f}  {describe(row)}{marker}")
+    production = next((row for row in rows if row["production"]), None)
+    if production:
+        print(f"Production: recall {production['recall'] or 0:.3f}, {production['latency_mean_ms']:.1f} ms  ({describe(production)})")
+    if cheapest:
+        print(f"Cheapest within {args.tolerance} of the best recall: recall {cheapest['recall'] or 0:.3f}, {cheapest['latency_mean_ms']:.1f} ms  ({describe(cheapest)})")
+
+    if args.output:
+        report = {"settings": vars(args), "cases": len(cases), "evaluated_cases": positives, "top_k": args.top_k, "recommended": cheapest, "configurations": rows}
+        with open(args.output, "wb") as f:
+            f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+        print(f"Report written to {args.output}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Retrieval latency/quality benchmark of the fusion settings.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="Build the replay file from the production logs.")
+    export.add_argument("--output", required=True)
+    export.add_argument("--since", help="Only evaluations from this date on (YYYY-MM-DD).")
+    export.add_argument("--limit", type=int)
+
+    sweep = commands.add_parser("run", help="Sweep the retrieval settings over a replay file.")
+    source = sweep.add_mutually_exclusive_group(required=True)
+    source.add_argument("--cases", help="Replay file written by export.")
+    source.add_argument("--synthetic", type=int, help="Generate this many cases over an in-memory index.")
+    sweep.add_argument("--strategies", default="rrf,weighted,bm25,vector")
+    sweep.add_argument("--bm25-k", default="5,10,20")
+    sweep.add_argument("--vector-k", default="5,10,20")
+    sweep.add_argument("--rrf-k", default="10,30,60")
+    sweep.add_argument("--weights", default="0.4,0.6,0.8", help="Vector weights of the weighted strategy (BM25 gets the rest).")
+    sweep.add_argument("--thresholds", default="0.6,0.7,0.8")
+    sweep.add_argument("--top-k", type=int, default=5, help="Pages kept after fusion (merged_top_k).")
+    sweep.add_argument("--repeat", type=int, default=1, help="Runs of each search; the median latency is used.")
+    sweep.add_argument("--tolerance", type=float, default=0.02, help="Recall loss accepted when picking the cheapest configuration.")
+    sweep.add_argument("--show", type=int, default=20, help="Configurations printed.")
+    sweep.add_argument("--output", help="Write the JSON report to this file.")
+
+    args = parser.parse_args(argv)
+    # Os módulos do pipeline registram cada busca em INFO
+    logging.disable(logging.INFO)
+    if args.command == "export":
+        es = Elasticsearch(
+            os.getenv("ELASTICSEARCH_HOSTS", "").split(","),
+            basic_auth=(os.getenv("ELASTICSEARCH_USER"), os.getenv("ELASTICSEARCH_PASSWORD")),
+            serializer=OrjsonSerializer(),
+        )
+        index_responses = os.getenv("ELASTICSEARCH_INDEX_RESPONSES", "gampes_agent_assessorvirtual")
+        written = export_cases(es, os.getenv("SQL_SERVER_CNXN_STR_IA"), index_responses, args.output, args.since, args.limit)
+        print(f"{written} cases written to {args.output}")
+        return 0
+    return run(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,317 @@
+"""
+Offline throughput benchmark of the worker pipeline.
+
+For every corpus size, seeds an in-memory Elasticsearch with synthetic
+documents, pages and vectors, enqueues `--tasks` tasks in a SQLite queue
+and drains it with `--concurrency` worker threads running the real worker
+loop (`main.handle_queue_item` -> `process_rag_task`). OCR, chat and
+embedding calls go to a local fake server with configurable latency.
+Reports tasks/s, task latency, per-phase and per-call latency percentiles,
+CPU time and memory per level, and can compare against a previous report
+to fail a CI job on regressions.
+
+Production runs one worker per process; here the workers are threads of a
+single process, so CPU-heavy phases contend for the GIL and the numbers
+at high concurrency are a pessimistic bound.
+
+Usage (from worker_files/):
+    python -m benchmark.run --documents 100,1000 --concurrency 1,4,8 --tasks 40 --output report.json
+    python -m benchmark.run --baseline report.json --max-regression 0.2
+"""
+import argparse
+import contextlib
+import logging
+import os
+import platform
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import orjson
+from benchmark.corpus import Corpus
+from benchmark.fake_es import InMemoryStore, create_client, seed_corpus
+from benchmark.fake_services import ServiceProfile, start_fake_services
+from benchmark.sqlite_queue import SqliteQueue
+
+# Spans contabilizados como fases do pipeline (os demais são chamadas externas)
+INTERNAL_SPANS = {"compressao"}
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+
+def summarize(values):
+    """Count and p50/p95/p99/max of a list of durations."""
+    return {
+        "count": len(values),
+        "p50": percentile(values, 0.50),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": max(values) if values else None,
+    }
+
+
+def rss_mb():
+    """Current resident memory of the process in MB (peak on systems without /proc)."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa em KB, macOS em bytes
+    return peak / 2**20 if sys.platform == "darwin" else peak / 1024
+
+
+def configure_environment(services_url, workdir):
+    """Point every external dependency of the worker at the local stand-ins (before importing main)."""
+    os.environ.update({
+        "ELASTICSEARCH_HOST": "http://benchmark:9200",
+        "ELASTICSEARCH_HOSTS": "http://benchmark:9200",
+        "ELASTICSEARCH_USER": "benchmark",
+        "ELASTICSEARCH_PASSWORD": "benchmark",
+        "SQL_SERVER_CNXN_STR_IA": "benchmark",
+        "URL_API_OCR_GAMPES": f"{services_url}/ocr/gampes",
+        "URL_API_OCR_MNI": f"{services_url}/ocr/mni",
+        "ENDPOINT_URL": services_url,
+        "AZURE_OPENAI_API_KEY": "benchmark",
+        "DEPLOYMENT_NAME": "bench-answer",
+        "ENHANCEMENT_ENDPOINT_URL": services_url,
+        "ENHANCEMENT_API_KEY": "benchmark",
+        "ENHANCEMENT_DEPLOYMENT_NAME": "bench-enhancement",
+        "ANSWER_ENDPOINT_URL": services_url,
+        "ANSWER_API_KEY": "benchmark",
+        "ANSWER_DEPLOYMENT_NAME": "bench-answer",
+        "AZURE_OPENAI_ENDPOINT": f"{services_url}/openai/deployments/bench-embedding/embeddings?api-version=2023-05-15",
+        "AZURE_OPENAI_KEY": "benchmark",
+        "API_NOTIFY_URL": "",
+        "METRICS_PORT": "0",
+        "RATE_LIMITS": "",
+        "RATE_LIMIT_DEFAULT_RPM": "0",
+        "RATE_LIMIT_DEFAULT_TPM": "0",
+        "RATE_LIMIT_DB": os.path.join(workdir, "ratelimit.sqlite3"),
+    })
+
+
+class SpanCollector:
+    """Span listener that keeps the durations of the current level by name."""
+
+    def __init__(self):
+        self.durations = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, registro):
+        with self._lock:
+            self.durations.setdefault(registro["nome"], []).append(registro["duracao_ms"] / 1000.0)
+
+    def reset(self):
+        with self._lock:
+            self.durations = {}
+
+    def report(self):
+        phases, calls = {}, {}
+        for nome, values in self.durations.items():
+            if nome.startswith("fase.") or nome in INTERNAL_SPANS:
+                phases[nome.removeprefix("fase.")] = summarize(values)
+            else:
+                calls[nome] = summarize(values)
+        return phases, calls
+
+
+def enqueue_tasks(worker, store, queue, corpus, rng, count, documents_per_task):
+    for _ in range(count):
+        task_id = str(uuid.uuid4())
+        # Documento de status criado pela API no POST /rag
+        store.put("gampes_agent_assessorvirtual", task_id, {"status": 102, "fase": "na_fila", "tipo_requisicao": "RAG"})
+        queue.enqueue(task_id, orjson.dumps(corpus.sample_payload(rng, documents_per_task)).decode())
+
+
+def drain(worker, queue, concurrency):
+    """Process the queue with `concurrency` worker threads until it is empty."""
+    def loop():
+        while True:
+            result = queue.proximo_da_fila()
+            if result is None:
+                return
+            worker.handle_queue_item(result)
+
+    threads = [threading.Thread(target=loop, name=f"worker-{i}") for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run_level(worker, store, queue, corpus, collector, rng, concurrency, tasks, documents_per_task):
+    first_id = queue.last_id()
+    enqueue_tasks(worker, store, queue, corpus, rng, tasks, documents_per_task)
+    collector.reset()
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    drain(worker, queue, concurrency)
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+
+    rows = queue.finished(first_id)
+    completed = [row for row in rows if row[0] == 200]
+    phases, calls = collector.report()
+    return {
+        "concurrency": concurrency,
+        "tasks": tasks,
+        "completed": len(completed),
+        "errors": len(rows) - len(completed),
+        "elapsed_seconds": elapsed,
+        "tasks_per_second": len(completed) / elapsed if elapsed else None,
+        "cpu_seconds_per_task": cpu / tasks if tasks else None,
+        "task_seconds": summarize([fim - inicio for _, _, inicio, fim in completed]),
+        "queue_wait_seconds": summarize([inicio - criacao for _, criacao, inicio, _ in completed]),
+        "phases": phases,
+        "calls": calls,
+        "rss_mb": rss_mb(),
+    }
+
+
+def compare(report, baseline, max_regression):
+    """Return the regressions of `report` against `baseline` (same corpus size and concurrency)."""
+    def index(data):
+        return {(level["documents"], level["concurrency"]): level for level in data["levels"]}
+
+    previous = index(baseline)
+    regressions = []
+    for key, level in index(report).items():
+        before = previous.get(key)
+        if before is None:
+            continue
+        if before["tasks_per_second"] and level["tasks_per_second"] is not None:
+            change = 1 - level["tasks_per_second"] / before["tasks_per_second"]
+            if change > max_regression:
+                regressions.append(f"documents={key[0]} concurrency={key[1]}: tasks/s {before['tasks_per_second']:.2f} -> {level['tasks_per_second']:.2f}")
+        p95_before, p95_now = before["task_seconds"]["p95"], level["task_seconds"]["p95"]
+        if p95_before and p95_now and p95_now / p95_before - 1 > max_regression:
+            regressions.append(f"documents={key[0]} concurrency={key[1]}: task p95 {p95_before:.2f}s -> {p95_now:.2f}s")
+    return regressions
+
+
+def print_level(level):
+    task = level["task_seconds"]
+    print(
+        f"{level['documents']:>9} {level['pages']:>8} {level['concurrency']:>11} {level['tasks_per_second'] or 0:>8.2f} "
+        f"{task['p50'] or 0:>7.2f} {task['p95'] or 0:>7.2f} {level['cpu_seconds_per_task'] or 0:>8.3f} "
+        f"{level['errors']:>6} {level['rss_mb']:>8.0f}"
+    )
+    for nome, stats in level["phases"].items():
+        print(f"{'':>12}fase {nome:<26} p50 {stats['p50'] * 1000:>8.1f} ms  p95 {stats['p95'] * 1000:>8.1f} ms  n={stats['count']}")
+
+
+def main(args):
+    documents_levels = [int(value) for value in args.documents.split(",")]
+    concurrency_levels = [int(value) for value in args.concurrency.split(",")]
+    workdir = tempfile.mkdtemp(prefix="rag_benchmark_")
+    profile = ServiceProfile(
+        ocr_latency=args.ocr_latency,
+        llm_ttft=args.llm_ttft,
+        llm_tokens_per_second=args.llm_tokens_per_second,
+        enhancement_tokens=args.enhancement_tokens,
+        answer_tokens=args.answer_tokens,
+        embedding_latency=args.embedding_latency,
+    )
+    # O mapeamento do OCR cobre o maior corpus; os menores usam um prefixo dele
+    largest = Corpus(max(documents_levels), args.pages_per_document, args.words_per_page, args.seed)
+    services, services_url = start_fake_services(profile, largest.ocr_mapping())
+    configure_environment(services_url, workdir)
+
+    import main as worker
+    from src.spans import add_listener
+
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.WARNING)
+    collector = SpanCollector()
+    add_listener(collector)
+    queue = SqliteQueue(os.path.join(workdir, "fila.sqlite3"))
+    worker.update_fila = queue.update_fila
+    worker.save_logs_to_database = queue.save_logs_to_database
+    worker.save_usage_to_database = queue.save_usage_to_database
+    rng = random.Random(args.seed)
+
+    report = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": vars(args),
+        "levels": [],
+    }
+    print(f"{'documents':>9} {'pages':>8} {'concurrency':>11} {'tasks/s':>8} {'p50 s':>7} {'p95 s':>7} {'cpu s/t':>8} {'errors':>6} {'rss MB':>8}")
+    output = sys.stdout if args.verbose else open(os.devnull, "w")
+    try:
+        for documents in documents_levels:
+            corpus = Corpus(documents, args.pages_per_document, args.words_per_page, args.seed)
+            store = InMemoryStore(latency=args.es_latency)
+            seed_start = time.perf_counter()
+            pages = seed_corpus(store, corpus, args.vector_coverage, args.denormalized)
+            seed_seconds = time.perf_counter() - seed_start
+            worker.es = create_client(store)
+            rss_seeded = rss_mb()
+            with contextlib.redirect_stdout(output):
+                # Aquecimento (tokenizador, clientes HTTP) fora das medições
+                run_level(worker, store, queue, corpus, collector, rng, 1, 1, args.documents_per_task)
+            for concurrency in concurrency_levels:
+                with contextlib.redirect_stdout(output):
+                    level = run_level(worker, store, queue, corpus, collector, rng, concurrency, args.tasks, args.documents_per_task)
+                level.update(documents=documents, pages=pages, seed_seconds=seed_seconds, rss_seeded_mb=rss_seeded)
+                report["levels"].append(level)
+                print_level(level)
+            del store
+    finally:
+        services.terminate()
+        if output is not sys.stdout:
+            output.close()
+    report["peak_rss_mb"] = peak_rss_mb()
+
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+        print(f"Report written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, "rb") as f:
+            regressions = compare(report, orjson.loads(f.read()), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline benchmark of the worker pipeline.")
+    parser.add_argument("--documents", default="100,1000", help="Comma-separated corpus sizes (documents).")
+    parser.add_argument("--pages-per-document", type=int, default=20)
+    parser.add_argument("--words-per-page", type=int, default=350)
+    parser.add_argument("--vector-coverage", type=float, default=1.0, help="Fraction of pages that already have a vector.")
+    parser.add_argument("--denormalized", action="store_true", help="Pages and vectors carry the document fields (see tools.denormalize_pages).")
+    parser.add_argument("--concurrency", default="1,4,8", help="Comma-separated numbers of worker threads.")
+    parser.add_argument("--tasks", type=int, default=40, help="Tasks per level.")
+    parser.add_argument("--documents-per-task", type=int, default=3)
+    parser.add_argument("--es-latency", type=float, default=0.002, help="Seconds added to every Elasticsearch request.")
+    parser.add_argument("--ocr-latency", type=float, default=0.05)
+    parser.add_argument("--llm-ttft", type=float, default=0.3, help="Seconds to the first token of a chat completion.")
+    parser.add_argument("--llm-tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--enhancement-tokens", type=int, default=60)
+    parser.add_argument("--answer-tokens", type=int, default=400)
+    parser.add_argument("--embedding-latency", type=float, default=0.05)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON report to this file.")
+    parser.add_argument("--baseline", help="Previous JSON report to compare against.")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed relative drop of tasks/s or rise of task p95.")
+    parser.add_argument("--verbose", action="store_true", help="Keep the worker's logs and prints.")
+    sys.exit(main(parser.parse_args()))
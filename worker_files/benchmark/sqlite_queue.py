@@ -0,0 +1,145 @@
+"""
+SQLite stand-in for fila_processamento_agentes, rag_gampes and rag_gampes_uso.
+
+`SqliteQueue` exposes `proximo_da_fila`, `update_fila`,
+`save_logs_to_database` and `save_usage_to_database` with the same
+signatures as `src.utils`, so the
+benchmark can swap them into the worker module. Times are stored as epoch
+seconds.
+"""
+import sqlite3
+import time
+from datetime import datetime
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS fila_processamento_agentes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    id_elasticsearch TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    data_criacao REAL NOT NULL,
+    data_inicio_processamento REAL,
+    data_fim_processamento REAL,
+    erro_mensagem TEXT,
+    tentativas INTEGER NOT NULL DEFAULT 0,
+    id_agente INTEGER NOT NULL,
+    worker TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_fila_status ON fila_processamento_agentes (status, id_agente, data_criacao);
+CREATE TABLE IF NOT EXISTS rag_gampes (
+    id TEXT, data REAL, prompt_original TEXT, prompt_final TEXT, resposta TEXT,
+    prompt_tokens INTEGER, completion_tokens INTEGER, total_tokens INTEGER, user_gampes TEXT,
+    idfuncao TEXT, idorgao TEXT, modelo TEXT, tempo_processamento REAL
+);
+CREATE TABLE IF NOT EXISTS rag_gampes_uso (
+    id_tarefa TEXT, id_requisicao TEXT, data REAL, user_gampes TEXT, idorgao TEXT, idfuncao TEXT,
+    fase TEXT, chamada TEXT, deployment TEXT, prompt_tokens INTEGER, cached_tokens INTEGER,
+    completion_tokens INTEGER, total_tokens INTEGER, custo REAL
+);
+"""
+
+
+def _epoch(value):
+    return value.timestamp() if isinstance(value, datetime) else value
+
+
+class SqliteQueue:
+    """Queue table of one benchmark run, in a SQLite file."""
+
+    def __init__(self, path, id_agente=101):
+        self.path = path
+        self.id_agente = id_agente
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def enqueue(self, id_elasticsearch, payload):
+        """Insert a pending (102) task; `payload` is the JSON text."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO fila_processamento_agentes (id_elasticsearch, payload, status, data_criacao, id_agente) VALUES (?, ?, 102, ?, ?)",
+                (id_elasticsearch, payload, time.time(), self.id_agente),
+            )
+
+    def proximo_da_fila(self, connection_string=None):
+        """Claim the oldest pending task: (id, id_elasticsearch, tentativas, payload, espera_ms) or None."""
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE serializa as reivindicações, como o UPDATE com lock no SQL Server
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT id, id_elasticsearch, tentativas, payload, data_criacao FROM fila_processamento_agentes "
+                "WHERE status = 102 AND id_agente = ? ORDER BY data_criacao ASC LIMIT 1",
+                (self.id_agente,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            now = time.time()
+            conn.execute(
+                "UPDATE fila_processamento_agentes SET data_inicio_processamento = ?, status = 202 WHERE id = ?",
+                (now, row[0]),
+            )
+            conn.execute("COMMIT")
+            return row[0], row[1], row[2], row[3], (now - row[4]) * 1000
+        finally:
+            conn.close()
+
+    def update_fila(self, id_value, connection_string, status, data_fim_processamento=None, erro_mensagem=None, tentativas=None):
+        update_fields = ["status = ?"]
+        params = [status]
+        if data_fim_processamento is not None:
+            update_fields.append("data_fim_processamento = ?")
+            params.append(_epoch(data_fim_processamento))
+        if erro_mensagem is not None:
+            update_fields.append("erro_mensagem = ?")
+            params.append(erro_mensagem)
+        if tentativas is not None:
+            update_fields.append("tentativas = ?")
+            params.append(tentativas)
+        params.append(id_value)
+        with self._connect() as conn:
+            conn.execute(f"UPDATE fila_processamento_agentes SET {', '.join(update_fields)} WHERE id = ?", params)
+        return True
+
+    def save_logs_to_database(self, connection_string, llm_response, prompt_original, prompt_final, prompt_data, tempo_processamento):
+        usage = llm_response["usage"]
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO rag_gampes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    llm_response["id"], time.time(), prompt_original, prompt_final,
+                    llm_response["choices"][0]["message"]["content"],
+                    usage["prompt_tokens"], usage["completion_tokens"], usage["total_tokens"],
+                    prompt_data["user"], prompt_data["idfuncao"], prompt_data["idorgao"],
+                    llm_response["model"], tempo_processamento,
+                ),
+            )
+
+    def save_usage_to_database(self, connection_string, rows):
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT INTO rag_gampes_uso VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(*row[:2], _epoch(row[2]), *row[3:]) for row in rows],
+            )
+
+    def pending(self):
+        """Number of tasks still waiting (102) or being processed (202)."""
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM fila_processamento_agentes WHERE status IN (102, 202)").fetchone()[0]
+
+    def finished(self, since_id=0):
+        """(status, data_criacao, data_inicio_processamento, data_fim_processamento) of the tasks after `since_id`."""
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT status, data_criacao, data_inicio_processamento, data_fim_processamento "
+                "FROM fila_processamento_agentes WHERE id > ? AND status NOT IN (102, 202)",
+                (since_id,),
+            ).fetchall()
+
+    def last_id(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COALESCE(MAX(id), 0) FROM fila_processamento_agentes").fetchone()[0]
@@ -3,17 +3,28 @@ import time
 from elasticsearch import Elasticsearch
 import os
 from dotenv import load_dotenv
-import json
+import orjson
+from pydantic import ValidationError
+from elasticsearch.serializer import OrjsonSerializer
 from src.elastic import buscar_ids, buscar_paginas_por_ids, buscar_vetores_por_ids, vector_similarity_search, bm25_similarity_search, merge_and_rerank, merge_and_rerank_rrf, process_merged_results, enhance_results, update_document
-from src.embed import get_embeddings
-from src.model import generate_chat_completion
-from src.prompt import build_structured_response, create_full_prompt
-from src.utils import save_logs_to_database, consultar_apis, proximo_da_fila, update_fila
+from src.embed import get_embeddings, get_embeddings_batch
+from src.compress import compress_results
+from src.routing import load_routes, generate_routed_completion, STAGE_ENHANCEMENT, STAGE_ANSWER
+from src.prompt import build_structured_response, create_full_prompt, build_context
+from src.utils import save_logs_to_database, save_usage_to_database, consultar_apis, proximo_da_fila, update_fila
+from src.webhook import send_completion_webhook, get_dispatcher
+from src.schemas import QueuedRagPayload
+from src.spans import SpanRecorder, recording, span
+from src.profiler import profiling
+from src.usage import UsageRecorder, accounting
+from src.tracing import get_exporter, make_span, new_span_id, new_trace_id, parse_traceparent, shutdown_exporter, SPAN_KIND_CONSUMER
+from src.metrics import start_metrics_server, observe_usage, tasks_in_flight, tasks_total, task_duration, task_end_to_end, claim_latency, batch_cache_lookups
 import logging
 from typing import Dict, Any
 import markdown
 from datetime import datetime, timezone
 import uuid
+from collections import OrderedDict
 from fastapi import BackgroundTasks
 from elasticsearch.exceptions import NotFoundError, TransportError, ApiError
 
@@ -28,6 +39,9 @@ endpoint_model = os.getenv("ENDPOINT_URL")
 deployment = os.getenv("DEPLOYMENT_NAME")
 subscription_key = os.getenv("AZURE_OPENAI_API_KEY")
 
+# Rotas de modelo por estágio (deployment, max_tokens, temperatura, timeout)
+model_routes = load_routes(endpoint_api, subscription_key, deployment)
+
 # Elasticsearch connection
 # Configurações do Elasticsearch
 elasticsearch_host = os.getenv('ELASTICSEARCH_HOST')
@@ -42,6 +56,7 @@ elasticsearch_hosts_list = elasticsearch_hosts.split(',')
 es = Elasticsearch(
     elasticsearch_hosts_list,
     basic_auth=(elasticsearch_user, elasticsearch_pwd),
+    serializer=OrjsonSerializer(),
 )
 
 # Define the Elasticsearch index for storing responses
@@ -66,168 +81,381 @@ merged_top_k = 5
 bm25_top_k = 10
 vector_top_k = 10
 
+# Orçamento de tokens do contexto enviado ao LLM
+context_max_tokens = int(os.getenv("CONTEXT_MAX_TOKENS", "12000"))
+context_max_tokens_per_page = int(os.getenv("CONTEXT_MAX_TOKENS_PER_PAGE", "3000"))
+context_dedup_threshold = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.9"))
+
+# Compressão extrativa do contexto
+compression_enabled = os.getenv("COMPRESSION_ENABLED", "true").lower() == "true"
+compression_spans_per_page = int(os.getenv("COMPRESSION_SPANS_PER_PAGE", "3"))
+compression_neighborhood = int(os.getenv("COMPRESSION_NEIGHBORHOOD", "1"))
+compression_embedding_candidates = int(os.getenv("COMPRESSION_EMBEDDING_CANDIDATES", "32"))
+
+# Streaming da resposta: texto parcial publicado no documento de status a cada N segundos
+answer_stream_enabled = os.getenv("ANSWER_STREAM", "false").lower() == "true"
+answer_stream_flush_seconds = float(os.getenv("ANSWER_STREAM_FLUSH_SECONDS", "1.0"))
+
+# Cache da fase 2 por lote: tarefas de um mesmo lote compartilham o conjunto de documentos
+batch_cache_ttl = float(os.getenv("BATCH_CACHE_TTL", "1800"))
+batch_cache_size = int(os.getenv("BATCH_CACHE_SIZE", "32"))
+batch_pages_cache = OrderedDict()
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 #logging.info(elasticsearch_host, elasticsearch_user)
 
+def report_progress(task_id, es, **fields):
+    """Update the status document of a task; a tracking failure must not abort the task."""
+    try:
+        update_document(id=task_id, es=es, **fields)
+    except Exception as e:
+        logging.warning(f"Could not report progress of task {task_id}: {e}")
+
+
+def partial_text_reporter(task_id, es):
+    """Return an on_delta callback that publishes the partial answer at most every answer_stream_flush_seconds."""
+    parts = []
+    last_flush = [time.monotonic()]
+
+    def on_delta(delta):
+        parts.append(delta)
+        now = time.monotonic()
+        if now - last_flush[0] >= answer_stream_flush_seconds:
+            last_flush[0] = now
+            report_progress(task_id, es, texto_parcial="".join(parts))
+
+    return on_delta
+
+
+def resolve_document_pages(prompt_data, es):
+    """
+    Run phase 2 (OCR APIs, page lookup and vector backfill) for the task's document set.
+
+    Tasks submitted through /rag/batch carry an `id_lote`; the pages of a
+    batch's document set are resolved once and reused by the other tasks of
+    the batch handled by this worker process.
+
+    Returns:
+        list: The page IDs of the document set.
+    """
+    ids_documento_mni = prompt_data['id_documentos_mni']
+    ids_documento_gampes = prompt_data['id_documentos_gampes']
+    id_lote = prompt_data.get('id_lote')
+    cache_key = None
+    if id_lote:
+        cache_key = (id_lote, tuple(sorted(map(str, ids_documento_gampes))), tuple(sorted(map(str, ids_documento_mni))))
+        cached = batch_pages_cache.get(cache_key)
+        if cached and time.time() - cached[0] < batch_cache_ttl:
+            batch_cache_lookups.labels("hit").inc()
+            batch_pages_cache.move_to_end(cache_key)
+            logging.info(f"Reusing phase 2 results of batch {id_lote} ({len(cached[1])} pages)")
+            return cached[1]
+        batch_cache_lookups.labels("miss").inc()
+
+    #id_textual_list = buscar_ids(ids_documento_gampes, ids_documento_mni)
+    id_textual_list = consultar_apis(ids_documento_gampes, ids_documento_mni, url_api_ocr_gampes, url_api_ocr_mni)
+    id_paginas_list = buscar_paginas_por_ids(id_textual_list, es)
+    id_vector_list = buscar_vetores_por_ids(id_paginas_list, es, azure_key, endpoint_embed)
+
+    if cache_key is not None:
+        batch_pages_cache[cache_key] = (time.time(), id_paginas_list)
+        while len(batch_pages_cache) > batch_cache_size:
+            batch_pages_cache.popitem(last=False)
+    return id_paginas_list
+
+
 def process_rag_task(
     task_id: str,
     payload: Dict[str, Any],
     es: Elasticsearch, # Pass dependencies if they are not easily global or for testability
-    connection_string: str
+    connection_string: str,
+    recorder: SpanRecorder = None
 ):
     start_time = time.time()
     response = {}
+    # Tempos de cada fase e de cada chamada externa, gravados no documento da tarefa
+    recorder = recorder or SpanRecorder()
+    # Tokens de cada chamada ao LLM e de embedding, gravados em lote ao final da tarefa
+    usage = UsageRecorder()
     try:
-        # 1. Preparação
-        logging.info("Starting phase 1: Preparation")
-        print(task_id)
-        prompt_data = json.loads(json.dumps(payload))
-        ids_documento_mni = prompt_data['id_documentos_mni']
-        ids_documento_gampes = prompt_data['id_documentos_gampes']
-        prompt_original = prompt_data['texto_prompt']
-
-        logging.info(f"Phase 1 completed in {time.time() - start_time} seconds")
-
-        # 2. Recuperação de documentos
-        logging.info("Starting phase 2: Document retrieval")
-        #id_textual_list = buscar_ids(ids_documento_gampes, ids_documento_mni)
-        id_textual_list = consultar_apis(ids_documento_gampes, ids_documento_mni, url_api_ocr_gampes, url_api_ocr_mni)
-        id_paginas_list = buscar_paginas_por_ids(id_textual_list, es)
-        id_vector_list = buscar_vetores_por_ids(id_paginas_list, es, azure_key, endpoint_embed)
-
-        logging.info(f"Phase 2.0 completed in {time.time() - start_time} seconds")
-
-        # 2.1. Geração de prompt aprimorado
-        logging.info("Starting phase 2.1: Enhanced prompt generation")
-        prompt_enhanced_response = generate_chat_completion(endpoint_api, deployment, subscription_key, role_upgrade_prompt, prompt_original)
-        prompt_enhanced = prompt_enhanced_response["choices"][0]["message"]["content"]
-        prompt_embedding = get_embeddings(prompt_enhanced, azure_key, endpoint_embed)
-
-        logging.info(f"Phase 2.1 completed in {time.time() - start_time} seconds")
-
-        # 3. Busca híbrida
-        logging.info("Starting phase 3: Hybrid search")
-        bm25_results = bm25_similarity_search(es, prompt_enhanced, id_paginas_list, k=bm25_top_k)
-        vector_results = vector_similarity_search(es, prompt_embedding, id_list=id_paginas_list, k=vector_top_k)
-
-        logging.info(f"Phase 3 completed in {time.time() - start_time} seconds")
-
-        # 4. Reranking
-        logging.info("Starting phase 4: Reranking")
-        #merged_results = merge_and_rerank(vector_results, bm25_results, vector_weight=0.6, bm25_weight=0.4)
-        merged_results = merge_and_rerank_rrf(vector_results, bm25_results, k=30)
-
-        logging.info(f"Phase 4 completed in {time.time() - start_time} seconds")
-
-        # 5. Contexto e compressão
-        logging.info("Starting phase 5: Context and compression")
-        processed_results = process_merged_results(es, merged_results)
-        top_k_merged_results = processed_results[:merged_top_k]
-        enhanced_results = enhance_results(es, top_k_merged_results)
-        prompt_final = create_full_prompt(prompt_enhanced, enhanced_results)
-        time.sleep(1) # Pause for 1 second to avoid rate limiting
-
-        logging.info(f"Phase 5 completed in {time.time() - start_time} seconds")
-
-        # 6. Geração de resposta
-        logging.info("Starting phase 6: Response generation")
-        llm_response = generate_chat_completion(endpoint_api, deployment, subscription_key, role_answer, prompt_final)
-        llm_response_html = markdown.markdown(llm_response["choices"][0]["message"]["content"], extensions=['extra', 'codehilite', 'tables'])
-
-        logging.info(f"Phase 6 completed in {time.time() - start_time} seconds")
-
-        # 7. Montagem da resposta final
-        logging.info("Starting phase 7: Final response assembly")
-        response = build_structured_response(
-            llm_response_html,
-            enhanced_results,
-            llm_response["id"]
-        )
-
-        reponse_es = update_document(id = task_id, es=es, id_requisicao=llm_response["id"], texto_resposta=llm_response_html, texto_aux=str(enhanced_results), status=200, data_criacao=datetime.now(timezone.utc).isoformat(), usuario=prompt_data["user"], tipo_requisicao="RAG")
-
-        logging.info(f"Phase 7 completed in {time.time() - start_time} seconds")
-
-        # 8. Logging e métricas
-        tempo_processamento = time.time() - start_time
-        logging.info(f"Total processing time: {tempo_processamento} seconds")
-
-        # Save logs to database only if no errors occurred
-        save_logs_to_database(connection_string, llm_response, prompt_original, prompt_final, prompt_data, tempo_processamento)
-
-    except json.JSONDecodeError as e:
-        logging.error(f"JSON decoding error: {e}")
-        raise HTTPException(status_code=400, detail="Invalid JSON payload")
+        with profiling(task_id, recorder), recording(recorder), accounting(usage):
+            # 1. Preparação
+            logging.info("Starting phase 1: Preparation")
+            print(task_id)
+            with span("fase.preparacao"):
+                prompt_data = QueuedRagPayload.model_validate(payload).model_dump()
+                ids_documento_mni = prompt_data['id_documentos_mni']
+                ids_documento_gampes = prompt_data['id_documentos_gampes']
+                prompt_original = prompt_data['texto_prompt']
+
+            logging.info(f"Phase 1 completed in {time.time() - start_time} seconds")
+
+            # 2. Recuperação de documentos
+            logging.info("Starting phase 2: Document retrieval")
+            report_progress(task_id, es, fase="recuperacao_documentos")
+            with span("fase.recuperacao_documentos", documentos=len(ids_documento_mni) + len(ids_documento_gampes)) as s:
+                id_paginas_list = resolve_document_pages(prompt_data, es)
+                s["paginas"] = len(id_paginas_list)
+
+            logging.info(f"Phase 2.0 completed in {time.time() - start_time} seconds")
+
+            # 2.1. Geração de prompt aprimorado
+            logging.info("Starting phase 2.1: Enhanced prompt generation")
+            with span("fase.aprimoramento_prompt"):
+                prompt_enhanced_response = generate_routed_completion(model_routes[STAGE_ENHANCEMENT], role_upgrade_prompt, prompt_original)
+                if prompt_enhanced_response is None:
+                    raise RuntimeError("Prompt enhancement failed after retries")
+                prompt_enhanced = prompt_enhanced_response["choices"][0]["message"]["content"]
+                prompt_embedding = get_embeddings(prompt_enhanced, azure_key, endpoint_embed)
+                if prompt_embedding is None:
+                    raise RuntimeError("Prompt embedding failed after retries")
+
+            logging.info(f"Phase 2.1 completed in {time.time() - start_time} seconds")
+
+            # 3. Busca híbrida
+            logging.info("Starting phase 3: Hybrid search")
+            report_progress(task_id, es, fase="busca_hibrida")
+            with span("fase.busca_hibrida") as s:
+                bm25_results = bm25_similarity_search(es, prompt_enhanced, id_paginas_list, k=bm25_top_k)
+                vector_results = vector_similarity_search(es, prompt_embedding, id_list=id_paginas_list, k=vector_top_k)
+                s["resultados_bm25"] = len(bm25_results)
+                s["resultados_vetoriais"] = len(vector_results)
+
+            logging.info(f"Phase 3 completed in {time.time() - start_time} seconds")
+
+            # 4. Reranking
+            logging.info("Starting phase 4: Reranking")
+            with span("fase.reranking") as s:
+                #merged_results = merge_and_rerank(vector_results, bm25_results, vector_weight=0.6, bm25_weight=0.4)
+                merged_results = merge_and_rerank_rrf(vector_results, bm25_results, k=30)
+                s["resultados"] = len(merged_results)
+
+            logging.info(f"Phase 4 completed in {time.time() - start_time} seconds")
+
+            # 5. Contexto e compressão
+            logging.info("Starting phase 5: Context and compression")
+            report_progress(task_id, es, fase="contexto")
+            with span("fase.contexto") as s:
+                processed_results = process_merged_results(es, merged_results, bm25_results)
+                top_k_merged_results = processed_results[:merged_top_k]
+                enhanced_results = enhance_results(es, top_k_merged_results)
+                if compression_enabled:
+                    embed_fn = (lambda texts: get_embeddings_batch(texts, azure_key, endpoint_embed)) if compression_embedding_candidates > 0 else None
+                    with span("compressao", paginas=len(enhanced_results)) as c:
+                        enhanced_results, compression_stats = compress_results(prompt_enhanced, enhanced_results, prompt_embedding, embed_fn, spans_per_page=compression_spans_per_page, neighborhood=compression_neighborhood, embedding_candidates=compression_embedding_candidates)
+                        c["tokens_antes"] = compression_stats.get("tokens_before")
+                        c["tokens_depois"] = compression_stats.get("tokens_after")
+                context = build_context(prompt_enhanced, enhanced_results, max_tokens=context_max_tokens, max_tokens_per_page=context_max_tokens_per_page, dedup_threshold=context_dedup_threshold)
+                prompt_final = context["prompt"]
+                enhanced_results = context["sources"]
+                s["paginas"] = len(enhanced_results)
+                s["tokens"] = context["tokens"]
+            logging.info(f"Context uses {context['tokens']} tokens from {len(enhanced_results)} pages")
+
+            logging.info(f"Phase 5 completed in {time.time() - start_time} seconds")
+
+            # 6. Geração de resposta
+            logging.info("Starting phase 6: Response generation")
+            report_progress(task_id, es, fase="geracao_resposta")
+            with span("fase.geracao_resposta"):
+                on_delta = partial_text_reporter(task_id, es) if answer_stream_enabled else None
+                llm_response = generate_routed_completion(model_routes[STAGE_ANSWER], role_answer, prompt_final, on_delta=on_delta)
+                if llm_response is None:
+                    raise RuntimeError("Response generation failed after retries")
+                llm_response_html = markdown.markdown(llm_response["choices"][0]["message"]["content"], extensions=['extra', 'codehilite', 'tables'])
+
+            logging.info(f"Phase 6 completed in {time.time() - start_time} seconds")
+
+            # 7. Montagem da resposta final
+            logging.info("Starting phase 7: Final response assembly")
+            with span("fase.montagem_resposta"):
+                response = build_structured_response(
+                    llm_response_html,
+                    enhanced_results,
+                    llm_response["id"]
+                )
+
+            reponse_es = update_document(id = task_id, es=es, id_requisicao=llm_response["id"], texto_resposta=llm_response_html, texto_aux=str(enhanced_results), status=200, fase="concluido", data_criacao=datetime.now(timezone.utc).isoformat(), usuario=prompt_data["user"], tipo_requisicao="RAG", tempos=recorder.to_dict(), uso=usage.to_dict())
+
+            logging.info(f"Phase 7 completed in {time.time() - start_time} seconds")
+
+            # 8. Logging e métricas
+            tempo_processamento = time.time() - start_time
+            logging.info(f"Total processing time: {tempo_processamento} seconds")
+            logging.info("Phase timings: " + ", ".join(f"{nome} {resumo['total_ms']:.0f}ms" for nome, resumo in recorder.resumo.items() if nome.startswith("fase.")))
+
+            # Save logs to database only if no errors occurred
+            with span("sql.rag_gampes"):
+                save_logs_to_database(connection_string, llm_response, prompt_original, prompt_final, prompt_data, tempo_processamento)
+
+    except ValidationError as e:
+        logging.error(f"Invalid payload: {e}")
+        report_progress(task_id, es, tempos=recorder.to_dict(), uso=usage.to_dict())
+        raise HTTPException(status_code=400, detail=f"Invalid Payload: {e}")
     except KeyError as e:
         logging.error(f"Missing key in payload: {e}")
+        report_progress(task_id, es, tempos=recorder.to_dict(), uso=usage.to_dict())
         raise HTTPException(status_code=400, detail=f"Missing key in payload: {e}")
     except Exception as e:
         logging.error(f"An unexpected error occurred: {e}")
+        report_progress(task_id, es, tempos=recorder.to_dict(), uso=usage.to_dict())
         raise HTTPException(status_code=500, detail="Internal server error")
+    finally:
+        # Tokens consumidos são gravados também quando a tarefa falha
+        save_task_usage(task_id, payload, usage, connection_string)
 
     return response
 
 
+def save_task_usage(task_id, payload, usage, connection_string):
+    """
+    Write the token usage of a task in one batch and feed the token metrics.
+
+    Args:
+        task_id (str): The task ID (Elasticsearch document ID).
+        payload (dict): The task payload (user, idorgao and idfuncao).
+        usage (UsageRecorder): The calls recorded during the task.
+        connection_string (str): The database connection string.
+    """
+    if not usage.chamadas:
+        return
+    dados = payload if isinstance(payload, dict) else {}
+    user, idorgao, idfuncao = (str(dados.get(campo) or "") for campo in ("user", "idorgao", "idfuncao"))
+    save_usage_to_database(connection_string, usage.rows(task_id, user, idorgao, idfuncao))
+    observe_usage(usage.chamadas, idorgao)
+
+
+def handle_queue_item(result):
+    """
+    Process one claimed row of fila_processamento_agentes.
+
+    Runs the pipeline, records the outcome in the queue row and in the task
+    document, sends the completion webhook and updates the worker metrics.
+
+    Args:
+        result: The row returned by proximo_da_fila
+            (id, id_elasticsearch, tentativas, payload, espera_ms).
+    """
+    id, id_elasticsearch, tentativas, payload, espera_ms = result
+    espera = (espera_ms or 0) / 1000.0
+    claim_latency.observe(espera)
+    try:
+        payload_dict = orjson.loads(payload) if isinstance(payload, str) else payload
+    except orjson.JSONDecodeError:
+        payload_dict = None
+    callback_url = payload_dict.get("callback_url") if isinstance(payload_dict, dict) else None
+    
+    # Verificar se já excedeu o número máximo de tentativas
+    if tentativas >= 3:
+        print(f"Item {id} excedeu o número máximo de tentativas. Marcando como erro.")
+        report_progress(id_elasticsearch, es, status=429, fase="erro", mensagem_erro="Número máximo de tentativas excedido")
+        update_fila(
+            id_value=id,
+            connection_string=connection_string,
+            status=429,
+            erro_mensagem="Número máximo de tentativas excedido",
+            tentativas=tentativas+1
+        )
+        send_completion_webhook(callback_url, id_elasticsearch, 429, erro="Número máximo de tentativas excedido")
+        tasks_total.labels("429").inc()
+        return
+    
+    print(f"Processando item {id} (Tentativa {tentativas+1}/3)")
+    print(payload)
+    
+    tasks_in_flight.inc()
+    inicio_tarefa = time.perf_counter()
+    recorder = SpanRecorder()
+    status_final = None
+    try:
+        # Executar o pipeline principal
+        if payload_dict is None:
+            raise ValueError("Payload inválido")
+        resultado = process_rag_task(task_id=id_elasticsearch, payload=payload_dict, es=es, connection_string=connection_string, recorder=recorder)
+        status_final = 200
+
+        # Se sucesso, atualizar status
+        update_fila(
+            id_value=id,
+            connection_string=connection_string,
+            status=200,
+            data_fim_processamento=datetime.now(),
+            tentativas=tentativas+1
+        )
+        print(f"Item {id} processado com sucesso.")
+        duracao = time.perf_counter() - inicio_tarefa
+        task_duration.observe(duracao)
+        task_end_to_end.observe(espera + duracao)
+        tasks_total.labels("200").inc()
+        send_completion_webhook(callback_url, id_elasticsearch, 200, resultado=resultado)
+    
+    except Exception as e:
+        print(f"Erro ao processar item {id}: {str(e)}")
+        
+        # Atualizar status de erro e incrementar tentativas
+        new_status = 400 if "Payload" in str(e) else 500
+        report_progress(id_elasticsearch, es, status=new_status, fase="erro", mensagem_erro=str(e))
+        update_fila(
+            id_value=id,
+            connection_string=connection_string,
+            status=new_status,
+            erro_mensagem=str(e),
+            tentativas=tentativas+1
+        )
+        send_completion_webhook(callback_url, id_elasticsearch, new_status, erro=str(e))
+        tasks_total.labels(str(new_status)).inc()
+        status_final = new_status
+    finally:
+        tasks_in_flight.dec()
+        traceparent = payload_dict.get("traceparent") if isinstance(payload_dict, dict) else None
+        export_task_trace(traceparent, id_elasticsearch, espera, recorder, status_final, tentativas + 1)
+
+
+def export_task_trace(traceparent, task_id, espera, recorder, status, tentativa):
+    """
+    Export the queue wait, the task and its phase/call spans, continuing the
+    trace started by the API (the traceparent stored in the queue payload).
+
+    Args:
+        traceparent (str): The traceparent of the API request, or None.
+        task_id (str): The task ID (Elasticsearch document ID).
+        espera (float): Seconds the task waited in the queue before being claimed.
+        recorder (SpanRecorder): The spans of the task.
+        status (int): Final status of the task.
+        tentativa (int): Attempt number.
+    """
+    exporter = get_exporter("rag-worker")
+    if exporter is None:
+        return
+    trace_id, parent_id = parse_traceparent(traceparent) or (new_trace_id(), None)
+    atributos = {"task.id": task_id, "task.attempt": tentativa}
+    # A espera termina quando o worker pega a tarefa, isto é, no início da gravação dos spans
+    fila = make_span("fila.espera", trace_id, new_span_id(), parent_id, recorder.started_ns - int(espera * 1_000_000_000), recorder.started_ns, kind=SPAN_KIND_CONSUMER, attributes=atributos)
+    tarefa_id = new_span_id()
+    tarefa = make_span("rag.tarefa", trace_id, tarefa_id, parent_id, recorder.started_ns, time.time_ns(), attributes={**atributos, "task.status": status}, error=None if status == 200 else f"status {status}")
+    exporter.export([fila, tarefa, *recorder.to_trace(trace_id, tarefa_id)])
+
+
 if __name__ == "__main__":
+    start_metrics_server()
     while True:
         try:
             # Obter o próximo item da fila (apenas status 102)
             result = proximo_da_fila(connection_string)
             
             if result:  # Se houver item para processar
-                id, id_elasticsearch, tentativas, payload = result
-                
-                # Verificar se já excedeu o número máximo de tentativas
-                if tentativas >= 3:
-                    print(f"Item {id} excedeu o número máximo de tentativas. Marcando como erro.")
-                    update_fila(
-                        id_value=id,
-                        connection_string=connection_string,
-                        status=429,
-                        erro_mensagem="Número máximo de tentativas excedido",
-                        tentativas=tentativas+1
-                    )
-                    continue
-                
-                print(f"Processando item {id} (Tentativa {tentativas+1}/3)")
-                print(payload)
-                
-                try:
-                    # Executar o pipeline principal
-                    payload_dict = json.loads(payload) if isinstance(payload, str) else payload
-                    process_rag_task(task_id=id_elasticsearch, payload=payload_dict, es=es, connection_string=connection_string)
-
-                    # Se sucesso, atualizar status
-                    update_fila(
-                        id_value=id,
-                        connection_string=connection_string,
-                        status=200,
-                        data_fim_processamento=datetime.now(),
-                        tentativas=tentativas+1
-                    )
-                    print(f"Item {id} processado com sucesso.")
-                
-                except Exception as e:
-                    print(f"Erro ao processar item {id}: {str(e)}")
-                    
-                    # Atualizar status de erro e incrementar tentativas
-                    new_status = 400 if "Payload" in str(e) else 500
-                    update_fila(
-                        id_value=id,
-                        connection_string=connection_string,
-                        status=new_status,
-                        erro_mensagem=str(e),
-                        tentativas=tentativas+1
-                    )
-            
+                handle_queue_item(result)
+
             # Pausa de 5 segundos entre as rodadas
             print("Aguardando 5 segundos para próxima verificação...")
             time.sleep(5)
             
         except KeyboardInterrupt:
             print("Processamento interrompido pelo usuário.")
+            get_dispatcher().stop()
+            shutdown_exporter()
             break
         except Exception as e:
             print(f"Erro inesperado: {str(e)}")
@@ -0,0 +1,19 @@
+CREATE TABLE [IA].[dbo].[rag_gampes_uso] (
+       [id] BIGINT IDENTITY(1,1) NOT NULL PRIMARY KEY
+      ,[id_tarefa] VARCHAR(64) NOT NULL
+      ,[id_requisicao] VARCHAR(128) NULL
+      ,[data] DATETIME2 NOT NULL
+      ,[user_gampes] VARCHAR(100) NOT NULL
+      ,[idorgao] VARCHAR(50) NOT NULL
+      ,[idfuncao] VARCHAR(50) NOT NULL
+      ,[fase] VARCHAR(64) NULL
+      ,[chamada] VARCHAR(64) NOT NULL
+      ,[deployment] VARCHAR(128) NOT NULL
+      ,[prompt_tokens] INT NOT NULL
+      ,[cached_tokens] INT NOT NULL
+      ,[completion_tokens] INT NOT NULL
+      ,[total_tokens] INT NOT NULL
+      ,[custo] DECIMAL(18, 8) NOT NULL
+)
+CREATE INDEX [ix_rag_gampes_uso_id_tarefa] ON [IA].[dbo].[rag_gampes_uso] ([id_tarefa], [data])
+CREATE INDEX [ix_rag_gampes_uso_data] ON [IA].[dbo].[rag_gampes_uso] ([data]) INCLUDE ([user_gampes], [idorgao], [total_tokens], [custo])
\ No newline at end of file
@@ -0,0 +1,16 @@
+CREATE TABLE [IA].[dbo].[rag_gampes_uso_diario] (
+       [dia] DATE NOT NULL
+      ,[user_gampes] VARCHAR(100) NOT NULL
+      ,[idorgao] VARCHAR(50) NOT NULL
+      ,[chamada] VARCHAR(64) NOT NULL
+      ,[deployment] VARCHAR(128) NOT NULL
+      ,[tarefas] INT NOT NULL
+      ,[chamadas] INT NOT NULL
+      ,[prompt_tokens] BIGINT NOT NULL
+      ,[cached_tokens] BIGINT NOT NULL
+      ,[completion_tokens] BIGINT NOT NULL
+      ,[total_tokens] BIGINT NOT NULL
+      ,[custo] DECIMAL(18, 8) NOT NULL
+      ,CONSTRAINT [pk_rag_gampes_uso_diario] PRIMARY KEY ([dia], [user_gampes], [idorgao], [chamada], [deployment])
+)
+CREATE INDEX [ix_rag_gampes_uso_diario_idorgao] ON [IA].[dbo].[rag_gampes_uso_diario] ([idorgao], [dia])
\ No newline at end of file
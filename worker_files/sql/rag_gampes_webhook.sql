@@ -0,0 +1,11 @@
+CREATE TABLE [IA].[dbo].[rag_gampes_webhook] (
+       [id] BIGINT IDENTITY(1,1) NOT NULL PRIMARY KEY
+      ,[id_elasticsearch] VARCHAR(64) NOT NULL
+      ,[callback_url] NVARCHAR(2048) NOT NULL
+      ,[tentativa] INT NOT NULL
+      ,[status_http] INT NULL
+      ,[erro] NVARCHAR(MAX) NULL
+      ,[entregue] BIT NOT NULL
+      ,[data_envio] DATETIME2 NOT NULL
+)
+CREATE INDEX [ix_rag_gampes_webhook_id_elasticsearch] ON [IA].[dbo].[rag_gampes_webhook] ([id_elasticsearch])
\ No newline at end of file
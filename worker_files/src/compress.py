@@ -0,0 +1,190 @@
+import re
+import math
+import logging
+import unicodedata
+from collections import Counter
+from src.tokens import count_tokens
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Trechos maiores que isso são divididos em frases
+MAX_PARAGRAPH_CHARS = 600
+
+# Separador entre trechos não contíguos de uma mesma página
+SPAN_SEPARATOR = "\n[...]\n"
+
+STOPWORDS = {
+    "a", "ao", "aos", "as", "com", "como", "da", "das", "de", "do", "dos", "e", "em", "entre",
+    "foi", "ha", "isso", "mais", "mas", "na", "nas", "no", "nos", "o", "os", "ou", "para",
+    "pela", "pelas", "pelo", "pelos", "por", "que", "se", "sem", "ser", "seu", "sua", "sao",
+    "um", "uma", "uns", "umas", "nao", "tambem", "ja", "lhe", "ele", "ela", "eles", "elas",
+}
+
+
+def _normalize(text):
+    """Lowercase and strip accents, so that "vítima" and "vitima" match."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    """
+    Split a text into normalized terms for BM25 scoring.
+
+    Args:
+        text (str): The text to tokenize.
+
+    Returns:
+        list: Terms without accents and Portuguese stopwords.
+    """
+    return [t for t in re.findall(r"\w+", _normalize(text)) if len(t) > 1 and t not in STOPWORDS]
+
+
+def split_spans(texto):
+    """
+    Split a page into paragraphs, breaking long paragraphs into sentences.
+
+    Args:
+        texto (str): The page text.
+
+    Returns:
+        list: The spans of the page, in reading order.
+    """
+    spans = []
+    for paragraph in re.split(r"\n\s*\n", texto or ""):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if len(paragraph) <= MAX_PARAGRAPH_CHARS:
+            spans.append(paragraph)
+        else:
+            spans.extend(s.strip() for s in re.split(r"(?<=[.!?;])\s+(?=[A-ZÀ-Ú0-9\"“(])", paragraph) if s.strip())
+    return spans
+
+
+def bm25_scores(query_terms, spans_terms, k1=1.5, b=0.75):
+    """
+    Score every span against the query with BM25, using the spans themselves as corpus.
+
+    Args:
+        query_terms (list): Terms of the query.
+        spans_terms (list): Terms of each span.
+
+    Returns:
+        list: One BM25 score per span.
+    """
+    n = len(spans_terms)
+    if n == 0:
+        return []
+    avg_len = sum(len(t) for t in spans_terms) / n or 1.0
+    doc_freq = Counter(term for terms in spans_terms for term in set(terms))
+    query = set(query_terms)
+
+    scores = []
+    for terms in spans_terms:
+        freqs = Counter(terms)
+        score = 0.0
+        for term in query:
+            tf = freqs.get(term)
+            if not tf:
+                continue
+            idf = math.log(1 + (n - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(terms) / avg_len))
+        scores.append(score)
+    return scores
+
+
+def _cosine(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def compress_results(query, results, query_embedding=None, embed_fn=None, spans_per_page=3, neighborhood=1,
+                     embedding_candidates=32, embedding_weight=0.5):
+    """
+    Keep only the spans of each page that best answer the query.
+
+    Spans are scored with BM25 against the query. When `embed_fn` and the
+    query embedding are given, the best `embedding_candidates` spans are
+    also embedded in one batch and their cosine similarity to the query
+    embedding is blended into the score. Each page keeps its
+    `spans_per_page` best spans plus `neighborhood` spans around each one,
+    in reading order.
+
+    Args:
+        query (str): The enhanced query.
+        results (list): Enriched results, each with a 'texto' field.
+        query_embedding (list, optional): Embedding of the query.
+        embed_fn (callable, optional): Function mapping a list of texts to a list of embeddings.
+        spans_per_page (int): Best spans to keep per page.
+        neighborhood (int): Spans kept before and after each selected span.
+        embedding_candidates (int): Maximum spans sent to `embed_fn`.
+        embedding_weight (float): Weight of the cosine similarity in the blended score.
+
+    Returns:
+        tuple: (compressed_results, stats) where stats reports the tokens and
+        characters before and after compression.
+    """
+    logging.info("Compressing context.")
+    query_terms = tokenize(query)
+    pages = [split_spans(result['texto']) for result in results]
+    flat = [(p, i) for p, spans in enumerate(pages) for i in range(len(spans))]
+    flat_text = [pages[p][i] for p, i in flat]
+    scores = bm25_scores(query_terms, [tokenize(t) for t in flat_text])
+
+    if embed_fn is not None and query_embedding and flat:
+        max_bm25 = max(scores) or 1.0
+        candidates = sorted(range(len(flat)), key=lambda j: scores[j], reverse=True)[:embedding_candidates]
+        vectors = embed_fn([flat_text[j] for j in candidates])
+        if vectors:
+            blended = [(1 - embedding_weight) * s / max_bm25 for s in scores]
+            for j, vector in zip(candidates, vectors):
+                blended[j] += embedding_weight * max(0.0, _cosine(query_embedding, vector))
+            scores = blended
+        else:
+            logging.warning("Span embeddings unavailable, compressing with BM25 only.")
+
+    page_scores = [[0.0] * len(spans) for spans in pages]
+    for (p, i), score in zip(flat, scores):
+        page_scores[p][i] = score
+
+    compressed = []
+    before_text = []
+    after_text = []
+    for result, spans, span_scores in zip(results, pages, page_scores):
+        before_text.append(result['texto'] or "")
+        if not spans:
+            compressed.append(result)
+            after_text.append(result['texto'] or "")
+            continue
+
+        best = sorted(range(len(spans)), key=lambda i: span_scores[i], reverse=True)[:spans_per_page]
+        keep = sorted({j for i in best for j in range(max(0, i - neighborhood), min(len(spans), i + neighborhood + 1))})
+
+        parts = []
+        previous = None
+        for i in keep:
+            if previous is not None and i != previous + 1:
+                parts.append(SPAN_SEPARATOR)
+            elif previous is not None:
+                parts.append("\n")
+            parts.append(spans[i])
+            previous = i
+        texto = "".join(parts)
+
+        compressed_result = result.copy()
+        compressed_result['texto'] = texto
+        compressed.append(compressed_result)
+        after_text.append(texto)
+
+    stats = {
+        "chars_before": sum(len(t) for t in before_text),
+        "chars_after": sum(len(t) for t in after_text),
+        "tokens_before": sum(count_tokens(t) for t in before_text),
+        "tokens_after": sum(count_tokens(t) for t in after_text),
+    }
+    stats["ratio"] = stats["tokens_after"] / stats["tokens_before"] if stats["tokens_before"] else 1.0
+    logging.info(f"Context compressed from {stats['tokens_before']} to {stats['tokens_after']} tokens ({stats['ratio']:.0%}).")
+    return compressed, stats
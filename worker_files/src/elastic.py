@@ -1,7 +1,10 @@
 from elasticsearch import Elasticsearch
+from elasticsearch.serializer import OrjsonSerializer
 import os
 from dotenv import load_dotenv
 from src.embed import get_embeddings
+from src.notify import notify_status
+from src.spans import span
 import logging
 from collections import defaultdict
 
@@ -17,7 +20,13 @@ azure_key = os.getenv('AZURE_OPENAI_KEY')
 
 # Elasticsearch connection
 elasticsearch_host = os.getenv('ELASTICSEARCH_HOST')
-es = Elasticsearch(elasticsearch_host)
+es = Elasticsearch(elasticsearch_host, serializer=OrjsonSerializer())
+
+# Campos de gampes_textual copiados para as páginas e vetores por tools.denormalize_pages
+PAGE_DOCUMENT_FIELDS = ("fonte", "id_documento_gampes", "id_identificador_MNI")
+
+# Campos de gampes_textual_paginas usados na montagem do contexto (fase 5)
+PAGE_SOURCE_FIELDS = ("id_textual", "pagina", "texto", *PAGE_DOCUMENT_FIELDS)
 
 def buscar_ids(ids_documento_gampes, ids_documento_mni):
     """
@@ -96,7 +105,9 @@ def buscar_paginas_por_ids(ids, es):
                 },
                 "size": 1000 # Adjust size as needed
             }
-            resposta = es.search(index="gampes_textual_paginas", body=query)
+            with span("es.paginas_por_documento") as s:
+                resposta = es.search(index="gampes_textual_paginas", body=query)
+                s["resultados"] = len(resposta["hits"]["hits"])
 
             if resposta["hits"]["total"]["value"] > 0:
                 for hit in resposta["hits"]["hits"]:
@@ -137,7 +148,9 @@ def buscar_vetores_por_ids(ids_paginas, es: Elasticsearch, key, endpoint, index_
                 "size": 1000 # Adjust as needed
             }
 
-            response = es.search(index=index_vector, body=query)
+            with span("es.vetor_por_pagina") as s:
+                response = es.search(index=index_vector, body=query)
+                s["resultados"] = len(response["hits"]["hits"])
 
             if response['hits']['total']['value'] > 0:
                 ids_documentos.append(response['hits']['hits'][0]['_id'])
@@ -147,7 +160,8 @@ def buscar_vetores_por_ids(ids_paginas, es: Elasticsearch, key, endpoint, index_
                     "id_pagina": id_pagina,
                     "embedding": embedding
                 }
-                es.index(index=index_vector, body=new_doc)
+                with span("es.indexar_vetor"):
+                    es.index(index=index_vector, body=new_doc)
                 logging.info(f"New document created for id_pagina: {id_pagina}")
 
     except Exception as e:
@@ -218,7 +232,9 @@ def vector_similarity_search(es, prompt_embedding, id_list, k=5, similarity_thre
             }
         }
 
-        response = es.search(index="gampes_vector_small", body=query)
+        with span("es.busca_vetorial", ids=len(id_list), k=k) as s:
+            response = es.search(index="gampes_vector_small", body=query)
+            s["resultados"] = len(response["hits"]["hits"])
 
         results = []
         for hit in response["hits"]["hits"]:
@@ -260,7 +276,8 @@ def bm25_similarity_search(es, prompt, id_list, k=5):
         k (int): Number of top results to return.
 
     Returns:
-        list: List of tuples containing document IDs and their BM25 scores.
+        list: List of tuples (document ID, BM25 score, _source with PAGE_SOURCE_FIELDS),
+            so the pages found need no further read in process_merged_results.
     """
     logging.info("Performing BM25 similarity search.")
     try:
@@ -278,11 +295,14 @@ def bm25_similarity_search(es, prompt, id_list, k=5):
                     "filter": [{"terms": {"_id": id_list}}]
                 }
             },
+            "_source": list(PAGE_SOURCE_FIELDS),
             "size": k
         }
         
-        response = es.search(index="gampes_textual_paginas", body=query)
-        top_results = [(hit["_id"], hit["_score"]) for hit in response['hits']['hits']]
+        with span("es.busca_bm25", ids=len(id_list), k=k, caracteres=len(prompt)) as s:
+            response = es.search(index="gampes_textual_paginas", body=query)
+            s["resultados"] = len(response["hits"]["hits"])
+        top_results = [(hit["_id"], hit["_score"], hit.get("_source") or {}) for hit in response['hits']['hits']]
         
         logging.info("BM25 similarity search completed successfully.")
         return top_results
@@ -297,7 +317,7 @@ def merge_and_rerank(vector_results, bm25_results, vector_weight=0.5, bm25_weigh
 
     Args:
         vector_results (list): List of tuples containing document IDs and vector similarity scores.
-        bm25_results (list): List of tuples containing document IDs and BM25 scores.
+        bm25_results (list): List of tuples starting with document IDs and BM25 scores.
         vector_weight (float): Weight for vector similarity scores.
         bm25_weight (float): Weight for BM25 scores.
 
@@ -307,13 +327,13 @@ def merge_and_rerank(vector_results, bm25_results, vector_weight=0.5, bm25_weigh
     logging.info("Merging and reranking results.")
     combined_scores = {}
     
-    for doc_id, score in vector_results:
+    for doc_id, score, *_ in vector_results:
         combined_scores[doc_id] = {
             'vector': score,
             'bm25': 0.0
         }
     
-    for doc_id, score in bm25_results:
+    for doc_id, score, *_ in bm25_results:
         if doc_id in combined_scores:
             combined_scores[doc_id]['bm25'] = score
         else:
@@ -339,7 +359,7 @@ def merge_and_rerank_rrf(vector_results, bm25_results, k=60):
     Args:
         vector_results (list): List of tuples (doc_id, score) from vector search.
                                Can be empty if all scores were below threshold.
-        bm25_results (list): List of tuples (doc_id, score) from BM25 search.
+        bm25_results (list): List of tuples (doc_id, score, _source) from BM25 search.
         k (int): Parameter for RRF, controlling the influence of rank.
                  Lower k gives more weight to top ranks. Defaults to 60.
 
@@ -359,7 +379,7 @@ def merge_and_rerank_rrf(vector_results, bm25_results, k=60):
     # Process vector results (if any)
     if vector_results:
         logging.info(f"Processing {len(vector_results)} vector results.")
-        for rank, (doc_id, _) in enumerate(vector_results):
+        for rank, (doc_id, *_) in enumerate(vector_results):
             # Rank starts at 0, RRF uses 1-based rank, hence rank + 1
             rrf_scores[doc_id] += 1.0 / (k + rank + 1)
     else:
@@ -369,7 +389,7 @@ def merge_and_rerank_rrf(vector_results, bm25_results, k=60):
     # Process BM25 results (if any)
     if bm25_results:
         logging.info(f"Processing {len(bm25_results)} BM25 results.")
-        for rank, (doc_id, _) in enumerate(bm25_results):
+        for rank, (doc_id, *_) in enumerate(bm25_results):
             # Rank starts at 0, RRF uses 1-based rank, hence rank + 1
             rrf_scores[doc_id] += 1.0 / (k + rank + 1)
     else:
@@ -383,65 +403,58 @@ def merge_and_rerank_rrf(vector_results, bm25_results, k=60):
     return merged
 
 
-def get_document_fields(es, _id):
+def get_pages_fields(es, ids, index_name="gampes_textual_paginas"):
     """
-    Retrieve document fields from Elasticsearch based on document ID.
+    Retrieve the PAGE_SOURCE_FIELDS of several pages with one mget.
 
     Args:
-        _id (str): The document ID.
+        ids (list): The page IDs.
 
     Returns:
-        dict: Dictionary containing document fields (id_textual, pagina, texto) or None if not found.
+        dict: page ID -> _source (id_textual, pagina, texto, plus the PAGE_DOCUMENT_FIELDS
+            already denormalized onto the page), only for the pages found.
     """
-    logging.info(f"Retrieving document fields for ID: {_id}")
+    if not ids:
+        return {}
+    logging.info(f"Retrieving document fields for {len(ids)} pages")
     try:
-        index_name = "gampes_textual_paginas"
-        response = es.get(index=index_name, id=_id)
-
-        if response['found']:
-            id_textual = response['_source']['id_textual']
-            pagina = response['_source']['pagina']
-            texto = response['_source']['texto']
-
-            return {
-                'id_textual': id_textual,
-                'pagina': pagina,
-                'texto': texto
-            }
-        else:
-            return None
+        with span("es.campos_pagina", paginas=len(ids)):
+            response = es.mget(index=index_name, ids=list(ids), source=list(PAGE_SOURCE_FIELDS))
+        return {doc['_id']: doc['_source'] for doc in response['docs'] if doc.get('found')}
     except Exception as e:
-        logging.error(f"Error retrieving document fields for ID {_id}: {e}")
-        return None
+        logging.error(f"Error retrieving document fields for pages {ids}: {e}")
+        return {}
 
-def process_merged_results(es, merged_results):
+def process_merged_results(es, merged_results, bm25_results=()):
     """
     Process merged results to retrieve document fields.
 
+    The pages found by the BM25 search already carry their _source; only the
+    pages found by the vector search alone are read, all with one mget.
+
     Args:
         merged_results (list): List of tuples containing document IDs and their combined scores.
+        bm25_results (list): Tuples (doc_id, score, _source) returned by bm25_similarity_search.
 
     Returns:
         list: List of dictionaries containing document fields and scores.
     """
     logging.info("Processing merged results.")
+    sources = {doc_id: source for doc_id, _, source in bm25_results if source}
+    sources.update(get_pages_fields(es, [doc_id for doc_id, _ in merged_results if doc_id not in sources]))
     processed_results = []
 
     for doc_id, score in merged_results:
-        document_fields = get_document_fields(es, doc_id)
-        
+        document_fields = sources.get(doc_id)
+
         if document_fields:
-            id_pagina = doc_id
-            id_textual = document_fields['id_textual']
-            pagina = document_fields['pagina']
-            texto = document_fields['texto']
-            
             processed_results.append({
-                'id_pagina': id_pagina,
-                'id_textual': id_textual,
-                'pagina': pagina,
-                'texto': texto,
-                'score': score
+                'id_pagina': doc_id,
+                'id_textual': document_fields['id_textual'],
+                'pagina': document_fields['pagina'],
+                'texto': document_fields['texto'],
+                'score': score,
+                **{field: document_fields[field] for field in PAGE_DOCUMENT_FIELDS if field in document_fields}
             })
     
     logging.info("Merged results processed successfully.")
@@ -451,6 +464,10 @@ def enhance_results(es, final_results, es_index="gampes_textual"):
     """
     Enhance results by fetching additional data from Elasticsearch.
 
+    Pages denormalized by tools.denormalize_pages already carry
+    id_documento_gampes and id_identificador_MNI; the documents of the other
+    results are read from `es_index` with one mget.
+
     Args:
         final_results (list): List of dictionaries containing document fields and scores.
         es_index (str): Elasticsearch index to fetch additional data from.
@@ -459,25 +476,25 @@ def enhance_results(es, final_results, es_index="gampes_textual"):
         list: List of dictionaries containing enriched document fields and scores.
     """
     logging.info("Enhancing results.")
-    enriched_results = []
-    
-    for result in final_results:
-        id_textual = result['id_textual']
-        
+    missing = {result['id_textual'] for result in final_results if 'id_documento_gampes' not in result or 'id_identificador_MNI' not in result}
+    documents = {}
+    if missing:
         try:
-            response = es.get(index=es_index, id=id_textual)
-            source = response['_source']
-            id_documento_gampes = source.get('id_documento_gampes', None)
-            id_documento_mni = source.get('id_identificador_MNI', None)
+            with span("es.documento_textual", documentos=len(missing)):
+                response = es.mget(index=es_index, ids=list(missing), source=["id_documento_gampes", "id_identificador_MNI"])
+            documents = {doc['_id']: doc['_source'] for doc in response['docs'] if doc.get('found')}
         except Exception as e:
-            logging.error(f"Error fetching data from Elasticsearch for id_textual {id_textual}: {e}")
-            id_documento_gampes = None
-            id_documento_mni = None
-        
+            logging.error(f"Error fetching data from Elasticsearch for id_textual {sorted(missing)}: {e}")
+
+    enriched_results = []
+    for result in final_results:
         enriched_result = result.copy()
-        enriched_result['id_documento_gampes'] = id_documento_gampes
-        enriched_result['id_documento_mni'] = id_documento_mni
-        
+        if 'id_documento_gampes' in result and 'id_identificador_MNI' in result:
+            enriched_result['id_documento_mni'] = result['id_identificador_MNI']
+        else:
+            source = documents.get(result['id_textual'], {})
+            enriched_result['id_documento_gampes'] = source.get('id_documento_gampes', None)
+            enriched_result['id_documento_mni'] = source.get('id_identificador_MNI', None)
         enriched_results.append(enriched_result)
     
     return enriched_results
@@ -494,7 +511,11 @@ def update_document(
     mensagem_erro=None,
     data_criacao=None,
     usuario=None,
-    tipo_requisicao=None
+    tipo_requisicao=None,
+    fase=None,
+    texto_parcial=None,
+    tempos=None,
+    uso=None
 ):
     # Prepara o dicionário apenas com campos não-nulos
     fields = [
@@ -505,7 +526,11 @@ def update_document(
         ('mensagem_erro', mensagem_erro),
         ('data_criacao', data_criacao),
         ('usuario', usuario),
-        ('tipo_requisicao', tipo_requisicao)
+        ('tipo_requisicao', tipo_requisicao),
+        ('fase', fase),
+        ('texto_parcial', texto_parcial),
+        ('tempos', tempos),
+        ('uso', uso)
     ]
     body = {"doc": {key: value for key, value in fields if value is not None}}
 
@@ -513,5 +538,8 @@ def update_document(
         print("Nenhum campo para atualizar.")
         return
 
-    response = es.update(index=index, id=id, body=body)
+    with span("es.atualizar_status"):
+        response = es.update(index=index, id=id, body=body)
+    # Avisa a API para que clientes em SSE/long-poll vejam a mudança imediatamente
+    notify_status(id, body["doc"])
     return response
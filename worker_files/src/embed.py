@@ -1,10 +1,16 @@
 import os
 import requests
 from elasticsearch import Elasticsearch
+from elasticsearch.serializer import OrjsonSerializer
 from dotenv import load_dotenv
 from elasticsearch import Elasticsearch, NotFoundError
 from typing import List
 import logging
+from src.ratelimit import acquire, deployment_from_url
+from src.tokens import count_tokens
+from src.retry import call_with_retry, RetryableError, RETRYABLE_STATUS
+from src.spans import span
+from src.usage import record_usage
 
 # Load environment variables
 load_dotenv()
@@ -16,38 +22,93 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 endpoint = os.getenv('AZURE_OPENAI_ENDPOINT')
 azure_key = os.getenv('AZURE_OPENAI_KEY')
 
+# Prazo total (todas as tentativas) e número máximo de tentativas por chamada de embedding
+embedding_call_deadline = float(os.getenv("EMBEDDING_CALL_DEADLINE", "60"))
+embedding_max_attempts = int(os.getenv("EMBEDDING_MAX_ATTEMPTS", "5"))
+
 # Elasticsearch connection
 elasticsearch_host = os.getenv('ELASTICSEARCH_HOST')
-es = Elasticsearch(elasticsearch_host)
+es = Elasticsearch(elasticsearch_host, serializer=OrjsonSerializer())
 
-def get_embeddings(text, key, endpoint):
+def _request_embeddings(payload_input, tokens, key, endpoint):
     """
-    Generate embeddings for the given text using Azure OpenAI API.
-
-    Args:
-        text (str): The text to generate embeddings for.
+    Send one embeddings request, retrying transient failures.
 
     Returns:
-        list: The generated embedding vector if successful, None otherwise.
+        list: The "data" items of the response, or None if the request failed.
     """
-
-    logging.info("Generating embeddings.")
     headers = {
         "Content-Type": "application/json",
         "api-key": key
     }
-    payload = {"input": text}
-    
-    response = requests.post(endpoint, headers=headers, json=payload)
+    payload = {"input": payload_input}
+    deployment = deployment_from_url(endpoint)
+
+    def _post(timeout):
+        # A espera pelo orçamento conta no prazo; sem orçamento a tempo, a chamada falha (TimeoutError)
+        timeout -= acquire(deployment, tokens, timeout=timeout)
+        response = requests.post(endpoint, headers=headers, json=payload, timeout=max(1.0, timeout))
+        if response.status_code in RETRYABLE_STATUS:
+            raise RetryableError(f"{response.status_code} - {response.text}", response.status_code, response.headers)
+        return response
+
+    entradas = len(payload_input) if isinstance(payload_input, list) else 1
+    try:
+        # Somente esta chamada é repetida em falhas transitórias (429, 5xx, timeouts)
+        with span("embedding", entradas=entradas, tokens=tokens):
+            response = call_with_retry(_post, deadline=embedding_call_deadline, max_attempts=embedding_max_attempts, description="Embedding request")
+    except Exception as e:
+        logging.error(f"Error generating embedding: {e}")
+        return None
     
     if response.status_code == 200:
-        logging.info("Embeddings generated successfully.")
-        return response.json()["data"][0]["embedding"]
+        body = response.json()
+        record_usage("embedding", deployment, body.get("usage"))
+        return body["data"]
     else:
         logging.error(f"Error generating embedding: {response.status_code} - {response.text}")
         return None
 
 
+def get_embeddings(text, key, endpoint):
+    """
+    Generate embeddings for the given text using Azure OpenAI API.
+
+    Args:
+        text (str): The text to generate embeddings for.
+
+    Returns:
+        list: The generated embedding vector if successful, None otherwise.
+    """
+
+    logging.info("Generating embeddings.")
+    data = _request_embeddings(text, count_tokens(text), key, endpoint)
+    if data is None:
+        return None
+    logging.info("Embeddings generated successfully.")
+    return data[0]["embedding"]
+
+
+def get_embeddings_batch(texts, key, endpoint):
+    """
+    Generate embeddings for several texts with a single Azure OpenAI request.
+
+    Args:
+        texts (list): The texts to generate embeddings for.
+
+    Returns:
+        list: One embedding vector per text, in input order, or None if the request failed.
+    """
+    if not texts:
+        return []
+    logging.info(f"Generating embeddings for {len(texts)} texts.")
+    data = _request_embeddings(texts, sum(count_tokens(t) for t in texts), key, endpoint)
+    if data is None:
+        return None
+    logging.info("Embeddings generated successfully.")
+    return [item["embedding"] for item in sorted(data, key=lambda item: item["index"])]
+
+
 
 def process_and_store_embedding(es_client: Elasticsearch, document_id: str) -> str:
     """
@@ -86,7 +147,7 @@ def process_and_store_embedding(es_client: Elasticsearch, document_id: str) -> s
     )
     
     texto_content = doc['_source']['texto']
-    embedding_vector = get_embeddings(texto_content)
+    embedding_vector = get_embeddings(texto_content, azure_key, endpoint)
     
     if embedding_vector is None:
         raise ValueError("Failed to generate embedding")
@@ -144,7 +205,7 @@ def process_and_store_embeddings(es_client: Elasticsearch, document_ids: List[st
             )
             
             texto_content = doc['_source']['texto']
-            embedding_vector = get_embeddings(texto_content)
+            embedding_vector = get_embeddings(texto_content, azure_key, endpoint)
             
             if embedding_vector is None:
                 logging.error(f"Failed to generate embedding for document {document_id}")
@@ -0,0 +1,79 @@
+import os
+import logging
+from dotenv import load_dotenv
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from src.spans import add_listener
+
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Porta do servidor de métricas embutido (0 desativa)
+metrics_port = int(os.getenv("METRICS_PORT", "9102"))
+
+TASK_BUCKETS = (1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120, 180, 300, 600, 1200)
+CALL_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Spans que não são chamadas externas, observados como fases
+INTERNAL_SPANS = {"compressao"}
+
+tasks_in_flight = Gauge("rag_worker_tasks_in_flight", "Tasks being processed by this worker.")
+tasks_total = Counter("rag_worker_tasks_total", "Tasks finished by this worker, by final status.", ["status"])
+task_duration = Histogram("rag_worker_task_duration_seconds", "Processing time of a task, from claim to completion.", buckets=TASK_BUCKETS)
+task_end_to_end = Histogram("rag_task_end_to_end_seconds", "Time from enqueue to completion (queue wait plus processing).", buckets=TASK_BUCKETS)
+claim_latency = Histogram("rag_worker_claim_latency_seconds", "Time a task waited in the queue before being claimed.", buckets=TASK_BUCKETS)
+phase_duration = Histogram("rag_worker_phase_duration_seconds", "Duration of each pipeline phase.", ["phase"], buckets=CALL_BUCKETS)
+external_calls = Counter("rag_worker_external_calls_total", "External calls (OCR, Elasticsearch, embeddings, LLM, SQL).", ["call"])
+external_call_errors = Counter("rag_worker_external_call_errors_total", "External calls that failed.", ["call"])
+external_call_duration = Histogram("rag_worker_external_call_duration_seconds", "Latency of external calls.", ["call"], buckets=CALL_BUCKETS)
+tokens_total = Counter("rag_tokens_total", "Tokens of every LLM and embedding call, by call type, deployment and kind (prompt, cached, completion).", ["call", "deployment", "kind"])
+token_cost_total = Counter("rag_token_cost_total", "Estimated cost of the LLM and embedding calls (TOKEN_PRICES), by call type and idorgao.", ["call", "idorgao"])
+batch_cache_lookups = Counter("rag_worker_batch_cache_lookups_total", "Lookups of the per-batch phase 2 cache.", ["result"])
+
+
+def observe_span(registro):
+    """Feed a finished span (see src.spans) into the phase and call metrics; tokens come from observe_usage."""
+    nome = registro["nome"]
+    seconds = registro["duracao_ms"] / 1000.0
+    if nome.startswith("fase.") or nome in INTERNAL_SPANS:
+        phase_duration.labels(nome.removeprefix("fase.")).observe(seconds)
+        return
+
+    external_calls.labels(nome).inc()
+    external_call_duration.labels(nome).observe(seconds)
+    if "erro" in registro:
+        external_call_errors.labels(nome).inc()
+
+
+def observe_usage(chamadas, idorgao):
+    """Feed the calls of a task's UsageRecorder into the token and cost metrics."""
+    for registro in chamadas:
+        for kind in ("prompt", "cached", "completion"):
+            if registro[f"{kind}_tokens"]:
+                tokens_total.labels(registro["chamada"], registro["deployment"], kind).inc(registro[f"{kind}_tokens"])
+        if registro["custo"]:
+            token_cost_total.labels(registro["chamada"], idorgao or "").inc(registro["custo"])
+
+
+def start_metrics_server(port=None):
+    """
+    Start the embedded Prometheus HTTP server and hook the span metrics.
+
+    If the port is taken (e.g. by another worker on the same host), the
+    worker logs a warning and runs without metrics instead of dying.
+
+    Returns:
+        bool: True if the server was started.
+    """
+    port = metrics_port if port is None else port
+    if not port:
+        return False
+    try:
+        start_http_server(port)
+    except OSError as e:
+        logging.warning(f"Metrics server not started on port {port}: {e}; set a distinct METRICS_PORT per worker process")
+        return False
+    add_listener(observe_span)
+    logging.info(f"Metrics server listening on port {port}")
+    return True
@@ -1,14 +1,156 @@
-import os  
-from openai import AzureOpenAI  
+import os
+import asyncio
+import threading
+import httpx
+from openai import AzureOpenAI, AsyncAzureOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
 from dotenv import load_dotenv
 import logging
+from src.ratelimit import acquire
+from src.tokens import count_tokens
+from src.retry import call_with_retry, call_with_retry_async
 
 load_dotenv()
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def generate_chat_completion(endpoint, deployment, subscription_key, role, prompt):
+# Azure OpenAI client settings
+API_VERSION = "2024-05-01-preview"
+
+# Limites do pool de conexões HTTP compartilhado pelos clientes
+HTTP_POOL_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("AZURE_OPENAI_MAX_CONNECTIONS", "20")),
+    max_keepalive_connections=int(os.getenv("AZURE_OPENAI_MAX_KEEPALIVE", "10")),
+    keepalive_expiry=float(os.getenv("AZURE_OPENAI_KEEPALIVE_EXPIRY", "120")),
+)
+HTTP_TIMEOUT = httpx.Timeout(
+    float(os.getenv("AZURE_OPENAI_TIMEOUT", "120")),
+    connect=float(os.getenv("AZURE_OPENAI_CONNECT_TIMEOUT", "10")),
+)
+
+# Prazo total (todas as tentativas) e número máximo de tentativas por chamada ao LLM
+llm_call_deadline = float(os.getenv("LLM_CALL_DEADLINE", "300"))
+llm_max_attempts = int(os.getenv("LLM_MAX_ATTEMPTS", "5"))
+
+# Registro de clientes: um cliente por (endpoint, chave, api_version)
+_clients = {}
+_async_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(endpoint, subscription_key, api_version=API_VERSION):
+    """
+    Return the shared Azure OpenAI client for the given endpoint and key.
+
+    The client is created on first use and reused afterwards, so the TLS
+    handshake and the connection pool are paid once per process. The
+    client is thread-safe and may be shared between threads.
+
+    Args:
+        endpoint (str): The Azure OpenAI endpoint URL.
+        subscription_key (str): The subscription key for Azure OpenAI.
+        api_version (str): The Azure OpenAI API version.
+
+    Returns:
+        AzureOpenAI: The pooled client.
+    """
+    key = (endpoint, subscription_key, api_version)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                logging.info("Initializing Azure OpenAI client.")
+                client = AzureOpenAI(
+                    azure_endpoint=endpoint,
+                    api_key=subscription_key,
+                    api_version=api_version,
+                    timeout=HTTP_TIMEOUT,
+                    max_retries=0,  # As novas tentativas ficam a cargo de src.retry
+                    http_client=DefaultHttpxClient(limits=HTTP_POOL_LIMITS, timeout=HTTP_TIMEOUT),
+                )
+                _clients[key] = client
+    return client
+
+
+def get_async_client(endpoint, subscription_key, api_version=API_VERSION):
+    """
+    Return the shared async Azure OpenAI client for the given endpoint and key.
+
+    Async twin of `get_client` for asyncio callers. The client must be used
+    from the event loop it was first used on.
+
+    Args:
+        endpoint (str): The Azure OpenAI endpoint URL.
+        subscription_key (str): The subscription key for Azure OpenAI.
+        api_version (str): The Azure OpenAI API version.
+
+    Returns:
+        AsyncAzureOpenAI: The pooled async client.
+    """
+    key = (endpoint, subscription_key, api_version)
+    client = _async_clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _async_clients.get(key)
+            if client is None:
+                logging.info("Initializing async Azure OpenAI client.")
+                client = AsyncAzureOpenAI(
+                    azure_endpoint=endpoint,
+                    api_key=subscription_key,
+                    api_version=api_version,
+                    timeout=HTTP_TIMEOUT,
+                    max_retries=0,
+                    http_client=DefaultAsyncHttpxClient(limits=HTTP_POOL_LIMITS, timeout=HTTP_TIMEOUT),
+                )
+                _async_clients[key] = client
+    return client
+
+
+def close_clients():
+    """
+    Close every pooled synchronous client and clear the registry.
+
+    Async clients are only dropped from the registry; close them with
+    `await client.close()` from their own event loop.
+    """
+    with _clients_lock:
+        for client in _clients.values():
+            try:
+                client.close()
+            except Exception as e:
+                logging.error(f"Error closing Azure OpenAI client: {e}")
+        _clients.clear()
+        _async_clients.clear()
+
+
+def _build_chat_prompt(role, prompt):
+    # Prepare the chat prompt with the provided role and prompt
+    return [
+        {
+            "role": "system",
+            "content": role
+        },
+        {
+            "role": "user",
+            "content": prompt
+        }
+    ]
+
+
+def _attempt_timeout(remaining):
+    """Bound the read timeout of one attempt by what is left of the call deadline."""
+    return httpx.Timeout(max(1.0, min(HTTP_TIMEOUT.read, remaining)), connect=HTTP_TIMEOUT.connect)
+
+
+def _log_completion_error(e):
+    if "maximum context length" in str(e) or "context_length_exceeded" in str(e):
+        logging.error("Exceeded token limit. Consider reducing input size.")
+    else:
+        logging.error(f"Error generating chat completion: {e}")
+
+
+def generate_chat_completion(endpoint, deployment, subscription_key, role, prompt, client=None, max_tokens=4096, temperature=0.2, deadline=None):
     """
     Generate a chat completion using Azure OpenAI.
 
@@ -18,44 +160,44 @@ def generate_chat_completion(endpoint, deployment, subscription_key, role, promp
         subscription_key (str): The subscription key for Azure OpenAI.
         role (str): The role description for the system message.
         prompt (str): The user prompt for the chat completion.
+        client (AzureOpenAI, optional): Client to use. Defaults to the pooled
+            client for `endpoint` and `subscription_key`.
+        max_tokens (int): Maximum tokens of the completion.
+        temperature (float): Sampling temperature.
+        deadline (float, optional): Total seconds allowed for the call,
+            retries included. Defaults to LLM_CALL_DEADLINE.
 
     Returns:
         dict: The completion result as a dictionary, or None if an error occurs.
     """
     try:
-        logging.info("Initializing Azure OpenAI client.")
-        # Initialize the Azure OpenAI client
-        client = AzureOpenAI(
-            azure_endpoint=endpoint,
-            api_key=subscription_key,
-            api_version="2024-05-01-preview",
-        )
-
-        # Prepare the chat prompt with the provided role and prompt
-        chat_prompt = [
-            {
-                "role": "system",
-                "content": role  # Change this to a string
-            },
-            {
-                "role": "user",
-                "content": prompt  # Change this to a string
-            }
-        ]
-
-        logging.info("Generating chat completion.")
-        # Generate the completion
-        completion = client.chat.completions.create(
-            model=deployment,
-            messages=chat_prompt,
-            max_tokens=4096,  # Aumente para o máximo que o modelo suporta (ajuste conforme necessário)
-            temperature=0.2,  # Reduza para respostas mais determinísticas e coerentes
-            top_p=1.0,        # Permita que o modelo explore todas as possibilidades
-            frequency_penalty=0,  # Sem penalização de frequência
-            presence_penalty=0,   # Sem penalização de presença
-            stop=None,         # Sem paradas forçadas
-            stream=False       # Desative o streaming para obter a resposta completa de uma vez
-        )
+        if client is None:
+            client = get_client(endpoint, subscription_key)
+
+        chat_prompt = _build_chat_prompt(role, prompt)
+
+        # O Azure estima o consumo da requisição como tokens de entrada + max_tokens
+        estimated_tokens = count_tokens(role) + count_tokens(prompt) + max_tokens
+
+        def _create(timeout):
+            # A espera pelo orçamento conta no prazo; sem orçamento a tempo, a chamada falha (TimeoutError)
+            timeout -= acquire(deployment, estimated_tokens, timeout=timeout)
+            logging.info("Generating chat completion.")
+            return client.chat.completions.create(
+                model=deployment,
+                messages=chat_prompt,
+                max_tokens=max_tokens,  # Limite de saída definido pela rota do estágio
+                temperature=temperature,  # Baixa para respostas mais determinísticas e coerentes
+                top_p=1.0,        # Permita que o modelo explore todas as possibilidades
+                frequency_penalty=0,  # Sem penalização de frequência
+                presence_penalty=0,   # Sem penalização de presença
+                stop=None,         # Sem paradas forçadas
+                stream=False,      # Desative o streaming para obter a resposta completa de uma vez
+                timeout=_attempt_timeout(timeout)
+            )
+
+        # Somente esta chamada é repetida em falhas transitórias (429, 5xx, timeouts)
+        completion = call_with_retry(_create, deadline=deadline or llm_call_deadline, max_attempts=llm_max_attempts, description="Chat completion")
 
         logging.info("Chat completion generated successfully.")
         # Return the completion result as JSON
@@ -63,7 +205,142 @@ def generate_chat_completion(endpoint, deployment, subscription_key, role, promp
         return completion.to_dict()
 
     except Exception as e:
-        if "maximum context length" in str(e) or "context_length_exceeded" in str(e):
-            logging.error("Exceeded token limit. Consider reducing input size.")
-        else:
-            logging.error(f"Error generating chat completion: {e}")
+        _log_completion_error(e)
+
+
+async def generate_chat_completion_async(endpoint, deployment, subscription_key, role, prompt, client=None, max_tokens=4096, temperature=0.2, deadline=None):
+    """
+    Async twin of `generate_chat_completion` for asyncio callers.
+
+    Args:
+        endpoint (str): The Azure OpenAI endpoint URL.
+        deployment (str): The deployment name of the model.
+        subscription_key (str): The subscription key for Azure OpenAI.
+        role (str): The role description for the system message.
+        prompt (str): The user prompt for the chat completion.
+        client (AsyncAzureOpenAI, optional): Client to use. Defaults to the
+            pooled async client for `endpoint` and `subscription_key`.
+        max_tokens (int): Maximum tokens of the completion.
+        temperature (float): Sampling temperature.
+        deadline (float, optional): Total seconds allowed for the call,
+            retries included. Defaults to LLM_CALL_DEADLINE.
+
+    Returns:
+        dict: The completion result as a dictionary, or None if an error occurs.
+    """
+    try:
+        if client is None:
+            client = get_async_client(endpoint, subscription_key)
+
+        estimated_tokens = count_tokens(role) + count_tokens(prompt) + max_tokens
+
+        async def _create(timeout):
+            timeout -= await asyncio.to_thread(acquire, deployment, estimated_tokens, timeout)
+            logging.info("Generating chat completion (async).")
+            return await client.chat.completions.create(
+                model=deployment,
+                messages=_build_chat_prompt(role, prompt),
+                max_tokens=max_tokens,
+                temperature=temperature,
+                top_p=1.0,
+                frequency_penalty=0,
+                presence_penalty=0,
+                stop=None,
+                stream=False,
+                timeout=_attempt_timeout(timeout)
+            )
+
+        completion = await call_with_retry_async(_create, deadline=deadline or llm_call_deadline, max_attempts=llm_max_attempts, description="Chat completion")
+
+        logging.info("Chat completion generated successfully.")
+        return completion.to_dict()
+
+    except Exception as e:
+        _log_completion_error(e)
+
+
+def stream_chat_completion(endpoint, deployment, subscription_key, role, prompt, on_delta, client=None, max_tokens=4096, temperature=0.2, deadline=None):
+    """
+    Generate a chat completion with streaming, reporting the text as it is produced.
+
+    Only opening the stream is retried; a failure in the middle of the
+    stream is reported like any other error.
+
+    Args:
+        endpoint (str): The Azure OpenAI endpoint URL.
+        deployment (str): The deployment name of the model.
+        subscription_key (str): The subscription key for Azure OpenAI.
+        role (str): The role description for the system message.
+        prompt (str): The user prompt for the chat completion.
+        on_delta (callable): Called with every new piece of content.
+        client (AzureOpenAI, optional): Client to use. Defaults to the pooled client.
+        max_tokens (int): Maximum tokens of the completion.
+        temperature (float): Sampling temperature.
+        deadline (float, optional): Total seconds allowed to open the stream, retries included.
+
+    Returns:
+        dict: The completion in the same shape as `generate_chat_completion`
+        returns, or None if an error occurs. Usage is estimated locally when
+        the API does not report it for streams.
+    """
+    try:
+        if client is None:
+            client = get_client(endpoint, subscription_key)
+
+        chat_prompt = _build_chat_prompt(role, prompt)
+        prompt_tokens = count_tokens(role) + count_tokens(prompt)
+
+        def _create(timeout):
+            timeout -= acquire(deployment, prompt_tokens + max_tokens, timeout=timeout)
+            logging.info("Generating chat completion (stream).")
+            return client.chat.completions.create(
+                model=deployment,
+                messages=chat_prompt,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                top_p=1.0,
+                frequency_penalty=0,
+                presence_penalty=0,
+                stop=None,
+                stream=True,
+                timeout=_attempt_timeout(timeout)
+            )
+
+        stream = call_with_retry(_create, deadline=deadline or llm_call_deadline, max_attempts=llm_max_attempts, description="Chat completion stream")
+
+        content = []
+        completion_id = model = finish_reason = usage = None
+        for chunk in stream:
+            completion_id = completion_id or chunk.id or None
+            model = chunk.model or model
+            if getattr(chunk, "usage", None):
+                usage = chunk.usage.to_dict()
+            # O Azure envia um primeiro chunk sem choices (resultado do filtro de conteúdo)
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            finish_reason = choice.finish_reason or finish_reason
+            if choice.delta and choice.delta.content:
+                content.append(choice.delta.content)
+                on_delta(choice.delta.content)
+
+        text = "".join(content)
+        if usage is None:
+            completion_tokens = count_tokens(text)
+            usage = {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+
+        logging.info("Chat completion generated successfully.")
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": finish_reason}],
+            "usage": usage
+        }
+
+    except Exception as e:
+        _log_completion_error(e)
@@ -0,0 +1,50 @@
+import os
+import logging
+import orjson
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# URL base da API que recebe as mudanças de status (ex.: http://localhost:2001)
+api_notify_url = os.getenv("API_NOTIFY_URL")
+notify_token = os.getenv("NOTIFY_TOKEN")
+notify_timeout = float(os.getenv("API_NOTIFY_TIMEOUT", "2"))
+
+# Sessão HTTP reutilizada entre notificações
+_session = requests.Session()
+
+
+def notify_status(task_id, fields):
+    """
+    Push a status change of a task to the API, so streaming clients see it immediately.
+
+    Best effort: failures are logged and ignored, since the API also polls
+    Elasticsearch for watched tasks.
+
+    Args:
+        task_id (str): The task ID (Elasticsearch document ID).
+        fields (dict): The fields that changed in the status document.
+
+    Returns:
+        bool: True if the API acknowledged the notification.
+    """
+    if not api_notify_url:
+        return False
+    headers = {"Content-Type": "application/json"}
+    if notify_token:
+        headers["X-Notify-Token"] = notify_token
+    try:
+        response = _session.post(
+            f"{api_notify_url.rstrip('/')}/rag/status/{task_id}/notify",
+            data=orjson.dumps(fields, default=str),
+            headers=headers,
+            timeout=notify_timeout,
+        )
+        return response.status_code < 300
+    except Exception as e:
+        logging.warning(f"Could not notify status change of task {task_id}: {e}")
+        return False
@@ -0,0 +1,227 @@
+import os
+import re
+import sys
+import time
+import random
+import logging
+import threading
+import orjson
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Perfil por amostragem (opcional): fração das tarefas perfiladas e limiar de tarefa lenta em segundos (0 desativa)
+profile_enabled = os.getenv("PROFILE_ENABLED", "false").lower() == "true"
+profile_sample_rate = float(os.getenv("PROFILE_SAMPLE_RATE", "0.01"))
+profile_slow_task_seconds = float(os.getenv("PROFILE_SLOW_TASK_SECONDS", "60"))
+profile_interval_ms = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+profile_dir = os.getenv("PROFILE_DIR", "profiles")
+profile_max_files = int(os.getenv("PROFILE_MAX_FILES", "200"))
+
+PROFILE_SUFFIX = ".speedscope.json"
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+
+class TaskProfile:
+    """
+    Wall-clock stack samples of the thread running one task.
+
+    Samples are taken whether the thread is computing or blocked, so time
+    spent waiting on sockets shows up under the call that is waiting. Each
+    distinct stack is stored once with the time attributed to it.
+    """
+
+    def __init__(self, task_id, thread_id, keep):
+        self.task_id = task_id
+        self.thread_id = thread_id
+        self.keep = keep
+        self.started = time.perf_counter()
+        self.last_sample = self.started
+        self.frames = {}
+        self.stacks = {}
+        self.samples = 0
+
+    def _frame_index(self, code):
+        key = (code.co_name, code.co_filename, code.co_firstlineno)
+        index = self.frames.get(key)
+        if index is None:
+            index = self.frames[key] = len(self.frames)
+        return index
+
+    def sample(self, frame, now):
+        stack = []
+        while frame is not None:
+            stack.append(self._frame_index(frame.f_code))
+            frame = frame.f_back
+        stack = tuple(reversed(stack))
+        self.stacks[stack] = self.stacks.get(stack, 0.0) + (now - self.last_sample) * 1000
+        self.last_sample = now
+        self.samples += 1
+
+    def to_speedscope(self, tempos=None):
+        """
+        Speedscope document with the stack samples and, when the task's
+        spans are given, the wall-clock time of each phase and external call.
+        """
+        frames = [{"name": name, "file": file, "line": line} for name, file, line in self.frames]
+        duration = round((self.last_sample - self.started) * 1000, 1)
+        profiles = [{
+            "type": "sampled",
+            "name": f"Amostras {self.task_id}",
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": duration,
+            "samples": [list(stack) for stack in self.stacks],
+            "weights": [round(weight, 3) for weight in self.stacks.values()],
+        }]
+
+        if tempos:
+            # Tempo de parede por span: um perfil com as fases e outro com as chamadas externas e etapas internas
+            names = {}
+
+            def index(name):
+                if name not in names:
+                    names[name] = len(frames)
+                    frames.append({"name": name})
+                return names[name]
+
+            total_ms = tempos.get("total_ms", duration)
+            fases, chamadas = ([], []), ([], [])
+            fases_ms = 0.0
+            for nome, resumo in tempos.get("resumo", {}).items():
+                samples, weights = fases if nome.startswith("fase.") else chamadas
+                samples.append([index(f"{nome} ({resumo['chamadas']}x)")])
+                weights.append(resumo["total_ms"])
+                if nome.startswith("fase."):
+                    fases_ms += resumo["total_ms"]
+            # Tempo da tarefa não coberto por fases (atualizações de status entre elas, etc.)
+            fora_das_fases = total_ms - fases_ms
+            if fora_das_fases > 0:
+                fases[0].append([index("fora das fases")])
+                fases[1].append(round(fora_das_fases, 1))
+            for titulo, (samples, weights) in (("Fases", fases), ("Chamadas externas e etapas internas", chamadas)):
+                profiles.append({
+                    "type": "sampled",
+                    "name": f"{titulo} {self.task_id}",
+                    "unit": "milliseconds",
+                    "startValue": 0,
+                    "endValue": total_ms,
+                    "samples": samples,
+                    "weights": weights,
+                })
+
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": f"Tarefa {self.task_id}",
+            "exporter": "rag-worker",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+
+class _Sampler:
+    """Single background thread sampling the stacks of every profiled task."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.active = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def add(self, profile):
+        with self.lock:
+            self.active[profile.thread_id] = profile
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                self.thread.start()
+
+    def remove(self, profile):
+        with self.lock:
+            if self.active.get(profile.thread_id) is profile:
+                del self.active[profile.thread_id]
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                if not self.active:
+                    self.thread = None
+                    return
+                profiles = list(self.active.values())
+            frames = sys._current_frames()
+            now = time.perf_counter()
+            for profile in profiles:
+                frame = frames.get(profile.thread_id)
+                if frame is not None:
+                    profile.sample(frame, now)
+
+
+_sampler = _Sampler(profile_interval_ms / 1000.0)
+
+
+def _prune(directory, max_files):
+    """Delete the oldest profiles beyond `max_files`."""
+    files = [os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(PROFILE_SUFFIX)]
+    if len(files) <= max_files:
+        return
+    files.sort(key=os.path.getmtime)
+    for path in files[:len(files) - max_files]:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logging.warning(f"Could not remove old profile {path}: {e}")
+
+
+def save_profile(profile, tempos=None, directory=None, max_files=None):
+    """
+    Write `<task_id>.speedscope.json` and apply the retention cap.
+
+    Returns:
+        str: The path written.
+    """
+    directory = directory or profile_dir
+    max_files = profile_max_files if max_files is None else max_files
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, re.sub(r"[^\w.-]", "_", str(profile.task_id)) + PROFILE_SUFFIX)
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(profile.to_speedscope(tempos)))
+    _prune(directory, max_files)
+    return path
+
+
+@contextmanager
+def profiling(task_id, recorder=None):
+    """
+    Sample the stacks of the current thread while the block runs.
+
+    Only when PROFILE_ENABLED is set. A fraction PROFILE_SAMPLE_RATE of the
+    tasks is always saved; with PROFILE_SLOW_TASK_SECONDS > 0 every task is
+    sampled and also saved if it takes longer than that. The span summary of
+    `recorder` (see src.spans) is added as the external-call breakdown.
+
+    Yields:
+        TaskProfile: The profile, or None when the task is not sampled.
+    """
+    keep = profile_enabled and random.random() < profile_sample_rate
+    if not profile_enabled or not (keep or profile_slow_task_seconds > 0):
+        yield None
+        return
+
+    profile = TaskProfile(task_id, threading.get_ident(), keep)
+    _sampler.add(profile)
+    try:
+        yield profile
+    finally:
+        _sampler.remove(profile)
+        duration = time.perf_counter() - profile.started
+        if profile.keep or (profile_slow_task_seconds > 0 and duration >= profile_slow_task_seconds):
+            try:
+                path = save_profile(profile, recorder.to_dict() if recorder is not None else None)
+                logging.info(f"Profile of task {task_id} ({duration:.1f}s, {profile.samples} samples) saved to {path}")
+            except Exception as e:
+                logging.warning(f"Could not save profile of task {task_id}: {e}")
@@ -1,20 +1,118 @@
 import logging
+from src.tokens import count_tokens, truncate_to_tokens
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def create_full_prompt(prompt, enriched_dict):
+def _shingles(text, size=5):
+    """Return the set of hashed word shingles of a text, used for near-duplicate detection."""
+    words = text.lower().split()
+    if len(words) < size:
+        return {hash(" ".join(words))} if words else set()
+    return {hash(" ".join(words[i:i + size])) for i in range(len(words) - size + 1)}
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def build_context(prompt, enriched_dict, max_tokens=None, max_tokens_per_page=None, dedup_threshold=0.9):
+    """
+    Build the full prompt packing as many pages as fit in a token budget.
+
+    Pages are added in score order. Pages longer than max_tokens_per_page, or
+    than what is left of the budget, are trimmed; pages whose word shingles
+    overlap an already included page by dedup_threshold or more are dropped.
+
+    Args:
+        prompt (str): The initial prompt string.
+        enriched_dict (list): A list of dictionaries containing document information.
+        max_tokens (int, optional): Token budget for the whole prompt. None means no limit.
+        max_tokens_per_page (int, optional): Maximum tokens for a single page. None means no limit.
+        dedup_threshold (float): Jaccard similarity from which a page is considered a duplicate.
+
+    Returns:
+        dict: The full prompt ("prompt"), the pages actually included ("sources"),
+        the tokens used ("tokens") and how many pages were trimmed ("truncated"),
+        dropped as duplicates ("dropped_duplicates") or dropped for lack of
+        budget ("dropped_budget").
+    """
+    logging.info("Building token-budgeted context.")
+    header = prompt + "\n\n Fontes de informação:\n\n"
+    parts = [header]
+    tokens_used = count_tokens(header)
+    sources = []
+    kept_shingles = []
+    truncated = dropped_duplicates = dropped_budget = 0
+
+    ranked = sorted(enriched_dict, key=lambda r: r.get('score', 0), reverse=True)
+    for result in ranked:
+        texto = result['texto'] or ""
+        shingles = _shingles(texto)
+        if any(_jaccard(shingles, kept) >= dedup_threshold for kept in kept_shingles):
+            dropped_duplicates += 1
+            continue
+
+        page_header = f"Documento: GAMPES ID n: {result['id_documento_gampes']} PJe ID n: {result['id_documento_mni']}\nPagina {result['pagina']}:\n"
+        page_overhead = count_tokens(page_header) + 1
+        limit = None
+        if max_tokens is not None:
+            limit = max_tokens - tokens_used - page_overhead
+            # Não vale a pena incluir um fragmento minúsculo de página
+            if limit < min(64, max_tokens_per_page or 64):
+                dropped_budget += 1
+                continue
+        if max_tokens_per_page is not None:
+            limit = max_tokens_per_page if limit is None else min(limit, max_tokens_per_page)
+
+        if limit is None:
+            page_tokens = count_tokens(texto)
+        else:
+            trimmed, page_tokens = truncate_to_tokens(texto, limit)
+            if trimmed != texto:
+                truncated += 1
+                texto = trimmed
+
+        parts.append(f"{page_header}{texto}\n\n")
+        tokens_used += page_overhead + page_tokens
+        kept_shingles.append(shingles)
+        sources.append(result)
+
+    logging.info(f"Context built with {len(sources)} pages and {tokens_used} tokens "
+                 f"({truncated} trimmed, {dropped_duplicates} duplicates, {dropped_budget} over budget).")
+    return {
+        "prompt": "".join(parts),
+        "sources": sources,
+        "tokens": tokens_used,
+        "truncated": truncated,
+        "dropped_duplicates": dropped_duplicates,
+        "dropped_budget": dropped_budget
+    }
+
+
+def create_full_prompt(prompt, enriched_dict, max_tokens=None, max_tokens_per_page=None):
     """
     Create a full prompt by appending information from the enriched dictionary.
 
+    Without a budget every page is appended in the given order, as before;
+    with max_tokens or max_tokens_per_page the pages are packed by
+    build_context (score order, trimming and near-duplicate removal).
+
     Args:
         prompt (str): The initial prompt string.
         enriched_dict (list): A list of dictionaries containing document information.
+        max_tokens (int, optional): Token budget for the whole prompt. None means no limit.
+        max_tokens_per_page (int, optional): Maximum tokens for a single page. None means no limit.
 
     Returns:
         str: The full prompt with appended document information.
     """
     logging.info("Creating full prompt.")
+    if max_tokens is not None or max_tokens_per_page is not None:
+        return build_context(prompt, enriched_dict, max_tokens, max_tokens_per_page)["prompt"]
+
     full_prompt = prompt + "\n\n Fontes de informação:\n\n"
     
     for result in enriched_dict:
@@ -0,0 +1,180 @@
+import os
+import re
+import time
+import sqlite3
+import tempfile
+import threading
+import logging
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Arquivo de estado compartilhado entre threads e processos do mesmo host
+rate_limit_db = os.getenv("RATE_LIMIT_DB", os.path.join(tempfile.gettempdir(), "rag_gampes_ratelimit.sqlite3"))
+
+# Limites padrão por deployment (0 = sem limite)
+default_rpm = float(os.getenv("RATE_LIMIT_DEFAULT_RPM", "0"))
+default_tpm = float(os.getenv("RATE_LIMIT_DEFAULT_TPM", "0"))
+
+
+def parse_limits(spec):
+    """
+    Parse per-deployment limits in the form "deployment=rpm:tpm,deployment=rpm:tpm".
+
+    Args:
+        spec (str): The limits specification.
+
+    Returns:
+        dict: Mapping of deployment name to a (rpm, tpm) tuple.
+    """
+    limits = {}
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            name, values = item.split("=", 1)
+            rpm, tpm = values.split(":", 1)
+            limits[name.strip()] = (float(rpm), float(tpm))
+        except ValueError:
+            logging.error(f"Invalid rate limit entry ignored: {item}")
+    return limits
+
+
+# Ex.: RATE_LIMITS="gpt-4o-special-edition=300:150000,text-embedding-3-small=1000:350000"
+deployment_limits = parse_limits(os.getenv("RATE_LIMITS"))
+
+
+def deployment_from_url(url):
+    """
+    Extract the deployment name from an Azure OpenAI URL.
+
+    Args:
+        url (str): A URL such as https://host/openai/deployments/<name>/embeddings?...
+
+    Returns:
+        str: The deployment name, or the URL itself when it has no deployment segment.
+    """
+    match = re.search(r"/deployments/([^/?]+)", url or "")
+    return match.group(1) if match else url
+
+
+class RateLimiter:
+    """
+    Token bucket limiter for requests/min and tokens/min per deployment.
+
+    The bucket state lives in a SQLite file, so every thread and worker
+    process on the host draws from the same budget. Callers only sleep when
+    the bucket of their deployment is exhausted.
+    """
+
+    def __init__(self, path=rate_limit_db, limits=None, rpm=default_rpm, tpm=default_tpm):
+        self.path = path
+        self.limits = deployment_limits if limits is None else limits
+        self.default_rpm = rpm
+        self.default_tpm = tpm
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "deployment TEXT PRIMARY KEY, requests REAL, tokens REAL, updated REAL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def limits_for(self, deployment):
+        return self.limits.get(deployment, (self.default_rpm, self.default_tpm))
+
+    def _try_acquire(self, deployment, tokens, rpm, tpm):
+        """Take from the bucket if possible. Returns 0 on success or the seconds to wait."""
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT requests, tokens, updated FROM buckets WHERE deployment = ?", (deployment,)
+            ).fetchone()
+            if row is None:
+                available_requests, available_tokens = rpm, tpm
+            else:
+                elapsed = max(0.0, now - row[2])
+                available_requests = min(rpm, row[0] + elapsed * rpm / 60.0) if rpm else 0.0
+                available_tokens = min(tpm, row[1] + elapsed * tpm / 60.0) if tpm else 0.0
+
+            wait = 0.0
+            if rpm and available_requests < 1:
+                wait = max(wait, (1 - available_requests) * 60.0 / rpm)
+            if tpm and available_tokens < tokens:
+                wait = max(wait, (tokens - available_tokens) * 60.0 / tpm)
+
+            if wait == 0.0:
+                available_requests -= 1 if rpm else 0
+                available_tokens -= tokens if tpm else 0
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (deployment, requests, tokens, updated) VALUES (?, ?, ?, ?)",
+                (deployment, available_requests, available_tokens, now),
+            )
+            conn.execute("COMMIT")
+            return wait
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def acquire(self, deployment, tokens=0, timeout=None):
+        """
+        Block until the deployment has budget for one request of `tokens` tokens.
+
+        Args:
+            deployment (str): The deployment name.
+            tokens (int): Estimated tokens of the request.
+            timeout (float, optional): Maximum seconds to wait. None waits indefinitely.
+
+        Returns:
+            float: Seconds spent waiting.
+
+        Raises:
+            TimeoutError: If the budget is not available within `timeout`.
+        """
+        rpm, tpm = self.limits_for(deployment)
+        if not rpm and not tpm:
+            return 0.0
+        # Uma requisição maior que o orçamento inteiro nunca caberia no bucket
+        tokens = min(tokens, tpm) if tpm else 0
+
+        start = time.monotonic()
+        while True:
+            wait = self._try_acquire(deployment, tokens, rpm, tpm)
+            waited = time.monotonic() - start
+            if wait == 0.0:
+                if waited > 0.01:
+                    logging.info(f"Rate limiter waited {waited:.2f}s for deployment {deployment}.")
+                return waited
+            if timeout is not None and waited + wait > timeout:
+                raise TimeoutError(f"Rate limit budget for {deployment} not available within {timeout}s")
+            time.sleep(min(wait, 5.0))
+
+
+_default_limiter = None
+_default_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter():
+    """Return the process-wide rate limiter configured from the environment."""
+    global _default_limiter
+    if _default_limiter is None:
+        with _default_limiter_lock:
+            if _default_limiter is None:
+                _default_limiter = RateLimiter()
+    return _default_limiter
+
+
+def acquire(deployment, tokens=0, timeout=None):
+    """Shortcut for `get_rate_limiter().acquire(...)`."""
+    return get_rate_limiter().acquire(deployment, tokens, timeout)
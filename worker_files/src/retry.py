@@ -0,0 +1,187 @@
+import re
+import time
+import asyncio
+import random
+import logging
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+import openai
+import requests
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Status HTTP que indicam falha transitória
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class RetryableError(Exception):
+    """Transient failure of an HTTP call, carrying the response status and headers."""
+
+    def __init__(self, message, status_code=None, headers=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def _parse_duration(value):
+    """
+    Parse a duration header value into seconds.
+
+    Accepts plain seconds ("2", "0.5") and Go-style durations used by the
+    x-ratelimit-reset-* headers ("20ms", "1s", "6m0s").
+    """
+    value = value.strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    factors = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(amount) * factors[unit] for amount, unit in parts)
+
+
+def retry_after_from_headers(headers):
+    """
+    Read how long the server asked us to wait before retrying.
+
+    Looks at retry-after-ms, Retry-After (seconds or HTTP date) and the
+    x-ratelimit-reset-requests / x-ratelimit-reset-tokens headers.
+
+    Args:
+        headers (Mapping): Response headers (case-insensitive mapping or dict).
+
+    Returns:
+        float: Seconds to wait, or None if the headers carry no hint.
+    """
+    if not headers:
+        return None
+    lowered = {k.lower(): v for k, v in headers.items()}
+
+    if "retry-after-ms" in lowered:
+        try:
+            return float(lowered["retry-after-ms"]) / 1000.0
+        except ValueError:
+            pass
+
+    if "retry-after" in lowered:
+        seconds = _parse_duration(lowered["retry-after"])
+        if seconds is not None:
+            return seconds
+        try:
+            retry_at = parsedate_to_datetime(lowered["retry-after"])
+            return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            pass
+
+    resets = [
+        _parse_duration(lowered[name])
+        for name in ("x-ratelimit-reset-requests", "x-ratelimit-reset-tokens")
+        if name in lowered
+    ]
+    resets = [r for r in resets if r is not None]
+    return max(resets) if resets else None
+
+
+def _headers_of(exc):
+    headers = getattr(exc, "headers", None)
+    if headers:
+        return headers
+    response = getattr(exc, "response", None)
+    return getattr(response, "headers", None)
+
+
+def is_retryable(exc):
+    """
+    Tell whether an exception is a transient failure worth retrying.
+
+    Args:
+        exc (Exception): The exception raised by the call.
+
+    Returns:
+        bool: True for timeouts, connection errors and retryable HTTP statuses.
+    """
+    if isinstance(exc, (openai.APIConnectionError, requests.ConnectionError, requests.Timeout)):
+        return True
+    status_code = getattr(exc, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(exc, "response", None), "status_code", None)
+    return status_code in RETRYABLE_STATUS
+
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=30.0):
+    """Full-jitter exponential backoff for the given attempt (1-based)."""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** (attempt - 1))))
+
+
+def _delay_before_retry(exc, attempt, elapsed, deadline, max_attempts, base_delay, max_delay, description):
+    """Return how long to wait before the next attempt, or None when the error must be raised."""
+    if not is_retryable(exc) or attempt >= max_attempts:
+        return None
+    delay = retry_after_from_headers(_headers_of(exc))
+    if delay is None:
+        delay = backoff_delay(attempt, base_delay, max_delay)
+    else:
+        # Pequeno jitter para que workers não voltem todos no mesmo instante
+        delay += random.uniform(0, base_delay / 2)
+    if elapsed + delay >= deadline:
+        logging.error(f"{description} failed and the deadline of {deadline}s does not allow another attempt: {exc}")
+        return None
+    logging.warning(f"{description} failed (attempt {attempt}/{max_attempts}): {exc}. Retrying in {delay:.2f}s.")
+    return delay
+
+
+def call_with_retry(func, deadline=60.0, max_attempts=5, base_delay=1.0, max_delay=30.0, description="call"):
+    """
+    Call `func` and retry it on transient failures until the deadline.
+
+    `func` is called as `func(timeout=remaining_seconds)` so each attempt can
+    bound its own network timeout by what is left of the deadline. Waits
+    honor Retry-After / x-ratelimit-reset-* hints when the server sends
+    them and fall back to jittered exponential backoff otherwise.
+
+    Args:
+        func (callable): The call to perform. Must accept a `timeout` keyword.
+        deadline (float): Total seconds allowed for all attempts.
+        max_attempts (int): Maximum number of attempts.
+        base_delay (float): Base delay for the exponential backoff.
+        max_delay (float): Maximum delay between attempts.
+        description (str): Name of the call, used in log messages.
+
+    Returns:
+        The return value of `func`.
+
+    Raises:
+        Exception: The last error, when it is not retryable or when the
+        attempts or the deadline are exhausted.
+    """
+    start = time.monotonic()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return func(timeout=deadline - (time.monotonic() - start))
+        except Exception as e:
+            delay = _delay_before_retry(e, attempt, time.monotonic() - start, deadline, max_attempts, base_delay, max_delay, description)
+            if delay is None:
+                raise
+            time.sleep(delay)
+
+
+async def call_with_retry_async(func, deadline=60.0, max_attempts=5, base_delay=1.0, max_delay=30.0, description="call"):
+    """
+    Async twin of `call_with_retry`; `func` must be a coroutine function.
+    """
+    start = time.monotonic()
+    attempt = 0
+    while True:
+        attempt += 1
+        try:
+            return await func(timeout=deadline - (time.monotonic() - start))
+        except Exception as e:
+            delay = _delay_before_retry(e, attempt, time.monotonic() - start, deadline, max_attempts, base_delay, max_delay, description)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
@@ -0,0 +1,166 @@
+import os
+import time
+import threading
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from dotenv import load_dotenv
+from src.model import generate_chat_completion, stream_chat_completion, get_client
+from src.spans import span
+from src.usage import record_usage
+
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Estágios do pipeline que chamam o LLM
+STAGE_ENHANCEMENT = "enhancement"
+STAGE_ANSWER = "answer"
+
+# Valores padrão por estágio: (max_tokens, temperature, timeout)
+STAGE_DEFAULTS = {
+    STAGE_ENHANCEMENT: (512, 0.2, 30.0),
+    STAGE_ANSWER: (4096, 0.2, 300.0),
+}
+
+
+class RouteMetrics:
+    """Thread-safe latency and token counters of a single route."""
+
+    def __init__(self, window=500):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.total_latency = 0.0
+
+    def record(self, latency, usage=None, error=False):
+        with self._lock:
+            self.calls += 1
+            self.total_latency += latency
+            self._latencies.append(latency)
+            if error:
+                self.errors += 1
+            if usage:
+                self.prompt_tokens += usage.get("prompt_tokens") or 0
+                self.completion_tokens += usage.get("completion_tokens") or 0
+
+    def snapshot(self):
+        """
+        Return the current metrics of the route.
+
+        Returns:
+            dict: Calls, errors, token totals, mean latency and p50/p95 over the recent window.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+            calls = self.calls
+
+            def percentile(p):
+                if not latencies:
+                    return None
+                return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+            return {
+                "calls": calls,
+                "errors": self.errors,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "latency_mean": self.total_latency / calls if calls else None,
+                "latency_p50": percentile(0.50),
+                "latency_p95": percentile(0.95),
+            }
+
+
+@dataclass
+class ModelRoute:
+    """LLM settings of one pipeline stage."""
+    stage: str
+    endpoint: str
+    subscription_key: str
+    deployment: str
+    max_tokens: int
+    temperature: float
+    timeout: float
+    metrics: RouteMetrics = field(default_factory=RouteMetrics, repr=False, compare=False)
+
+
+def load_routes(endpoint, subscription_key, deployment):
+    """
+    Build the route of every stage from the environment.
+
+    Each stage reads <STAGE>_DEPLOYMENT_NAME, <STAGE>_MAX_TOKENS,
+    <STAGE>_TEMPERATURE, <STAGE>_TIMEOUT and, optionally, <STAGE>_ENDPOINT_URL
+    and <STAGE>_API_KEY (e.g. ENHANCEMENT_DEPLOYMENT_NAME). Unset values
+    fall back to the shared endpoint/key/deployment and to STAGE_DEFAULTS.
+
+    Args:
+        endpoint (str): Default Azure OpenAI endpoint URL.
+        subscription_key (str): Default subscription key.
+        deployment (str): Default deployment name.
+
+    Returns:
+        dict: Mapping of stage name to ModelRoute.
+    """
+    routes = {}
+    for stage, (max_tokens, temperature, timeout) in STAGE_DEFAULTS.items():
+        prefix = stage.upper()
+        routes[stage] = ModelRoute(
+            stage=stage,
+            endpoint=os.getenv(f"{prefix}_ENDPOINT_URL", endpoint),
+            subscription_key=os.getenv(f"{prefix}_API_KEY", subscription_key),
+            deployment=os.getenv(f"{prefix}_DEPLOYMENT_NAME", deployment),
+            max_tokens=int(os.getenv(f"{prefix}_MAX_TOKENS", max_tokens)),
+            temperature=float(os.getenv(f"{prefix}_TEMPERATURE", temperature)),
+            timeout=float(os.getenv(f"{prefix}_TIMEOUT", timeout)),
+        )
+        logging.info(f"Route {stage}: deployment={routes[stage].deployment}, max_tokens={routes[stage].max_tokens}")
+    return routes
+
+
+def generate_routed_completion(route, role, prompt, on_delta=None):
+    """
+    Generate a chat completion with the settings of a route and record its metrics.
+
+    Args:
+        route (ModelRoute): The route of the pipeline stage.
+        role (str): The role description for the system message.
+        prompt (str): The user prompt for the chat completion.
+        on_delta (callable, optional): When given, the completion is streamed
+            and this is called with every new piece of content.
+
+    Returns:
+        dict: The completion result as a dictionary, or None if an error occurs.
+    """
+    start = time.perf_counter()
+    options = dict(
+        client=get_client(route.endpoint, route.subscription_key),
+        max_tokens=route.max_tokens,
+        temperature=route.temperature,
+        deadline=route.timeout,
+    )
+    with span(f"llm.{route.stage}", deployment=route.deployment, caracteres=len(role) + len(prompt), stream=on_delta is not None) as s:
+        if on_delta is None:
+            completion = generate_chat_completion(route.endpoint, route.deployment, route.subscription_key, role, prompt, **options)
+        else:
+            completion = stream_chat_completion(route.endpoint, route.deployment, route.subscription_key, role, prompt, on_delta, **options)
+        latency = time.perf_counter() - start
+        usage = completion.get("usage") if completion else None
+        s["prompt_tokens"] = (usage or {}).get("prompt_tokens")
+        s["completion_tokens"] = (usage or {}).get("completion_tokens")
+        if completion is None:
+            s["erro"] = "sem_resposta"
+        else:
+            record_usage(f"llm.{route.stage}", route.deployment, usage, completion.get("id"))
+    route.metrics.record(latency, usage, error=completion is None)
+
+    summary = route.metrics.snapshot()
+    logging.info(
+        f"Route {route.stage} ({route.deployment}): {latency:.2f}s, "
+        f"{(usage or {}).get('prompt_tokens')} prompt / {(usage or {}).get('completion_tokens')} completion tokens "
+        f"(p50 {summary['latency_p50']:.2f}s, p95 {summary['latency_p95']:.2f}s over {summary['calls']} calls)"
+    )
+    return completion
@@ -0,0 +1,124 @@
+"""
+Request models of the RAG pipeline.
+
+The API validates payloads strictly with these models before enqueueing
+them; the worker parses the queued ones with the lenient QueuedRagPayload.
+This module is kept identical in API_files/schemas.py and
+worker_files/src/schemas.py (each deployable is built from its own
+directory).
+"""
+import os
+import socket
+import ipaddress
+from typing import List, Optional
+from urllib.parse import urlparse
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
+
+
+def check_callback_host(url):
+    """
+    Refuse callback URLs that would make the worker post results to internal hosts.
+
+    The host must match WEBHOOK_ALLOWED_HOSTS when it is set (comma-separated,
+    "*.domain" also accepts subdomains), and every address it resolves to must
+    be public: private, loopback, link-local (cloud metadata) and reserved
+    addresses are always refused. Checked when the API validates the payload
+    and again by the worker before each delivery.
+
+    Raises:
+        ValueError: If the URL may not receive webhooks.
+        OSError: If the host cannot be resolved right now.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError("callback_url deve ser uma URL http(s) válida")
+    host = parsed.hostname.rstrip(".").lower()
+    allowed = [entry.strip().lower() for entry in os.getenv("WEBHOOK_ALLOWED_HOSTS", "").split(",") if entry.strip()]
+    if allowed and not any(host == entry or (entry.startswith("*.") and host.endswith(entry[1:])) for entry in allowed):
+        raise ValueError("o host de callback_url não está em WEBHOOK_ALLOWED_HOSTS")
+    port = parsed.port or (443 if parsed.scheme == "https" else 80)
+    for *_, address in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP):
+        ip = ipaddress.ip_address(address[0].split("%", 1)[0])
+        if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        if not ip.is_global or ip.is_multicast:
+            raise ValueError("callback_url não pode apontar para endereços privados, locais ou reservados")
+
+
+class RagFields(BaseModel):
+    """Fields shared by a single RAG request and a batch of questions."""
+
+    model_config = ConfigDict(extra="forbid", strict=True, str_strip_whitespace=True)
+
+    id_documentos_mni: List[int] = Field(default_factory=list)
+    id_documentos_gampes: List[int] = Field(default_factory=list)
+    user: str = Field(min_length=1)
+    idfuncao: str = Field(min_length=1)
+    idorgao: str = Field(min_length=1)
+    info: Optional[str] = None
+    callback_url: Optional[str] = None
+
+    @field_validator("callback_url")
+    @classmethod
+    def check_callback_url(cls, value):
+        if value is not None:
+            try:
+                check_callback_host(value)
+            except OSError:
+                # Host sem resolução no momento: a entrega verifica de novo antes de cada envio
+                pass
+        return value
+
+    @model_validator(mode="after")
+    def check_documents(self):
+        if not self.id_documentos_mni and not self.id_documentos_gampes:
+            raise ValueError("informe ao menos um documento em id_documentos_mni ou id_documentos_gampes")
+        return self
+
+
+class RagPayload(RagFields):
+    """Payload of one RAG task, as sent to POST /rag and stored in the queue."""
+
+    texto_prompt: str = Field(min_length=1)
+    # Preenchido pela API nas tarefas criadas por POST /rag/batch
+    id_lote: Optional[str] = None
+    # Preenchido pela API: contexto W3C do trace da requisição, retomado pelo worker
+    traceparent: Optional[str] = Field(default=None, pattern=r"^00-[0-9a-f]{32}-[0-9a-f]{16}-[0-9a-f]{2}$")
+
+
+class RagBatchPayload(RagFields):
+    """Payload of POST /rag/batch: the shared fields plus the list of questions."""
+
+    textos_prompt: List[str] = Field(min_length=1)
+
+    @field_validator("textos_prompt")
+    @classmethod
+    def check_questions(cls, value):
+        if any(not pergunta.strip() for pergunta in value):
+            raise ValueError("as perguntas não podem ser vazias")
+        return value
+
+
+class QueuedRagPayload(BaseModel):
+    """
+    Payload of one RAG task as read from the queue by the worker.
+
+    Lenient on purpose: payloads enqueued before the API validated them (or by
+    an older API) may lack user/idfuncao/idorgao, carry other types or extra
+    keys, and must still run. The callback host is not checked here; the
+    webhook dispatcher checks it before each delivery, so a bad callback_url
+    only drops the webhook.
+    """
+
+    model_config = ConfigDict(extra="allow", coerce_numbers_to_str=True)
+
+    id_documentos_mni: List[int] = Field(default_factory=list)
+    id_documentos_gampes: List[int] = Field(default_factory=list)
+    texto_prompt: str
+    user: Optional[str] = None
+    idfuncao: Optional[str] = None
+    idorgao: Optional[str] = None
+    info: Optional[str] = None
+    callback_url: Optional[str] = None
+    id_lote: Optional[str] = None
+    traceparent: Optional[str] = None
@@ -0,0 +1,143 @@
+import os
+import time
+import logging
+import contextvars
+from contextlib import contextmanager, nullcontext
+from dotenv import load_dotenv
+from src.tracing import make_span, new_span_id
+
+load_dotenv()
+
+# Quantos spans de um mesmo nome são guardados individualmente (os demais entram só no resumo)
+spans_max_per_name = int(os.getenv("SPANS_MAX_PER_NAME", "20"))
+
+# Gravador da tarefa em andamento; chamadas externas registram nele sem recebê-lo por parâmetro
+_current = contextvars.ContextVar("span_recorder", default=None)
+
+# Funções chamadas com cada span concluído (ex.: métricas)
+_listeners = []
+
+
+def add_listener(listener):
+    """Call `listener(registro)` with every finished span of every recorder."""
+    _listeners.append(listener)
+
+
+class SpanRecorder:
+    """
+    Collects timing spans of one task.
+
+    Every span records its start offset and duration in milliseconds plus
+    the attributes given by the caller (payload sizes, result counts, ...).
+    The first `max_per_name` spans of each name are kept individually and
+    all of them are aggregated per name, so a phase issuing one query per
+    page does not bloat the task document.
+    """
+
+    def __init__(self, max_per_name=None):
+        self.max_per_name = spans_max_per_name if max_per_name is None else max_per_name
+        self.started = time.perf_counter()
+        self.started_ns = time.time_ns()
+        self.spans = []
+        self.resumo = {}
+        # Fase ("fase.*") aberta no momento, usada para atribuir chamadas feitas fora de um span próprio
+        self.fase = None
+
+    @contextmanager
+    def span(self, nome, **atributos):
+        """Time the block; the yielded dict accepts extra attributes set inside it."""
+        inicio = time.perf_counter()
+        registro = {"nome": nome, "inicio_ms": round((inicio - self.started) * 1000, 1), **atributos}
+        fase_anterior = self.fase
+        if nome.startswith("fase."):
+            self.fase = nome
+        try:
+            yield registro
+        except BaseException as e:
+            registro["erro"] = type(e).__name__
+            raise
+        finally:
+            self.fase = fase_anterior
+            registro["duracao_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+            self._add(registro)
+
+    def _add(self, registro):
+        agregado = self.resumo.get(registro["nome"])
+        if agregado is None:
+            agregado = self.resumo[registro["nome"]] = {"chamadas": 0, "total_ms": 0.0, "max_ms": 0.0, "erros": 0}
+        agregado["chamadas"] += 1
+        agregado["total_ms"] = round(agregado["total_ms"] + registro["duracao_ms"], 1)
+        agregado["max_ms"] = max(agregado["max_ms"], registro["duracao_ms"])
+        if "erro" in registro:
+            agregado["erros"] += 1
+        if agregado["chamadas"] <= self.max_per_name:
+            self.spans.append(registro)
+        for listener in _listeners:
+            try:
+                listener(registro)
+            except Exception as e:
+                logging.warning(f"Span listener failed: {e}")
+
+    def to_trace(self, trace_id, parent_id):
+        """
+        The spans kept individually, as OTLP spans (see src.tracing).
+
+        Phases are children of `parent_id`; every other span is a child of
+        the phase whose interval contains it.
+        """
+        def interval(registro):
+            inicio = self.started_ns + int(registro["inicio_ms"] * 1_000_000)
+            return inicio, inicio + int(registro["duracao_ms"] * 1_000_000)
+
+        fases = {id(registro): (new_span_id(), *interval(registro)) for registro in self.spans if registro["nome"].startswith("fase.")}
+        otlp = []
+        for registro in self.spans:
+            inicio, fim = interval(registro)
+            if id(registro) in fases:
+                span_id, pai = fases[id(registro)][0], parent_id
+            else:
+                # Tolerância de 1 ms: inicio_ms e duracao_ms são arredondados
+                span_id = new_span_id()
+                pai = next((fase_id for fase_id, f_inicio, f_fim in fases.values() if f_inicio <= inicio and fim <= f_fim + 1_000_000), parent_id)
+            atributos = {chave: valor for chave, valor in registro.items() if chave not in ("nome", "inicio_ms", "duracao_ms", "erro")}
+            otlp.append(make_span(registro["nome"], trace_id, span_id, pai, inicio, fim, attributes=atributos, error=registro.get("erro")))
+        return otlp
+
+    def to_dict(self):
+        """Spans and per-name summary, ready to be stored in the task document."""
+        return {
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+            "spans": self.spans,
+            "resumo": self.resumo,
+        }
+
+
+@contextmanager
+def recording(recorder):
+    """Make `recorder` the active recorder for the duration of the block."""
+    token = _current.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current.reset(token)
+
+
+def current_phase():
+    """Name of the phase span ("fase.*") open in the active recorder, or None."""
+    recorder = _current.get()
+    return recorder.fase if recorder is not None else None
+
+
+def span(nome, **atributos):
+    """
+    Time a block in the active recorder, if any.
+
+    Usage:
+        with span("es.search", indice="gampes_textual_paginas") as s:
+            response = es.search(...)
+            s["resultados"] = len(response["hits"]["hits"])
+    """
+    recorder = _current.get()
+    if recorder is None:
+        return nullcontext({})
+    return recorder.span(nome, **atributos)
@@ -0,0 +1,76 @@
+import os
+import logging
+from functools import lru_cache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Encoding do tokenizador local (o200k_base = família gpt-4o)
+tokenizer_encoding = os.getenv("TOKENIZER_ENCODING", "o200k_base")
+
+# Média de caracteres por token usada quando o tokenizador não está disponível
+CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def get_encoding(name=None):
+    """
+    Load the local tokenizer encoding.
+
+    Args:
+        name (str, optional): The tiktoken encoding name. Defaults to TOKENIZER_ENCODING.
+
+    Returns:
+        tiktoken.Encoding: The encoding, or None if tiktoken or the encoding
+        files are not available (token counts are then estimated).
+    """
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(name or tokenizer_encoding)
+    except Exception as e:
+        logging.warning(f"Local tokenizer unavailable, estimating token counts: {e}")
+        return None
+
+
+def count_tokens(text):
+    """
+    Count the tokens of a text with the local tokenizer.
+
+    Args:
+        text (str): The text to count.
+
+    Returns:
+        int: The number of tokens.
+    """
+    if not text:
+        return 0
+    encoding = get_encoding()
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    Truncate a text so that it fits in max_tokens.
+
+    Args:
+        text (str): The text to truncate.
+        max_tokens (int): Maximum number of tokens to keep.
+
+    Returns:
+        tuple: (truncated_text, token_count).
+    """
+    if not text or max_tokens <= 0:
+        return "", 0
+    encoding = get_encoding()
+    if encoding is None:
+        truncated = text[:max_tokens * CHARS_PER_TOKEN]
+        return truncated, count_tokens(truncated)
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text, len(tokens)
+    return encoding.decode(tokens[:max_tokens]), max_tokens
@@ -0,0 +1,139 @@
+import os
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+import orjson
+from dotenv import load_dotenv
+from src.spans import current_phase
+
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Preço por milhão de tokens de cada deployment, ex.: {"gpt-4o": {"entrada": 2.5, "cache": 1.25, "saida": 10}}
+# Deployments ausentes têm custo 0; "cache" ausente usa o preço de entrada
+try:
+    token_prices = orjson.loads(os.getenv("TOKEN_PRICES") or "{}")
+except orjson.JSONDecodeError as e:
+    logging.error(f"Invalid TOKEN_PRICES, costs will be 0: {e}")
+    token_prices = {}
+
+# Contador de uso da tarefa em andamento; as chamadas ao LLM e de embedding registram nele
+_current = contextvars.ContextVar("usage_recorder", default=None)
+
+
+def call_cost(deployment, prompt_tokens, cached_tokens, completion_tokens):
+    """
+    Estimated cost of one call with the TOKEN_PRICES of its deployment.
+
+    Cached prompt tokens are charged at the "cache" price and the rest of
+    the prompt at the "entrada" price.
+    """
+    prices = token_prices.get(deployment)
+    if not prices:
+        return 0.0
+    entrada = prices.get("entrada", 0.0)
+    cache = prices.get("cache", entrada)
+    saida = prices.get("saida", 0.0)
+    return ((prompt_tokens - cached_tokens) * entrada + cached_tokens * cache + completion_tokens * saida) / 1_000_000
+
+
+class UsageRecorder:
+    """
+    Collects the token usage of every LLM and embedding call of one task.
+
+    Calls may come from several threads (e.g. embeddings of a batch), so
+    additions are locked.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.chamadas = []
+
+    def add(self, chamada, deployment, prompt_tokens=0, completion_tokens=0, cached_tokens=0, id_requisicao=None, fase=None):
+        registro = {
+            "chamada": chamada,
+            "deployment": deployment,
+            "fase": fase,
+            "id_requisicao": id_requisicao,
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "custo": call_cost(deployment, prompt_tokens, cached_tokens, completion_tokens),
+            "data": datetime.now(),
+        }
+        with self._lock:
+            self.chamadas.append(registro)
+        return registro
+
+    def to_dict(self):
+        """Totals per call type and overall, ready to be stored in the task document."""
+        resumo = {}
+        total = {"chamadas": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "custo": 0.0}
+        with self._lock:
+            chamadas = list(self.chamadas)
+        for registro in chamadas:
+            agregado = resumo.setdefault(registro["chamada"], {key: 0 for key in total})
+            for destino in (agregado, total):
+                destino["chamadas"] += 1
+                for key in ("prompt_tokens", "cached_tokens", "completion_tokens", "total_tokens", "custo"):
+                    destino[key] += registro[key]
+        for destino in (*resumo.values(), total):
+            destino["custo"] = round(destino["custo"], 6)
+        return {**total, "resumo": resumo}
+
+    def rows(self, task_id, user, idorgao, idfuncao):
+        """One row per call for rag_gampes_uso (see save_usage_to_database)."""
+        with self._lock:
+            return [
+                (
+                    task_id, registro["id_requisicao"], registro["data"], user, idorgao, idfuncao,
+                    registro["fase"], registro["chamada"], registro["deployment"],
+                    registro["prompt_tokens"], registro["cached_tokens"], registro["completion_tokens"],
+                    registro["total_tokens"], registro["custo"],
+                )
+                for registro in self.chamadas
+            ]
+
+
+@contextmanager
+def accounting(recorder):
+    """Make `recorder` the active usage recorder for the duration of the block."""
+    token = _current.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _current.reset(token)
+
+
+def record_usage(chamada, deployment, usage, id_requisicao=None):
+    """
+    Record the `usage` of an API response in the active recorder, if any.
+
+    Args:
+        chamada (str): Call type, e.g. "llm.answer" or "embedding".
+        deployment (str): The Azure OpenAI deployment called.
+        usage (dict): The "usage" object of the response; cached tokens are
+            read from prompt_tokens_details.cached_tokens when present.
+        id_requisicao (str, optional): The completion ID.
+
+    Returns:
+        dict: The recorded call, or None when there is no active recorder or usage.
+    """
+    recorder = _current.get()
+    if recorder is None or not usage:
+        return None
+    detalhes = usage.get("prompt_tokens_details") or {}
+    return recorder.add(
+        chamada,
+        deployment,
+        prompt_tokens=usage.get("prompt_tokens") or 0,
+        completion_tokens=usage.get("completion_tokens") or 0,
+        cached_tokens=detalhes.get("cached_tokens") or 0,
+        id_requisicao=id_requisicao,
+        fase=current_phase(),
+    )
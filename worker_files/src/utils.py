@@ -5,6 +5,7 @@ from dotenv import load_dotenv
 import logging
 import requests
 import time
+from src.spans import span
 
 load_dotenv()
 
@@ -78,6 +79,79 @@ def save_logs_to_database(connection_string, llm_response, prompt_original, prom
         conn.close()
 
 
+def save_usage_to_database(connection_string, rows):
+    """
+    Save the token usage of every LLM and embedding call of a task.
+
+    The rows are inserted into rag_gampes_uso in a single batch and, in the
+    same transaction, added to the daily rollup rag_gampes_uso_diario (per
+    day, user, idorgao, call type and deployment).
+
+    Args:
+        connection_string (str): The database connection string.
+        rows (list): Rows built by UsageRecorder.rows.
+
+    Returns:
+        None
+    """
+    if not connection_string or not rows:
+        return
+    try:
+        conn = pyodbc.connect(connection_string)
+        try:
+            cursor = conn.cursor()
+            cursor.fast_executemany = True
+            cursor.executemany(
+                """
+                INSERT INTO IA.dbo.rag_gampes_uso (
+                    id_tarefa, id_requisicao, data, user_gampes, idorgao, idfuncao,
+                    fase, chamada, deployment, prompt_tokens, cached_tokens, completion_tokens,
+                    total_tokens, custo
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows
+            )
+            cursor.execute(
+                """
+                MERGE IA.dbo.rag_gampes_uso_diario WITH (HOLDLOCK) AS destino
+                USING (
+                    SELECT CAST(data AS DATE) AS dia, user_gampes, idorgao, chamada, deployment,
+                           COUNT(*) AS chamadas, SUM(prompt_tokens) AS prompt_tokens, SUM(cached_tokens) AS cached_tokens,
+                           SUM(completion_tokens) AS completion_tokens, SUM(total_tokens) AS total_tokens, SUM(custo) AS custo
+                    FROM IA.dbo.rag_gampes_uso
+                    WHERE id_tarefa = ? AND data >= ?
+                    GROUP BY CAST(data AS DATE), user_gampes, idorgao, chamada, deployment
+                ) AS origem
+                ON destino.dia = origem.dia AND destino.user_gampes = origem.user_gampes AND destino.idorgao = origem.idorgao
+                   AND destino.chamada = origem.chamada AND destino.deployment = origem.deployment
+                WHEN MATCHED THEN UPDATE SET
+                    tarefas = destino.tarefas + 1,
+                    chamadas = destino.chamadas + origem.chamadas,
+                    prompt_tokens = destino.prompt_tokens + origem.prompt_tokens,
+                    cached_tokens = destino.cached_tokens + origem.cached_tokens,
+                    completion_tokens = destino.completion_tokens + origem.completion_tokens,
+                    total_tokens = destino.total_tokens + origem.total_tokens,
+                    custo = destino.custo + origem.custo
+                WHEN NOT MATCHED THEN INSERT (
+                    dia, user_gampes, idorgao, chamada, deployment, tarefas, chamadas,
+                    prompt_tokens, cached_tokens, completion_tokens, total_tokens, custo
+                ) VALUES (
+                    origem.dia, origem.user_gampes, origem.idorgao, origem.chamada, origem.deployment, 1, origem.chamadas,
+                    origem.prompt_tokens, origem.cached_tokens, origem.completion_tokens, origem.total_tokens, origem.custo
+                );
+                """,
+                # Só as linhas recém-inseridas: uma nova tentativa da mesma tarefa já teve as anteriores somadas
+                (rows[0][0], min(row[2] for row in rows))
+            )
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+        logging.info(f"Token usage of {len(rows)} calls saved to database.")
+    except Exception as e:
+        logging.error(f"Error saving token usage to database: {e}")
+
+
 def consultar_apis(ids_documento_gampes, ids_documento_mni, url_api_ocr_gampes, url_api_ocr_mni):
     """
     Consult APIs and return document IDs.
@@ -95,21 +169,25 @@ def consultar_apis(ids_documento_gampes, ids_documento_mni, url_api_ocr_gampes,
         payload = {"document_ids": document_ids}
         headers = {"Content-Type": "application/json"}
         tentativas = 0
-        while tentativas < 3:
-            try:
-                response = requests.post(url, json=payload, headers=headers)
-                if response.status_code == 200:
-                    resultados = response.json().get("resultados", {})
-                    return list(resultados.values())
-                else:
-                    print(f"Erro na requisição para {url}: {response.status_code}")
-                    print(response.text)
-            except Exception as e:
-                print(f"Erro ao fazer a requisição para {url}: {e}")
-            tentativas += 1
-            if tentativas < 3:
-                time.sleep(2)
-        return []
+        with span("ocr", url=url, documentos=len(document_ids)) as s:
+            while tentativas < 3:
+                s["tentativas"] = tentativas + 1
+                try:
+                    response = requests.post(url, json=payload, headers=headers)
+                    if response.status_code == 200:
+                        resultados = response.json().get("resultados", {})
+                        s["resultados"] = len(resultados)
+                        return list(resultados.values())
+                    else:
+                        print(f"Erro na requisição para {url}: {response.status_code}")
+                        print(response.text)
+                except Exception as e:
+                    print(f"Erro ao fazer a requisição para {url}: {e}")
+                tentativas += 1
+                if tentativas < 3:
+                    time.sleep(2)
+            s["erro"] = "sem_resposta"
+            return []
 
     _ids_gampes = consultar_api(url_api_ocr_gampes, ids_documento_gampes)
     _ids_mni = consultar_api(url_api_ocr_mni, ids_documento_mni)
@@ -120,7 +198,8 @@ def proximo_da_fila(connection_string):
     cnxn = pyodbc.connect(connection_string)
     cursor = cnxn.cursor()
     query_select = (
-        "SELECT TOP 1 id, id_elasticsearch, tentativas, payload "
+        "SELECT TOP 1 id, id_elasticsearch, tentativas, payload, "
+        "DATEDIFF(millisecond, data_criacao, GETDATE()) AS espera_ms "
         "FROM fila_processamento_agentes "
         "WHERE status = 102 AND id_agente = 101 "
         "ORDER BY data_criacao ASC"
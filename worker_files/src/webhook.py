@@ -0,0 +1,249 @@
+import os
+import orjson
+import hmac
+import heapq
+import hashlib
+import logging
+import threading
+import time
+from datetime import datetime
+import pyodbc
+import requests
+from requests.adapters import HTTPAdapter
+from dotenv import load_dotenv
+from src.retry import RETRYABLE_STATUS, backoff_delay, retry_after_from_headers
+from src.schemas import check_callback_host
+
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Database connection details
+connection_string = os.getenv("SQL_SERVER_CNXN_STR_IA")
+
+# Entrega dos webhooks de conclusão
+webhook_timeout = float(os.getenv("WEBHOOK_TIMEOUT", "10"))
+webhook_max_attempts = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "6"))
+webhook_base_delay = float(os.getenv("WEBHOOK_BASE_DELAY", "2"))
+webhook_max_delay = float(os.getenv("WEBHOOK_MAX_DELAY", "300"))
+webhook_pool_size = int(os.getenv("WEBHOOK_POOL_SIZE", "10"))
+# Segredo opcional para assinar o corpo (HMAC-SHA256 no cabeçalho X-Webhook-Signature)
+webhook_secret = os.getenv("WEBHOOK_SECRET")
+
+
+def save_delivery_log(connection_string, task_id, callback_url, tentativa, status_http, erro, entregue):
+    """
+    Record one webhook delivery attempt in the delivery log table.
+
+    Args:
+        connection_string (str): The database connection string.
+        task_id (str): The task ID (Elasticsearch document ID).
+        callback_url (str): The URL the result was posted to.
+        tentativa (int): Attempt number, starting at 1.
+        status_http (int): HTTP status of the response, or None if there was no response.
+        erro (str): Error message, or None on success.
+        entregue (bool): Whether this attempt delivered the webhook.
+
+    Returns:
+        None
+    """
+    if not connection_string:
+        return
+    try:
+        conn = pyodbc.connect(connection_string)
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                INSERT INTO IA.dbo.rag_gampes_webhook (
+                    id_elasticsearch, callback_url, tentativa, status_http, erro, entregue, data_envio
+                ) VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (task_id, callback_url, tentativa, status_http, erro, 1 if entregue else 0, datetime.now())
+            )
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+    except Exception as e:
+        logging.error(f"Error saving webhook delivery log: {e}")
+
+
+class WebhookDispatcher:
+    """
+    Background delivery of completion webhooks.
+
+    Deliveries are kept in a heap ordered by due time and sent by a single
+    daemon thread over a pooled requests.Session, so the worker loop never
+    waits on a client's server. Transient failures (connection errors and
+    retryable HTTP status) are retried with exponential backoff, honoring
+    Retry-After; every attempt is written to the delivery log table.
+    """
+
+    def __init__(self, connection_string=None, timeout=10.0, max_attempts=6, base_delay=2.0, max_delay=300.0, pool_size=10, secret=None):
+        self.connection_string = connection_string
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.secret = secret
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._heap = []
+        self._sequence = 0
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="webhook-dispatcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, task_id, callback_url, body):
+        """
+        Schedule the delivery of a webhook.
+
+        Args:
+            task_id (str): The task ID (Elasticsearch document ID).
+            callback_url (str): The URL to POST to.
+            body (dict): The JSON body.
+        """
+        self.start()
+        data = orjson.dumps(body, default=str)
+        self._schedule(time.monotonic(), {"task_id": task_id, "url": callback_url, "data": data, "tentativa": 1})
+
+    def _schedule(self, due, delivery):
+        with self._condition:
+            self._sequence += 1
+            heapq.heappush(self._heap, (due, self._sequence, delivery))
+            self._condition.notify()
+
+    def pending(self):
+        with self._condition:
+            return len(self._heap)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while True:
+                    if not self._heap:
+                        if self._stopping:
+                            return
+                        self._condition.wait()
+                        continue
+                    wait = self._heap[0][0] - time.monotonic()
+                    if wait <= 0:
+                        _, _, delivery = heapq.heappop(self._heap)
+                        break
+                    self._condition.wait(wait)
+            try:
+                self._deliver(delivery)
+            except Exception as e:
+                logging.error(f"Unexpected error delivering webhook of task {delivery['task_id']}: {e}")
+
+    def _headers(self, delivery):
+        headers = {"Content-Type": "application/json", "X-Task-Id": delivery["task_id"]}
+        if self.secret:
+            signature = hmac.new(self.secret.encode("utf-8"), delivery["data"], hashlib.sha256).hexdigest()
+            headers["X-Webhook-Signature"] = f"sha256={signature}"
+        return headers
+
+    def _deliver(self, delivery):
+        task_id, url, tentativa = delivery["task_id"], delivery["url"], delivery["tentativa"]
+        status_http, erro, retry_after = None, None, None
+        try:
+            # Verifica de novo na entrega: o DNS do host pode ter mudado desde a validação do payload
+            check_callback_host(url)
+            # Redirecionamentos não são seguidos: levariam o corpo a um host não verificado
+            response = self.session.post(url, data=delivery["data"], headers=self._headers(delivery), timeout=self.timeout, allow_redirects=False)
+            status_http = response.status_code
+            if status_http < 300:
+                save_delivery_log(self.connection_string, task_id, url, tentativa, status_http, None, True)
+                logging.info(f"Webhook of task {task_id} delivered on attempt {tentativa}")
+                return
+            erro = f"HTTP {status_http}: {response.text[:500]}"
+            retryable = status_http in RETRYABLE_STATUS
+            retry_after = retry_after_from_headers(response.headers)
+        except requests.RequestException as e:
+            erro = str(e)
+            retryable = True
+        except ValueError as e:
+            # Host não permitido: não adianta tentar de novo
+            erro = str(e)
+            retryable = False
+        except OSError as e:
+            erro = f"Could not resolve callback host: {e}"
+            retryable = True
+
+        save_delivery_log(self.connection_string, task_id, url, tentativa, status_http, erro, False)
+        if not retryable or tentativa >= self.max_attempts:
+            logging.error(f"Giving up webhook of task {task_id} after {tentativa} attempts: {erro}")
+            return
+        delay = retry_after if retry_after is not None else backoff_delay(tentativa, self.base_delay, self.max_delay)
+        delay = min(delay, self.max_delay)
+        logging.warning(f"Webhook of task {task_id} failed ({erro}); retrying in {delay:.1f}s")
+        self._schedule(time.monotonic() + delay, {**delivery, "tentativa": tentativa + 1})
+
+    def stop(self, timeout=10.0):
+        """
+        Stop the dispatcher, giving deliveries that are already due up to `timeout` seconds.
+
+        Deliveries still waiting for a retry are dropped (their attempts are in the log table).
+        """
+        with self._condition:
+            now = time.monotonic()
+            self._heap = [item for item in self._heap if item[0] <= now]
+            heapq.heapify(self._heap)
+            self._stopping = True
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.session.close()
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """Return the process-wide webhook dispatcher, created on first use."""
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = WebhookDispatcher(
+                    connection_string,
+                    timeout=webhook_timeout,
+                    max_attempts=webhook_max_attempts,
+                    base_delay=webhook_base_delay,
+                    max_delay=webhook_max_delay,
+                    pool_size=webhook_pool_size,
+                    secret=webhook_secret,
+                )
+    return _dispatcher
+
+
+def send_completion_webhook(callback_url, task_id, status, resultado=None, erro=None):
+    """
+    Queue the completion webhook of a task, if the request asked for one.
+
+    Args:
+        callback_url (str): The callback URL from the payload (None to skip).
+        task_id (str): The task ID (Elasticsearch document ID).
+        status (int): Final status of the task (200 on success, 4xx/5xx on failure).
+        resultado (dict): Structured response (`build_structured_response`) on success.
+        erro (str): Error message on failure.
+    """
+    if not callback_url:
+        return
+    body = {"task_id": task_id, "status": status}
+    if resultado is not None:
+        body["resultado"] = resultado
+    if erro is not None:
+        body["erro"] = erro
+    get_dispatcher().submit(task_id, callback_url, body)
@@ -1,5 +1,5 @@
 import requests
-import time
+import json
 
 # URL base da API
 #BASE_URL = "http://localhost:8000"
@@ -24,19 +24,18 @@ if response.status_code == 202:
     print(f"Tarefa iniciada com ID: {task_id}")
     print(f"URL para acompanhamento: {task_data['url']}")
     
-    # 2. Verificar o status periodicamente (polling)
-    while True:
-        status_response = requests.get(f"{BASE_URL}/rag/status/{task_id}")
-        status_data = status_response.json()
-        
-        print(f"Status atual: {status_data['status']}")
-        
-        if status_data['status'] != 102:  # 102 = processando
-            print("Processamento concluído!")
-            print(f"Resposta final: {status_data['texto_resposta']}")
-            break
-            
-        time.sleep(2)  # Aguarda 2 segundos entre as verificações
+    # 2. Acompanhar o status pelo stream SSE (sem polling)
+    with requests.get(f"{BASE_URL}/rag/stream/{task_id}", stream=True) as stream_response:
+        event = None
+        for line in stream_response.iter_lines(decode_unicode=True):
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: ") and event == "status":
+                status_data = json.loads(line[len("data: "):])
+                print(f"Status atual: {status_data['status']} ({status_data.get('fase', '')})")
+            elif line.startswith("data: ") and event == "end":
+                print("Processamento concluído!")
+                break
 else:
     print(f"Erro ao iniciar a tarefa: {response.status_code} - {response.text}")
 
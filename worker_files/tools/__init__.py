@@ -0,0 +1,6 @@
+"""
+Maintenance commands of the Elasticsearch indexes used by the worker.
+
+Run from worker_files/ with the same .env as the worker, e.g.
+`python -m tools.backfill_embeddings --help`.
+"""
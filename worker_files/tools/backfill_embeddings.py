@@ -0,0 +1,198 @@
+"""
+Resumable embedding backfill of gampes_vector_small.
+
+Walks gampes_textual_paginas with a point in time and search_after, looks up
+which pages of each scroll page already have a vector (one terms query),
+embeds the missing texts in batches on a thread pool and bulk-indexes the
+vectors. Embedding requests go through `get_embeddings_batch`, so they share
+the rate limiter (RATE_LIMITS) and the retry policy of the worker.
+
+Progress is checkpointed to a JSON file after every scroll page. New vectors
+are indexed with `_id` = id_pagina, so re-processing a page after a crash
+overwrites instead of duplicating. search_after values of the `_shard_doc`
+tiebreaker only hold within one point in time: when the checkpointed point
+in time has expired, the walk restarts from the beginning (pages with vectors
+are skipped without calling the embedding API) unless `--sort` names fields
+that identify a page, e.g. `--sort id_textual,pagina`, in which case it
+continues from the checkpointed position.
+
+Usage (from worker_files/):
+    python -m tools.backfill_embeddings --checkpoint backfill.json
+    python -m tools.backfill_embeddings --checkpoint backfill.json --workers 8 --batch-size 16 --sort id_textual,pagina
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import orjson
+from dotenv import load_dotenv
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import bulk
+from elasticsearch.serializer import OrjsonSerializer
+from src.elastic import PAGE_DOCUMENT_FIELDS
+from src.embed import get_embeddings_batch
+from src.tokens import truncate_to_tokens
+from tools.checkpoint import close_pit, load_checkpoint, resume_pit, save_checkpoint
+
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+INDEX_PAGES = "gampes_textual_paginas"
+INDEX_VECTORS = "gampes_vector_small"
+
+# Limite de entrada do text-embedding-3-small é 8191 tokens
+MAX_INPUT_TOKENS = 8000
+
+
+def pages_with_vectors(es, page_ids, index_vectors=INDEX_VECTORS):
+    """IDs among `page_ids` that already have a document in the vector index."""
+    response = es.search(
+        index=index_vectors,
+        body={"query": {"terms": {"id_pagina": page_ids}}, "_source": ["id_pagina"], "size": len(page_ids) * 2},
+    )
+    return {hit["_source"]["id_pagina"] for hit in response["hits"]["hits"]}
+
+
+def embed_batch(batch, key, endpoint, max_input_tokens):
+    """
+    Embed one batch of (id_pagina, texto).
+
+    Returns:
+        list: (id_pagina, embedding) pairs; empty if the request failed.
+    """
+    texts = [truncate_to_tokens(texto, max_input_tokens)[0] for _, texto in batch]
+    embeddings = get_embeddings_batch(texts, key, endpoint)
+    if embeddings is None:
+        return []
+    return [(page_id, embedding) for (page_id, _), embedding in zip(batch, embeddings)]
+
+
+class Backfill:
+    """One backfill run: scroll state, counters and the embedding pool."""
+
+    def __init__(self, es, key, endpoint, args):
+        self.es = es
+        self.key = key
+        self.endpoint = endpoint
+        self.args = args
+        self.sort_fields = [field.strip() for field in (args.sort or "").split(",") if field.strip()]
+        self.checkpoint = load_checkpoint(args.checkpoint)
+        for counter in ("paginas", "com_vetor", "sem_texto", "vetorizadas", "falhas"):
+            self.checkpoint.setdefault(counter, 0)
+        self.pool = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="embed")
+
+    def _scroll_page(self, pit_id):
+        body = {
+            "pit": {"id": pit_id, "keep_alive": self.args.keep_alive},
+            "size": self.args.page_size,
+            "_source": ["texto", *PAGE_DOCUMENT_FIELDS],
+            "sort": [{field: "asc"} for field in self.sort_fields] + [{"_shard_doc": "asc"}],
+            "track_total_hits": False,
+        }
+        if self.checkpoint.get("search_after") is not None:
+            body["search_after"] = self.checkpoint["search_after"]
+        return self.es.search(body=body)
+
+    def _process(self, hits):
+        ids = [hit["_id"] for hit in hits]
+        existing = pages_with_vectors(self.es, ids, self.args.index_vectors)
+        pending = []
+        # Campos do documento já desnormalizados na página seguem para o vetor
+        fields = {}
+        for hit in hits:
+            source = hit.get("_source") or {}
+            texto = source.get("texto")
+            fields[hit["_id"]] = {field: source[field] for field in PAGE_DOCUMENT_FIELDS if field in source}
+            if hit["_id"] in existing:
+                self.checkpoint["com_vetor"] += 1
+            elif not texto or not texto.strip():
+                self.checkpoint["sem_texto"] += 1
+            else:
+                pending.append((hit["_id"], texto))
+
+        batches = [pending[start:start + self.args.batch_size] for start in range(0, len(pending), self.args.batch_size)]
+        embedded = []
+        for result in self.pool.map(lambda batch: embed_batch(batch, self.key, self.endpoint, self.args.max_input_tokens), batches):
+            embedded.extend(result)
+        self.checkpoint["falhas"] += len(pending) - len(embedded)
+
+        if embedded and not self.args.dry_run:
+            actions = (
+                {"_index": self.args.index_vectors, "_id": page_id, "_source": {"id_pagina": page_id, "embedding": embedding, **fields[page_id]}}
+                for page_id, embedding in embedded
+            )
+            indexed, errors = bulk(self.es, actions, chunk_size=self.args.bulk_size, raise_on_error=False)
+            self.checkpoint["falhas"] += len(errors)
+            embedded = embedded[:indexed]
+        self.checkpoint["vetorizadas"] += len(embedded)
+        self.checkpoint["paginas"] += len(hits)
+
+    def run(self):
+        if self.checkpoint.get("concluido"):
+            logging.info(f"Backfill already finished in {self.args.checkpoint}; remove it to walk the index again.")
+            self.pool.shutdown()
+            return self.checkpoint
+        pit_id = resume_pit(self.es, self.args.index_pages, self.checkpoint, self.args.keep_alive, self.sort_fields)
+        started = time.perf_counter()
+        vetorizadas_inicio = self.checkpoint["vetorizadas"]
+        try:
+            while True:
+                response = self._scroll_page(pit_id)
+                pit_id = response.get("pit_id", pit_id)
+                hits = response["hits"]["hits"]
+                if not hits:
+                    self.checkpoint["concluido"] = True
+                    break
+                self._process(hits)
+                self.checkpoint.update(pit_id=pit_id, search_after=hits[-1]["sort"], atualizado_em=time.strftime("%Y-%m-%dT%H:%M:%S"))
+                save_checkpoint(self.args.checkpoint, self.checkpoint)
+
+                elapsed = time.perf_counter() - started
+                rate = (self.checkpoint["vetorizadas"] - vetorizadas_inicio) / elapsed if elapsed else 0.0
+                logging.info(
+                    f"{self.checkpoint['paginas']} pages read, {self.checkpoint['com_vetor']} already had vectors, "
+                    f"{self.checkpoint['vetorizadas']} embedded, {self.checkpoint['falhas']} failed ({rate:.1f} pages/s)"
+                )
+                if self.args.limit and self.checkpoint["paginas"] >= self.args.limit:
+                    break
+        finally:
+            self.pool.shutdown(wait=True)
+            save_checkpoint(self.args.checkpoint, self.checkpoint)
+        if self.checkpoint.get("concluido"):
+            close_pit(self.es, pit_id)
+        return self.checkpoint
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Embed the pages of gampes_textual_paginas that have no vector in gampes_vector_small.")
+    parser.add_argument("--checkpoint", default="backfill_embeddings.json", help="Progress file; an existing one is resumed.")
+    parser.add_argument("--page-size", type=int, default=500, help="Pages read per search_after request.")
+    parser.add_argument("--batch-size", type=int, default=16, help="Texts per embedding request.")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent embedding requests.")
+    parser.add_argument("--bulk-size", type=int, default=500, help="Vectors per _bulk request.")
+    parser.add_argument("--max-input-tokens", type=int, default=MAX_INPUT_TOKENS, help="Longer pages are truncated before embedding.")
+    parser.add_argument("--keep-alive", default="10m", help="Point in time keep alive between requests.")
+    parser.add_argument("--sort", help="Fields identifying a page (e.g. id_textual,pagina), to resume from the checkpoint after the point in time expires.")
+    parser.add_argument("--limit", type=int, help="Stop after reading this many pages (across resumptions).")
+    parser.add_argument("--index-pages", default=INDEX_PAGES)
+    parser.add_argument("--index-vectors", default=INDEX_VECTORS)
+    parser.add_argument("--dry-run", action="store_true", help="Embed but do not index (measures throughput).")
+    args = parser.parse_args(argv)
+
+    es = Elasticsearch(
+        os.getenv("ELASTICSEARCH_HOSTS", "").split(","),
+        basic_auth=(os.getenv("ELASTICSEARCH_USER"), os.getenv("ELASTICSEARCH_PASSWORD")),
+        serializer=OrjsonSerializer(),
+        request_timeout=120,
+    )
+    checkpoint = Backfill(es, os.getenv("AZURE_OPENAI_KEY"), os.getenv("AZURE_OPENAI_ENDPOINT"), args).run()
+    print(orjson.dumps({key: value for key, value in checkpoint.items() if key not in ("pit_id", "search_after")}).decode())
+    return 0 if checkpoint["falhas"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
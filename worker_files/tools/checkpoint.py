@@ -0,0 +1,63 @@
+"""
+Checkpoint file and point in time handling shared by the index walks.
+
+A walk keeps its state in a JSON checkpoint (pit_id, search_after and its
+counters) written after every scroll page, so an interrupted run resumes
+where it stopped.
+"""
+import logging
+import os
+import orjson
+from elasticsearch import NotFoundError
+
+
+def load_checkpoint(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "rb") as f:
+        return orjson.loads(f.read())
+
+
+def save_checkpoint(path, checkpoint):
+    """Write the checkpoint atomically (a crash never leaves a truncated file)."""
+    if not path:
+        return
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(orjson.dumps(checkpoint, option=orjson.OPT_INDENT_2))
+    os.replace(temporary, path)
+
+
+def resume_pit(es, index, checkpoint, keep_alive, sort_fields=()):
+    """
+    Reuse the point in time of the checkpoint, or open a new one on `index`.
+
+    search_after values of the `_shard_doc` tiebreaker only hold within one
+    point in time, so when the checkpointed one has expired the position is
+    kept only if `sort_fields` identify the documents; otherwise the walk
+    restarts from the beginning.
+
+    Returns:
+        str: The point in time ID (also stored in `checkpoint`).
+    """
+    pit_id = checkpoint.get("pit_id")
+    if pit_id:
+        try:
+            # Renova o point in time salvo; falha se ele já expirou
+            es.search(body={"pit": {"id": pit_id, "keep_alive": keep_alive}, "size": 0})
+            return pit_id
+        except NotFoundError:
+            logging.warning("Checkpointed point in time expired.")
+            if not sort_fields:
+                logging.warning("Restarting the walk from the beginning.")
+                checkpoint["search_after"] = None
+    pit_id = es.open_point_in_time(index=index, keep_alive=keep_alive)["id"]
+    checkpoint["pit_id"] = pit_id
+    return pit_id
+
+
+def close_pit(es, pit_id):
+    try:
+        es.close_point_in_time(id=pit_id)
+    except Exception as e:
+        logging.warning(f"Could not close the point in time: {e}")
@@ -0,0 +1,204 @@
+"""
+Copy the document fields of gampes_textual onto its pages and vectors.
+
+The citations of an answer need id_documento_gampes and
+id_identificador_MNI, which live only in gampes_textual; `enhance_results`
+reads them with one get per result. This batch job writes those fields
+(PAGE_DOCUMENT_FIELDS) onto every gampes_textual_paginas document and onto
+its gampes_vector_small documents, so the page read of phase 5 already
+returns them and `enhance_results` makes no further requests.
+
+Every updated page also gets the marker DENORMALIZED_MARKER (the update
+time), which is always written even when the document lacks some field.
+Pages are walked with a point in time and search_after, filtered to the
+ones without the marker, so a re-run only touches pages created since the
+last one (new OCR pages); run it after every ingestion, e.g. from cron. For each
+scroll page, the documents are read with one mget and the pages and vectors
+are updated with `_bulk` partial updates. Progress is checkpointed like in
+tools.backfill_embeddings; since finished pages drop out of the filter,
+restarting the walk after the point in time expires repeats no work, and
+a run started after a finished one begins a new walk.
+
+Usage (from worker_files/):
+    python -m tools.denormalize_pages --checkpoint denormalize.json
+    python -m tools.denormalize_pages --checkpoint denormalize.json --force   # rewrite every page
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+import orjson
+from dotenv import load_dotenv
+from elasticsearch import Elasticsearch
+from elasticsearch.helpers import bulk
+from elasticsearch.serializer import OrjsonSerializer
+from src.elastic import PAGE_DOCUMENT_FIELDS
+from tools.checkpoint import close_pit, load_checkpoint, resume_pit, save_checkpoint
+
+load_dotenv()
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+INDEX_DOCUMENTS = "gampes_textual"
+INDEX_PAGES = "gampes_textual_paginas"
+INDEX_VECTORS = "gampes_vector_small"
+
+# Marca das páginas já processadas (nunca nula, ao contrário dos campos copiados)
+DENORMALIZED_MARKER = "desnormalizado_em"
+
+
+def put_mappings(es, indices):
+    """Map PAGE_DOCUMENT_FIELDS as keyword (instead of dynamic text) in `indices`."""
+    properties = {field: {"type": "keyword"} for field in PAGE_DOCUMENT_FIELDS}
+    properties[DENORMALIZED_MARKER] = {"type": "date"}
+    for index in indices:
+        try:
+            es.indices.put_mapping(index=index, properties=properties)
+        except Exception as e:
+            logging.warning(f"Could not map {', '.join(PAGE_DOCUMENT_FIELDS)} in {index}: {e}")
+
+
+def document_fields(es, ids_textual, index_documents=INDEX_DOCUMENTS):
+    """
+    Read PAGE_DOCUMENT_FIELDS of several gampes_textual documents with one mget.
+
+    Returns:
+        dict: id_textual -> fields, only for the documents found.
+    """
+    response = es.mget(index=index_documents, ids=list(ids_textual), source=list(PAGE_DOCUMENT_FIELDS))
+    return {
+        doc["_id"]: {field: doc["_source"].get(field) for field in PAGE_DOCUMENT_FIELDS}
+        for doc in response["docs"]
+        if doc.get("found")
+    }
+
+
+def vectors_by_page(es, page_ids, index_vectors=INDEX_VECTORS):
+    """
+    The vector documents of `page_ids`.
+
+    Returns:
+        list: (vector _id, id_pagina) pairs.
+    """
+    response = es.search(
+        index=index_vectors,
+        body={"query": {"terms": {"id_pagina": page_ids}}, "_source": ["id_pagina"], "size": len(page_ids) * 2},
+    )
+    return [(hit["_id"], hit["_source"]["id_pagina"]) for hit in response["hits"]["hits"]]
+
+
+class Denormalize:
+    """One run of the job: scroll state and counters."""
+
+    def __init__(self, es, args):
+        self.es = es
+        self.args = args
+        self.sort_fields = [field.strip() for field in (args.sort or "").split(",") if field.strip()]
+        self.checkpoint = load_checkpoint(args.checkpoint)
+        for counter in ("paginas", "vetores", "sem_documento", "falhas"):
+            self.checkpoint.setdefault(counter, 0)
+
+    def _scroll_page(self, pit_id):
+        body = {
+            "pit": {"id": pit_id, "keep_alive": self.args.keep_alive},
+            "size": self.args.page_size,
+            "_source": ["id_textual"],
+            "sort": [{field: "asc"} for field in self.sort_fields] + [{"_shard_doc": "asc"}],
+            "track_total_hits": False,
+        }
+        if not self.args.force:
+            body["query"] = {"bool": {"must_not": [{"exists": {"field": DENORMALIZED_MARKER}}]}}
+        if self.checkpoint.get("search_after") is not None:
+            body["search_after"] = self.checkpoint["search_after"]
+        return self.es.search(body=body)
+
+    def _update(self, index, updates):
+        """Bulk partial updates of (_id, fields); returns how many succeeded."""
+        if not updates or self.args.dry_run:
+            return len(updates)
+        actions = ({"_op_type": "update", "_index": index, "_id": doc_id, "doc": fields} for doc_id, fields in updates)
+        updated, errors = bulk(self.es, actions, chunk_size=self.args.bulk_size, raise_on_error=False)
+        self.checkpoint["falhas"] += len(errors)
+        return updated
+
+    def _process(self, hits):
+        page_textual = {hit["_id"]: (hit.get("_source") or {}).get("id_textual") for hit in hits}
+        fields = document_fields(self.es, {id_textual for id_textual in page_textual.values() if id_textual}, self.args.index_documents)
+
+        page_updates = []
+        marker = {DENORMALIZED_MARKER: time.strftime("%Y-%m-%dT%H:%M:%S")}
+        for page_id, id_textual in page_textual.items():
+            if id_textual in fields:
+                page_updates.append((page_id, {**fields[id_textual], **marker}))
+            else:
+                self.checkpoint["sem_documento"] += 1
+        self.checkpoint["paginas"] += self._update(self.args.index_pages, page_updates)
+
+        page_fields = dict(page_updates)
+        vectors = vectors_by_page(self.es, list(page_fields), self.args.index_vectors) if page_fields else []
+        self.checkpoint["vetores"] += self._update(self.args.index_vectors, [(vector_id, page_fields[page_id]) for vector_id, page_id in vectors])
+
+    def run(self):
+        if self.checkpoint.get("concluido"):
+            # Execução anterior terminou: nova varredura, que só encontra as páginas criadas desde então
+            logging.info("Previous run finished; looking for new pages.")
+            self.checkpoint = {counter: 0 for counter in ("paginas", "vetores", "sem_documento", "falhas")}
+        if not self.args.dry_run:
+            put_mappings(self.es, (self.args.index_pages, self.args.index_vectors))
+        pit_id = resume_pit(self.es, self.args.index_pages, self.checkpoint, self.args.keep_alive, self.sort_fields)
+        lidas = 0
+        try:
+            while True:
+                response = self._scroll_page(pit_id)
+                pit_id = response.get("pit_id", pit_id)
+                hits = response["hits"]["hits"]
+                if not hits:
+                    self.checkpoint["concluido"] = True
+                    break
+                self._process(hits)
+                lidas += len(hits)
+                self.checkpoint.update(pit_id=pit_id, search_after=hits[-1]["sort"], atualizado_em=time.strftime("%Y-%m-%dT%H:%M:%S"))
+                save_checkpoint(self.args.checkpoint, self.checkpoint)
+                logging.info(
+                    f"{self.checkpoint['paginas']} pages and {self.checkpoint['vetores']} vectors updated, "
+                    f"{self.checkpoint['sem_documento']} pages without document, {self.checkpoint['falhas']} failed"
+                )
+                if self.args.limit and lidas >= self.args.limit:
+                    break
+        finally:
+            save_checkpoint(self.args.checkpoint, self.checkpoint)
+        if self.checkpoint.get("concluido"):
+            close_pit(self.es, pit_id)
+        return self.checkpoint
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Copy fonte, id_documento_gampes and id_identificador_MNI of gampes_textual onto its pages and vectors.")
+    parser.add_argument("--checkpoint", default="denormalize_pages.json", help="Progress file; an existing one is resumed.")
+    parser.add_argument("--page-size", type=int, default=1000, help="Pages read per search_after request.")
+    parser.add_argument("--bulk-size", type=int, default=1000, help="Updates per _bulk request.")
+    parser.add_argument("--keep-alive", default="10m", help="Point in time keep alive between requests.")
+    parser.add_argument("--sort", help="Fields identifying a page (e.g. id_textual,pagina), to resume from the checkpoint after the point in time expires.")
+    parser.add_argument("--force", action="store_true", help="Also rewrite pages that already have the fields (e.g. after a document changed).")
+    parser.add_argument("--limit", type=int, help="Stop after reading this many pages.")
+    parser.add_argument("--index-documents", default=INDEX_DOCUMENTS)
+    parser.add_argument("--index-pages", default=INDEX_PAGES)
+    parser.add_argument("--index-vectors", default=INDEX_VECTORS)
+    parser.add_argument("--dry-run", action="store_true", help="Read and count, without writing.")
+    args = parser.parse_args(argv)
+
+    es = Elasticsearch(
+        os.getenv("ELASTICSEARCH_HOSTS", "").split(","),
+        basic_auth=(os.getenv("ELASTICSEARCH_USER"), os.getenv("ELASTICSEARCH_PASSWORD")),
+        serializer=OrjsonSerializer(),
+        request_timeout=120,
+    )
+    checkpoint = Denormalize(es, args).run()
+    print(orjson.dumps({key: value for key, value in checkpoint.items() if key not in ("pit_id", "search_after")}).decode())
+    return 0 if checkpoint["falhas"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())